@@ -0,0 +1,71 @@
+# File: cryonix/benchmarks/compare_results.py
+
+# Compares two run_suite.py result files metric by metric. Numbers are
+# matched by their path in the JSON (list entries by their mode/sync_mode
+# labels where they have them); anything that moved by more than
+# --threshold percent is printed with the ratio new/old.
+
+import argparse
+import json
+
+LABEL_KEYS = ('mode', 'sync_mode', 'name')
+
+def flatten(value, prefix: str = '', out=None) -> dict:
+    out = {} if out is None else out
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flatten(item, f'{prefix}.{key}' if prefix else key, out)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            label = '/'.join(str(item[key]) for key in LABEL_KEYS if isinstance(item, dict) and key in item)
+            flatten(item, f'{prefix}[{label or index}]', out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark suite results')
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=5.0, help='Only show changes above this many percent')
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    for label, data in (('old', old), ('new', new)):
+        git = data.get('git') or {}
+        print(f"{label}: {data.get('taken_at')} {git.get('commit') or '?'}{' (dirty)' if git.get('dirty') else ''}")
+    if old.get('host') != new.get('host'):
+        print('warning: results were taken on different hosts')
+    print()
+
+    old_metrics = flatten(old.get('benchmarks', {}))
+    new_metrics = flatten(new.get('benchmarks', {}))
+    rows = []
+    for key in sorted(old_metrics.keys() & new_metrics.keys()):
+        before, after = old_metrics[key], new_metrics[key]
+        if before == after:
+            continue
+        if before:
+            change = (after - before) / abs(before) * 100
+            if abs(change) < args.threshold:
+                continue
+            ratio = f'{after / before:.2f}x'
+        else:
+            ratio = 'new'
+        rows.append((key, before, after, ratio))
+
+    width = max((len(row[0]) for row in rows), default=0)
+    for key, before, after, ratio in rows:
+        print(f'{key:<{width}}  {before:>12}  {after:>12}  {ratio:>7}')
+
+    for label, keys in (('only in old', old_metrics.keys() - new_metrics.keys()),
+                        ('only in new', new_metrics.keys() - old_metrics.keys())):
+        if keys:
+            print(f'\n{label}: {len(keys)} metrics')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# File: cryonix/benchmarks/epg_api_load.py
+
+# Fires concurrent GET requests at a running EPG sync service and reports
+# latency percentiles and throughput. Run it once against a service started
+# with EPG_DB_POOL=1 and once with EPG_DB_POOL=0 to compare the pooled and
+# connection-per-request paths.
+
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+async def worker(session, url, queue, latencies, errors):
+    while True:
+        try:
+            queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+
+        started = time.perf_counter()
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+        except aiohttp.ClientError as e:
+            errors.append(str(e))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+async def run(base_url, path, requests, concurrency):
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    latencies = []
+    errors = []
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*[
+            worker(session, base_url + path, queue, latencies, errors)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - started
+
+        pool_stats = None
+        try:
+            async with session.get(base_url + '/epg/db/pool') as response:
+                if response.status == 200:
+                    pool_stats = await response.json()
+        except aiohttp.ClientError:
+            pass
+
+    return {
+        'path': path,
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(requests / elapsed, 1),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2) if latencies else 0.0
+        },
+        'pool': pool_stats
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the EPG sync service read endpoints')
+    parser.add_argument('--url', default='http://127.0.0.1:8001')
+    parser.add_argument('--path', action='append', help='Endpoint path, may be repeated (default /epg/sources)')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    results = [
+        asyncio.run(run(args.url.rstrip('/'), path, args.requests, args.concurrency))
+        for path in (args.path or ['/epg/sources'])
+    ]
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# File: cryonix/benchmarks/epg_bulk_write.py
+
+# Compares the per-row INSERT loop with the bulk executemany() writer against a
+# scratch MySQL/MariaDB database. Point it at a local throwaway server:
+#   BENCH_DB_HOST=127.0.0.1 BENCH_DB_USERNAME=root python benchmarks/epg_bulk_write.py
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'epg_sync'))
+
+import mysql.connector
+
+from epg_writer import EPGWriter
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS epg_sources (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        url VARCHAR(255) NOT NULL,
+        type ENUM('xmltv', 'xtream') NOT NULL,
+        last_sync DATETIME NULL,
+        is_active TINYINT(1) NOT NULL DEFAULT 1,
+        generation INT UNSIGNED NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NULL,
+        updated_at TIMESTAMP NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS epg_channels (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        source_id BIGINT UNSIGNED NOT NULL,
+        channel_id VARCHAR(255) NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        icon VARCHAR(255) NULL,
+        generation INT UNSIGNED NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NULL,
+        updated_at TIMESTAMP NULL,
+        INDEX (source_id, channel_id),
+        INDEX (source_id, generation)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS epg_programmes (
+        id BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+        source_id BIGINT UNSIGNED NOT NULL,
+        channel_id VARCHAR(255) NOT NULL,
+        start_time DATETIME NOT NULL,
+        stop_time DATETIME NOT NULL,
+        title VARCHAR(255) NOT NULL,
+        description TEXT NULL,
+        category VARCHAR(255) NULL,
+        content_hash CHAR(32) NULL,
+        generation INT UNSIGNED NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NULL,
+        updated_at TIMESTAMP NULL,
+        INDEX (channel_id, start_time),
+        INDEX (source_id, start_time),
+        INDEX (source_id, generation)
+    )
+    """
+]
+
+def db_config() -> dict:
+    return {
+        'host': os.getenv('BENCH_DB_HOST', '127.0.0.1'),
+        'database': os.getenv('BENCH_DB_DATABASE', 'cryonix_bench'),
+        'user': os.getenv('BENCH_DB_USERNAME', 'root'),
+        'password': os.getenv('BENCH_DB_PASSWORD', ''),
+        'port': int(os.getenv('BENCH_DB_PORT', '3306'))
+    }
+
+def prepare_database() -> int:
+    config = db_config()
+    database = config.pop('database')
+
+    connection = mysql.connector.connect(**config)
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+    cursor.execute(f"USE `{database}`")
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cursor.execute("""
+        INSERT INTO epg_sources (name, url, type, created_at, updated_at)
+        VALUES ('bench', 'http://bench.invalid/epg.xml', 'xmltv', NOW(), NOW())
+    """)
+    source_id = cursor.lastrowid
+    connection.commit()
+    cursor.close()
+    connection.close()
+    return source_id
+
+def synthetic_guide(channels: int, programmes_per_channel: int):
+    start = datetime(2024, 1, 1)
+    channel_rows = [{'id': f'ch{c}.bench', 'name': f'Bench Channel {c}', 'icon': None} for c in range(channels)]
+    programme_rows = [
+        {
+            'channel_id': f'ch{c}.bench',
+            'start_time': start + timedelta(minutes=30 * p),
+            'stop_time': start + timedelta(minutes=30 * (p + 1)),
+            'title': f'Show {c}-{p}',
+            'description': f'Episode {p} of a synthetic benchmark programme on channel {c}.',
+            'category': 'Bench'
+        }
+        for c in range(channels)
+        for p in range(programmes_per_channel)
+    ]
+    return channel_rows, programme_rows
+
+def run(source_id: int, channels, programmes, bulk: bool, batch_size: int) -> dict:
+    connection = mysql.connector.connect(**db_config())
+    writer = EPGWriter(connection, source_id, bulk=bulk, batch_size=batch_size)
+    started = time.perf_counter()
+    try:
+        writer.begin()
+        writer.write_batch(channels, programmes)
+        writer.finish()
+    finally:
+        writer.close()
+        connection.close()
+    elapsed = time.perf_counter() - started
+
+    rows = len(channels) + len(programmes)
+    return {
+        'mode': 'bulk' if bulk else 'per_row',
+        'batch_size': batch_size if bulk else None,
+        'rows': rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'commits': writer.commits
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-row vs bulk EPG writes')
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--programmes-per-channel', type=int, default=336)
+    parser.add_argument('--batch-sizes', default='500,1000,5000')
+    parser.add_argument('--skip-per-row', action='store_true')
+    args = parser.parse_args()
+
+    source_id = prepare_database()
+    channels, programmes = synthetic_guide(args.channels, args.programmes_per_channel)
+
+    results = []
+    if not args.skip_per_row:
+        results.append(run(source_id, channels, programmes, bulk=False, batch_size=1))
+    for batch_size in (int(size) for size in args.batch_sizes.split(',')):
+        results.append(run(source_id, channels, programmes, bulk=True, batch_size=batch_size))
+
+    baseline = next((r for r in results if r['mode'] == 'per_row'), None)
+    if baseline:
+        for result in results:
+            result['speedup'] = round(result['rows_per_sec'] / baseline['rows_per_sec'], 2)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
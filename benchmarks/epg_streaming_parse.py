@@ -0,0 +1,106 @@
+# File: cryonix/benchmarks/epg_streaming_parse.py
+
+# Compares the whole-document XMLTV parse with the streaming parser.
+# Each mode runs in its own interpreter so peak RSS is measured in isolation.
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'epg_sync'))
+
+from xmltv_generator import write_xmltv
+
+CHUNK_SIZE = 65536
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_document(path: str) -> dict:
+    from xmltv_parser import parse_xmltv_document
+
+    started = time.perf_counter()
+    with open(path, encoding='utf-8') as f:
+        content = f.read()
+    channels, programmes = parse_xmltv_document(content)
+    elapsed = time.perf_counter() - started
+
+    return {'channels': len(channels), 'programmes': len(programmes), 'seconds': elapsed}
+
+def run_streaming(path: str, batch_size: int) -> dict:
+    from xmltv_parser import XMLTVStreamParser
+
+    parser = XMLTVStreamParser(batch_size=batch_size)
+    batches = 0
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            batches += len(parser.feed(chunk))
+    batches += len(parser.close())
+    elapsed = time.perf_counter() - started
+
+    return {
+        'channels': parser.channels_count,
+        'programmes': parser.programmes_count,
+        'batches': batches,
+        'seconds': elapsed
+    }
+
+def run_child(mode: str, path: str, batch_size: int) -> dict:
+    output = subprocess.check_output([
+        sys.executable, os.path.abspath(__file__), '--child', mode, '--input', path,
+        '--batch-size', str(batch_size)
+    ])
+    return json.loads(output)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark streaming vs whole-document XMLTV parsing')
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--input', help='Existing XMLTV file to use instead of a generated one')
+    parser.add_argument('--child', choices=['document', 'streaming'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.child == 'document':
+            result = run_document(args.input)
+        else:
+            result = run_streaming(args.input, args.batch_size)
+        result['peak_rss_mb'] = peak_rss_mb()
+        result['programmes_per_sec'] = result['programmes'] / result['seconds'] if result['seconds'] else 0
+        print(json.dumps(result))
+        return
+
+    path = args.input
+    cleanup = False
+    if not path:
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        cleanup = True
+        write_xmltv(path, args.channels, args.days)
+
+    try:
+        results = {
+            'input_bytes': os.path.getsize(path),
+            'document': run_child('document', path, args.batch_size),
+            'streaming': run_child('streaming', path, args.batch_size)
+        }
+    finally:
+        if cleanup:
+            os.unlink(path)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
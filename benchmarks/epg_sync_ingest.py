@@ -0,0 +1,203 @@
+# File: cryonix/benchmarks/epg_sync_ingest.py
+
+# End-to-end XMLTV ingest through EPGSyncService (download side excluded):
+# parse, time conversion, diff/bulk writer and index refresh, for the
+# streaming and whole-document modes. MySQL is replaced by an in-memory sink
+# that renders every statement with its parameters the way the driver would,
+# so this runs offline and tracks the cost of our code, not of the server
+# (use epg_bulk_write.py against a scratch database for that). Each mode runs
+# in its own interpreter so peak RSS is measured in isolation.
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(BENCH_DIR, '..', 'services', 'epg_sync')
+
+from xmltv_generator import write_xmltv
+
+CHUNK_SIZE = 65536
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def literal(value) -> str:
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, datetime):
+        return f"'{value:%Y-%m-%d %H:%M:%S}'"
+    return "'" + str(value).replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+class SinkCursor:
+    def __init__(self, sink: 'SinkStats'):
+        self.sink = sink
+        self.rowcount = 0
+
+    def execute(self, sql: str, params=None):
+        self.sink.statements += 1
+        self.sink.sql_bytes += len(sql % tuple(literal(value) for value in params) if params else sql)
+        self.rowcount = 0
+
+    def executemany(self, sql: str, rows):
+        # One multi-row INSERT, as mysql-connector rewrites it
+        head, _, values = sql.partition('VALUES')
+        rendered = [values.strip() % tuple(literal(value) for value in row) for row in rows]
+        self.sink.statements += 1
+        self.sink.rows += len(rows)
+        self.sink.sql_bytes += len(head) + sum(len(part) + 1 for part in rendered)
+        self.rowcount = len(rows)
+
+    def fetchall(self):
+        return []
+
+    def fetchone(self):
+        return None
+
+    def __iter__(self):
+        return iter(())
+
+    def close(self):
+        pass
+
+class SinkConnection:
+    in_transaction = False
+
+    def __init__(self, sink: 'SinkStats'):
+        self.sink = sink
+
+    def cursor(self, **kwargs):
+        return SinkCursor(self.sink)
+
+    def commit(self):
+        self.sink.commits += 1
+
+    def rollback(self):
+        pass
+
+    def ping(self, **kwargs):
+        pass
+
+    def close(self):
+        pass
+
+class SinkStats:
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.commits = 0
+        self.sql_bytes = 0
+
+    def to_dict(self) -> dict:
+        return {'statements': self.statements, 'rows': self.rows, 'commits': self.commits,
+                'sql_mb': round(self.sql_bytes / 1048576, 1)}
+
+async def file_chunks(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+async def run_ingest(path: str) -> dict:
+    sys.path.insert(0, SERVICE_DIR)
+    from db_pool import DBPool
+    from main import EPGSyncService
+
+    sink = SinkStats()
+
+    class SinkPool(DBPool):
+        async def _connect(self):
+            self._size += 1
+            self.stats_counters['created'] += 1
+            return SinkConnection(sink)
+
+    service = EPGSyncService()
+    service.db_pool = SinkPool({}, min_size=1, max_size=2)
+    await service.db_pool.open()
+    await service.epg_index.start()
+    try:
+        started = time.perf_counter()
+        result = await service.ingest_chunks(1, file_chunks(path))
+        elapsed = time.perf_counter() - started
+    finally:
+        await service.epg_index.stop()
+        await service.close()
+
+    programmes = result['programmes_count']
+    return {
+        'channels': result['channels_count'],
+        'programmes': programmes,
+        'seconds': round(elapsed, 3),
+        'programmes_per_sec': round(programmes / elapsed) if elapsed else 0,
+        'write': result.get('write_stats'),
+        'sink': sink.to_dict()
+    }
+
+def run_child(mode: str, sync_mode: str, path: str, batch_size: int) -> dict:
+    # The service reads its configuration from the environment at import time
+    env = dict(os.environ, EPG_STREAMING_PARSE='1' if mode == 'streaming' else '0', EPG_SYNC_MODE=sync_mode,
+               EPG_PARSE_BATCH_SIZE=str(batch_size), EPG_DOWNLOAD_CACHE='0', EPG_SCHEDULER_ENABLED='0')
+    workdir = tempfile.mkdtemp(prefix='cryonix-epg-bench-')
+    try:
+        output = subprocess.check_output([
+            sys.executable, os.path.abspath(__file__), '--child', '--input', os.path.abspath(path)
+        ], env=env, cwd=workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'mode': mode, 'sync_mode': sync_mode, **json.loads(output)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark XMLTV ingest through EPGSyncService, offline')
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--modes', default='streaming,document')
+    parser.add_argument('--sync-modes', default='incremental,full')
+    parser.add_argument('--input', help='Existing XMLTV file to use instead of a generated one')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run_ingest(args.input))
+        result['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        print(json.dumps(result))
+        return
+
+    path = args.input
+    cleanup = False
+    if not path:
+        fd, path = tempfile.mkstemp(suffix='.xml')
+        os.close(fd)
+        cleanup = True
+        write_xmltv(path, args.channels, args.days)
+
+    try:
+        results = {
+            'input_bytes': os.path.getsize(path),
+            'runs': [
+                run_child(mode, sync_mode, path, args.batch_size)
+                for mode in args.modes.split(',')
+                for sync_mode in args.sync_modes.split(',')
+            ]
+        }
+    finally:
+        if cleanup:
+            os.unlink(path)
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# File: cryonix/benchmarks/fake_ffmpeg.py
+
+# Stand-in for ffmpeg/ffprobe so the stream manager can be benchmarked with
+# no media, network or encoder. Behaviour is picked by the input URL:
+#   fake://live                  progress every stats period, runs until killed
+#   fake://exit?after=2&code=1   exits after 2s with code 1
+#   fake://stall?after=2         stops reporting progress after 2s, keeps running
+#   fake://dead                  ffprobe fails, ffmpeg exits at once
+# marker=<path> writes the wall-clock time of the exit/stall to <path>.
+
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ S..... = Subtitle
+ ------
+ V..... libx264              libx264 H.264 / AVC / MPEG-4 AVC (codec h264)
+ V..... libx265              libx265 H.265 / HEVC (codec hevc)
+ A..... aac                  AAC (Advanced Audio Coding)
+ A..... libmp3lame           libmp3lame MP3 (MPEG audio layer 3) (codec mp3)
+"""
+
+PROBE = {
+    'streams': [
+        {'codec_type': 'video', 'codec_name': 'h264', 'profile': 'High', 'width': 1920, 'height': 1080,
+         'pix_fmt': 'yuv420p', 'avg_frame_rate': '25/1', 'bit_rate': '3500000'},
+        {'codec_type': 'audio', 'codec_name': 'aac', 'sample_rate': '48000', 'channels': 2, 'bit_rate': '128000'}
+    ],
+    'format': {'format_name': 'mpegts', 'bit_rate': '3700000'}
+}
+
+def write(stream, text: str):
+    # Like ffmpeg, a closed log/progress pipe is not fatal
+    try:
+        stream.write(text)
+        stream.flush()
+    except (OSError, ValueError):
+        pass
+
+def option(argv, name: str, default=None):
+    return argv[argv.index(name) + 1] if name in argv[:-1] else default
+
+def mark(params):
+    if 'marker' in params:
+        with open(params['marker'][0], 'w') as f:
+            f.write(repr(time.time()))
+
+def ffprobe(url: str) -> int:
+    if url.startswith('fake://dead'):
+        write(sys.stderr, f"{url}: Connection refused\n")
+        return 1
+    write(sys.stdout, json.dumps(PROBE))
+    return 0
+
+def ffmpeg(argv, url: str) -> int:
+    parsed = urlparse(url)
+    params = parse_qs(parsed.query)
+    behaviour = parsed.netloc
+    after = float(params.get('after', ['0'])[0])
+    progress = option(argv, '-progress') == 'pipe:1'
+    period = float(option(argv, '-stats_period', '1'))
+
+    write(sys.stderr, "ffmpeg version 6.0-fake Copyright (c) 2000-2023 the FFmpeg developers\n"
+                      f"Input #0, mpegts, from '{url}':\n"
+                      "  Stream #0:0: Video: h264 (High), yuv420p, 1920x1080, 25 fps\n"
+                      "  Stream #0:1: Audio: aac (LC), 48000 Hz, stereo, fltp, 128 kb/s\n")
+    if behaviour == 'dead':
+        write(sys.stderr, f"{url}: Connection refused\n")
+        return 1
+
+    started = time.time()
+    block = 0
+    while True:
+        elapsed = time.time() - started
+        if behaviour == 'exit' and elapsed >= after:
+            mark(params)
+            write(sys.stderr, f"{url}: End of file\n")
+            return int(params.get('code', ['1'])[0])
+        if behaviour == 'stall' and elapsed >= after:
+            mark(params)
+            # Hung upstream: no progress and no output, until killed
+            while True:
+                time.sleep(3600)
+
+        block += 1
+        if progress:
+            write(sys.stdout, f"frame={block * 25}\nfps=25.00\nstream_0_0_q=-1.0\nbitrate=3700.0kbits/s\n"
+                              f"total_size={block * 462500}\nout_time_us={block * 1000000}\n"
+                              f"out_time_ms={block * 1000000}\nout_time=00:00:{block % 60:02d}.000000\n"
+                              f"dup_frames=0\ndrop_frames=0\nspeed=1.00x\nprogress=continue\n")
+        write(sys.stderr, f"[mpegts @ 0x5581] Opening 'segment-{block}.ts' for writing\n")
+        time.sleep(period)
+
+def main() -> int:
+    argv = sys.argv[1:]
+    if '-version' in argv:
+        write(sys.stdout, "ffmpeg version 6.0-fake Copyright (c) 2000-2023 the FFmpeg developers\n")
+        return 0
+    if '-encoders' in argv:
+        write(sys.stdout, ENCODERS)
+        return 0
+
+    url = option(argv, '-i') or (argv[-1] if argv else '')
+    if '-show_streams' in argv:
+        return ffprobe(url)
+    return ffmpeg(argv, url)
+
+def install(directory: str) -> dict:
+    # Executable ffmpeg/ffprobe wrappers in directory, for FFMPEG_PATH/FFPROBE_PATH
+    paths = {}
+    for name in ('ffmpeg', 'ffprobe'):
+        path = os.path.join(directory, name)
+        with open(path, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.abspath(__file__)}" "$@"\n')
+        os.chmod(path, 0o755)
+        paths[name] = path
+    return paths
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+# File: cryonix/benchmarks/run_suite.py
+
+# Runs every benchmark that needs no database or running service and
+# collects the results, with the commit and host they were taken on, into
+# one JSON document. Save runs with --output and diff two of them with
+# compare_results.py.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (script, full-size args, --quick args)
+SUITE = {
+    'xmltv_time_parse': ('xmltv_time_parse.py', [], ['--unique', '20000', '--channels', '50', '--days', '2']),
+    'epg_streaming_parse': ('epg_streaming_parse.py', [], ['--channels', '50', '--days', '2']),
+    'epg_sync_ingest': ('epg_sync_ingest.py', [], ['--channels', '50', '--days', '2']),
+    'stream_manager_api': ('stream_manager_api.py', [],
+                           ['--streams', '20', '--concurrency', '10', '--status-requests', '200', '--monitor-streams', '2'])
+}
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            return subprocess.check_output(['git', *args], cwd=BENCH_DIR, stderr=subprocess.DEVNULL, text=True).strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    status = git('status', '--porcelain')
+    return {'commit': git('rev-parse', 'HEAD'), 'branch': git('rev-parse', '--abbrev-ref', 'HEAD'),
+            'dirty': bool(status) if status is not None else None}
+
+def run_bench(script: str, args) -> dict:
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, os.path.join(BENCH_DIR, script), *args],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    elapsed = round(time.perf_counter() - started, 1)
+    if process.returncode != 0:
+        lines = process.stderr.strip().splitlines()
+        return {'error': lines[-1] if lines else f'exited with code {process.returncode}', 'wall_seconds': elapsed}
+    return {'result': json.loads(process.stdout), 'wall_seconds': elapsed}
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the offline benchmark suite')
+    parser.add_argument('--only', help=f"Comma-separated subset of: {', '.join(SUITE)}")
+    parser.add_argument('--quick', action='store_true', help='Small inputs, for a smoke run')
+    parser.add_argument('--output', help='Write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    names = args.only.split(',') if args.only else list(SUITE)
+    unknown = [name for name in names if name not in SUITE]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)}")
+
+    results = {
+        'taken_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'quick': args.quick,
+        'git': git_revision(),
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count()
+        },
+        'benchmarks': {}
+    }
+    for name in names:
+        script, full_args, quick_args = SUITE[name]
+        print(f"Running {name}...", file=sys.stderr)
+        results['benchmarks'][name] = run_bench(script, quick_args if args.quick else full_args)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
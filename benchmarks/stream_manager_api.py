@@ -0,0 +1,247 @@
+# File: cryonix/benchmarks/stream_manager_api.py
+
+# Runs the stream manager against fake_ffmpeg (no media, network or
+# encoders needed) and measures:
+#   - API latency for N concurrent /stream/start calls, then /stream/status,
+#     /streams/list and /streams/metrics under load, and the batch stop
+#   - time from start request to first output, as reported by the service
+#   - how long the supervisor takes to notice a crashed and a stalled stream
+# The service runs in its own uvicorn process in a scratch directory.
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.join(BENCH_DIR, '..', 'services', 'stream_manager')
+
+sys.path.insert(0, BENCH_DIR)
+
+import fake_ffmpeg
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+def latency_summary(latencies, errors, elapsed) -> dict:
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_sec': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2) if latencies else 0.0
+        }
+    }
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_service(workdir: str, port: int, args) -> subprocess.Popen:
+    paths = fake_ffmpeg.install(workdir)
+    env = dict(
+        os.environ,
+        FFMPEG_PATH=paths['ffmpeg'],
+        FFPROBE_PATH=paths['ffprobe'],
+        REGISTRY_PATH=os.path.join(workdir, 'stream_registry.db'),
+        DETACH_ON_SHUTDOWN='false',
+        MAX_STREAMS=str(args.streams + args.monitor_streams * 2 + 10),
+        STATS_PERIOD=str(args.stats_period),
+        HEALTH_CHECK_INTERVAL=str(args.check_interval),
+        STALL_TIMEOUT=str(args.stall_timeout),
+        RESTART_BACKOFF_BASE='1',
+        SPAWN_RATE=str(args.spawn_rate),
+        SPAWN_BURST=str(args.spawn_burst),
+        MAX_CONCURRENT_STARTS=str(args.max_concurrent_starts)
+    )
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', os.path.abspath(SERVICE_DIR),
+         '--host', '127.0.0.1', '--port', str(port), '--log-level', 'warning'],
+        cwd=workdir, env=env
+    )
+
+async def wait_ready(session, base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(base_url + '/streams/capacity') as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError('Stream manager did not come up')
+
+async def timed_requests(session, calls, concurrency: int) -> dict:
+    # calls: (method, url, json body) tuples, run concurrency at a time
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = []
+
+    async def one(method, url, body):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, json=body) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors.append(response.status)
+            except aiohttp.ClientError as e:
+                errors.append(str(e))
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*call) for call in calls))
+    return latency_summary(latencies, errors, time.perf_counter() - started)
+
+async def get_json(session, url: str):
+    async with session.get(url) as response:
+        return await response.json()
+
+async def api_latency(session, base_url: str, args) -> dict:
+    stream_ids = [f'bench{i}' for i in range(args.streams)]
+    starts = [
+        ('POST', base_url + '/stream/start', {
+            'stream_id': stream_id,
+            'input_url': 'fake://live',
+            'output_url': f'/dev/null/{stream_id}',
+            'profile': args.profile
+        })
+        for stream_id in stream_ids
+    ]
+    results = {'start': await timed_requests(session, starts, args.concurrency)}
+
+    # Let every stream report progress before measuring the read paths
+    await asyncio.sleep(max(2, args.stats_period * 3))
+    statuses = [('GET', f'{base_url}/stream/status/{stream_ids[i % len(stream_ids)]}', None)
+                for i in range(args.status_requests)]
+    results['status'] = await timed_requests(session, statuses, args.concurrency)
+    results['list'] = await timed_requests(session, [('GET', base_url + '/streams/list', None)] * 20, 4)
+    results['metrics'] = await timed_requests(session, [('GET', base_url + '/streams/metrics', None)] * 20, 4)
+
+    capacity = await get_json(session, base_url + '/streams/capacity')
+    results['time_to_first_output'] = capacity.get('time_to_first_output')
+    results['input_probe'] = capacity.get('input_probe')
+
+    started = time.perf_counter()
+    async with session.post(base_url + '/streams/stop-batch', json={'stream_ids': stream_ids}) as response:
+        stopped = await response.json()
+    results['stop_batch'] = {'seconds': round(time.perf_counter() - started, 3), 'stopped': stopped.get('succeeded')}
+    return results
+
+async def wait_for_detection(session, base_url: str, stream_ids, reason_prefix: str, timeout: float) -> dict:
+    # Polls /streams/list until the supervisor has recorded a failure for each stream
+    seen = {}
+    deadline = time.monotonic() + timeout
+    while len(seen) < len(stream_ids) and time.monotonic() < deadline:
+        now = time.time()
+        for stream in await get_json(session, base_url + '/streams/list'):
+            reason = stream.get('last_exit_reason') or ''
+            if stream['stream_id'] in stream_ids and stream['stream_id'] not in seen and reason.startswith(reason_prefix):
+                seen[stream['stream_id']] = now
+        await asyncio.sleep(0.05)
+    return seen
+
+async def detection_latency(session, base_url: str, workdir: str, kind: str, args) -> dict:
+    stream_ids = [f'{kind}{i}' for i in range(args.monitor_streams)]
+    markers = {stream_id: os.path.join(workdir, f'{stream_id}.marker') for stream_id in stream_ids}
+    for stream_id in stream_ids:
+        async with session.post(base_url + '/stream/start', json={
+            'stream_id': stream_id,
+            'input_url': f'fake://{kind}?after={args.fail_after}&marker={markers[stream_id]}',
+            'output_url': f'/dev/null/{stream_id}',
+            'profile': args.profile
+        }) as response:
+            await response.read()
+
+    reason_prefix = 'stalled' if kind == 'stall' else 'exited'
+    seen = await wait_for_detection(session, base_url, stream_ids, reason_prefix,
+                                    args.fail_after + args.stall_timeout + args.check_interval * 3 + 10)
+
+    latencies = []
+    for stream_id, detected_at in seen.items():
+        with open(markers[stream_id]) as f:
+            failed_at = float(f.read())
+        latencies.append((detected_at - failed_at) * 1000)
+
+    async with session.post(base_url + '/streams/stop-batch', json={'stream_ids': stream_ids}) as response:
+        await response.read()
+
+    return {
+        'streams': len(stream_ids),
+        'detected': len(seen),
+        # Stalls can't be flagged before stall_timeout has passed
+        'expected_floor_ms': args.stall_timeout * 1000 if kind == 'stall' else 0,
+        'check_interval_ms': args.check_interval * 1000,
+        'latency_ms': {
+            'avg': round(sum(latencies) / len(latencies), 1) if latencies else None,
+            'p50': round(percentile(latencies, 50), 1),
+            'max': round(max(latencies), 1) if latencies else None
+        }
+    }
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='cryonix-sm-bench-')
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    service = start_service(workdir, port, args)
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency + 4)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, base_url)
+            results = {
+                'streams': args.streams,
+                'concurrency': args.concurrency,
+                'api': await api_latency(session, base_url, args)
+            }
+            if args.monitor_streams:
+                results['monitor'] = {
+                    'crash': await detection_latency(session, base_url, workdir, 'exit', args),
+                    'stall': await detection_latency(session, base_url, workdir, 'stall', args)
+                }
+            return results
+    finally:
+        service.terminate()
+        try:
+            service.wait(30)
+        except subprocess.TimeoutExpired:
+            service.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stream manager API and supervisor offline')
+    parser.add_argument('--streams', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--status-requests', type=int, default=1000)
+    parser.add_argument('--profile', default='high')
+    parser.add_argument('--stats-period', type=float, default=0.5)
+    parser.add_argument('--spawn-rate', type=float, default=50)
+    parser.add_argument('--spawn-burst', type=int, default=50)
+    parser.add_argument('--max-concurrent-starts', type=int, default=50)
+    parser.add_argument('--monitor-streams', type=int, default=5, help='Streams per failure kind; 0 skips the monitor runs')
+    parser.add_argument('--check-interval', type=int, default=1)
+    parser.add_argument('--stall-timeout', type=float, default=3)
+    parser.add_argument('--fail-after', type=float, default=1.5)
+    args = parser.parse_args()
+
+    print(json.dumps(asyncio.run(run(args)), indent=2))
+
+if __name__ == '__main__':
+    main()
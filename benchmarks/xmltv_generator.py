@@ -0,0 +1,54 @@
+# File: cryonix/benchmarks/xmltv_generator.py
+
+import argparse
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+def iter_xmltv(channels: int = 100, days: int = 7, slot_minutes: int = 30,
+               start: datetime = None, offset: str = '+0000'):
+    # Yields a synthetic XMLTV guide in chunks so large guides never sit in memory
+    start = start or datetime(2024, 1, 1)
+    slots = days * 24 * 60 // slot_minutes
+
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<tv generator-info-name="cryonix-bench">\n'
+
+    for c in range(channels):
+        yield (f'  <channel id="ch{c}.bench">\n'
+               f'    <display-name>Bench Channel {c}</display-name>\n'
+               f'    <icon src="http://logos.example/ch{c}.png"/>\n'
+               f'  </channel>\n')
+
+    for c in range(channels):
+        parts = []
+        for s in range(slots):
+            begin = start + timedelta(minutes=s * slot_minutes)
+            end = begin + timedelta(minutes=slot_minutes)
+            parts.append(
+                f'  <programme start="{begin:%Y%m%d%H%M%S} {offset}" stop="{end:%Y%m%d%H%M%S} {offset}" channel="ch{c}.bench">\n'
+                f'    <title lang="en">{escape(f"Show {c}-{s}")}</title>\n'
+                f'    <desc lang="en">Episode {s} of a synthetic benchmark programme on channel {c}.</desc>\n'
+                f'    <category lang="en">Bench</category>\n'
+                f'  </programme>\n'
+            )
+        yield ''.join(parts)
+
+    yield '</tv>\n'
+
+def write_xmltv(path: str, channels: int = 100, days: int = 7, slot_minutes: int = 30) -> int:
+    size = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for chunk in iter_xmltv(channels, days, slot_minutes):
+            f.write(chunk)
+            size += len(chunk)
+    return size
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic XMLTV guide')
+    parser.add_argument('path')
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--slot-minutes', type=int, default=30)
+    args = parser.parse_args()
+
+    size = write_xmltv(args.path, args.channels, args.days, args.slot_minutes)
+    print(f"Wrote {size} bytes to {args.path}")
@@ -0,0 +1,82 @@
+# File: cryonix/benchmarks/xmltv_time_parse.py
+
+# Micro-benchmark for XMLTV timestamp parsing: the old strptime-based parser
+# against XMLTVTimeParser, cold (every value unique) and on a realistic guide
+# where slot boundaries repeat across programmes and channels.
+
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'services', 'epg_sync'))
+
+from xmltv_time import XMLTVTimeParser
+
+def legacy_parse(time_str: str) -> datetime:
+    # The parser used before xmltv_time; drops the offset
+    if not time_str:
+        return datetime.now()
+    try:
+        return datetime.strptime(time_str.split(' ')[0], '%Y%m%d%H%M%S')
+    except:
+        return datetime.now()
+
+def unique_timestamps(count: int, offset: str):
+    start = datetime(2024, 1, 1)
+    return [f'{start + timedelta(seconds=i * 37):%Y%m%d%H%M%S} {offset}' for i in range(count)]
+
+def guide_programmes(channels: int, days: int, slot_minutes: int, offset: str):
+    start = datetime(2024, 1, 1)
+    slots = days * 24 * 60 // slot_minutes
+    programmes = []
+    for c in range(channels):
+        for s in range(slots):
+            begin = start + timedelta(minutes=s * slot_minutes)
+            end = begin + timedelta(minutes=slot_minutes)
+            programmes.append({
+                'channel_id': f'ch{c}',
+                'start_time': f'{begin:%Y%m%d%H%M%S} {offset}',
+                'stop_time': f'{end:%Y%m%d%H%M%S} {offset}'
+            })
+    return programmes
+
+def timed(fn, count: int) -> dict:
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    return {'seconds': round(elapsed, 4), 'per_sec': round(count / elapsed) if elapsed else 0}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark XMLTV timestamp parsing')
+    parser.add_argument('--unique', type=int, default=200000, help='Number of distinct timestamps for the cold run')
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--slot-minutes', type=int, default=30)
+    parser.add_argument('--offset', default='+0100')
+    args = parser.parse_args()
+
+    values = unique_timestamps(args.unique, args.offset)
+    programmes = guide_programmes(args.channels, args.days, args.slot_minutes, args.offset)
+    guide_values = [p['start_time'] for p in programmes] + [p['stop_time'] for p in programmes]
+
+    results = {
+        'unique_timestamps': len(values),
+        'guide_timestamps': len(guide_values),
+        'cold': {
+            'legacy_strptime': timed(lambda: [legacy_parse(v) for v in values], len(values)),
+            'xmltv_time': timed(lambda: XMLTVTimeParser(cache_size=0).parse_many(values), len(values))
+        },
+        'guide': {
+            'legacy_strptime': timed(lambda: [legacy_parse(v) for v in guide_values], len(guide_values)),
+            'xmltv_time': timed(lambda: XMLTVTimeParser().parse_many(guide_values), len(guide_values)),
+            'xmltv_time_batch': timed(lambda: XMLTVTimeParser().convert_programmes(programmes), len(guide_values))
+        }
+    }
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -109,7 +109,7 @@ cd $INSTALL_DIR
 
 # Initialize project structure
 echo -e "${YELLOW}🔧 Setting up project structure...${NC}"
-mkdir -p services/{stream_manager,epg_sync} config logs updater
+mkdir -p services/{stream_manager,epg_sync,common} config logs updater
 
 # Secure MySQL installation
 echo -e "${YELLOW}🔒 Securing MySQL installation...${NC}"
@@ -771,6 +771,8 @@ uvicorn==0.24.0
 python-multipart==0.0.6
 pydantic==2.5.0
 aiofiles==23.2.1
+aiohttp==3.9.1
+redis==5.0.1
 EOF
 
 python3 -m venv venv
@@ -810,6 +812,8 @@ Environment=PATH=$INSTALL_DIR/services/stream_manager/venv/bin
 ExecStart=$INSTALL_DIR/services/stream_manager/venv/bin/uvicorn main:app --host 127.0.0.1 --port 8000
 Restart=always
 RestartSec=5
+# Only stop the API process: ffmpeg keeps running and is re-adopted on start
+KillMode=process
 
 [Install]
 WantedBy=multi-user.target
@@ -0,0 +1,322 @@
+# File: cryonix/services/common/instrumentation.py
+
+import asyncio
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Seconds; request and stage latencies
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def setup_logging(filename: str, level: str = 'INFO') -> QueueListener:
+    # Replaces logging.basicConfig(filename=...): callers only put records on a
+    # queue and a listener thread does the formatting and file writes, so a
+    # slow disk never stalls the event loop
+    handler = logging.FileHandler(filename)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.addHandler(QueueHandler(log_queue))
+    listener.start()
+    # Flushes whatever is still queued when the process exits
+    atexit.register(listener.stop)
+    return listener
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(str(value))}"' for name, value in labels) + '}'
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket plus +Inf; cumulative only when rendered
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> float:
+        # Linear interpolation inside the bucket holding the q-th observation
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'avg_ms': round(self.sum / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.5) * 1000, 2),
+            'p95_ms': round(self.quantile(0.95) * 1000, 2),
+            'p99_ms': round(self.quantile(0.99) * 1000, 2),
+            'max_ms': round(self.max * 1000, 2)
+        }
+
+# A named histogram with one child per label combination, rendered in the
+# Prometheus text format. Label values must come from a bounded set (route
+# templates, stage names), never from request data.
+class HistogramFamily:
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.children: Dict[Tuple[str, ...], Histogram] = {}
+
+    def labels(self, **labels) -> Histogram:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        child = self.children.get(key)
+        if child is None:
+            child = self.children[key] = Histogram(self.buckets)
+        return child
+
+    def observe(self, value: float, **labels):
+        self.labels(**labels).observe(value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for key, child in sorted(self.children.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), child.counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{format_labels(labels + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(labels)} {child.sum}')
+            lines.append(f'{self.name}_count{format_labels(labels)} {child.count}')
+        return lines
+
+    def to_dict(self) -> Dict:
+        return {
+            ' '.join(f'{name}={value}' for name, value in zip(self.labelnames, key)) or 'all': child.to_dict()
+            for key, child in sorted(self.children.items())
+        }
+
+# Raw ASGI middleware rather than BaseHTTPMiddleware, which runs every
+# request through an extra task. Requests are labelled with the route
+# template (/stream/status/{stream_id}), so ids don't explode the label set.
+class RequestTimer:
+    def __init__(self, app, histogram: HistogramFamily):
+        self.app = app
+        self.histogram = histogram
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.histogram.observe(time.perf_counter() - started, method=scope['method'],
+                                   route=self.route_path(scope), status=status[0])
+
+    @staticmethod
+    def route_path(scope) -> str:
+        # Newer routers store the matched route in the scope on the way in;
+        # older ones (FastAPI 0.68's Starlette) don't, so match it again
+        route = scope.get('route')
+        if route is not None:
+            return getattr(route, 'path', 'unmatched')
+        router = scope.get('router') or getattr(scope.get('app'), 'router', None)
+        for route in getattr(router, 'routes', ()):
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, 'path', 'unmatched')
+        return 'unmatched'
+
+# Measures how late the event loop wakes a sleeping task. The coroutine
+# records the lag; a watchdog thread notices when the loop has not ticked for
+# block_threshold and captures the loop thread's stack at that moment, which
+# names the blocking call (a synchronous DB query, a pipe read, a big parse)
+# instead of only reporting that something was slow.
+class LoopLagMonitor:
+    def __init__(self, histogram: HistogramFamily, interval: float = 0.25, block_threshold: float = 0.1,
+                 stack_depth: int = 8, history_size: int = 50):
+        self.histogram = histogram
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.stack_depth = stack_depth
+        self.running = False
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self.blocked_seconds = 0.0
+        self.blocked: deque = deque(maxlen=history_size)
+        self._beat = 0.0
+        self._capture: Optional[Dict] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.running = True
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        watchdog.start()
+        try:
+            while self.running:
+                beat = self._beat
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+                self._beat = time.monotonic()
+                self.histogram.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag >= self.block_threshold:
+                    self._record_block(lag, beat)
+        finally:
+            self._stop.set()
+
+    def stop(self):
+        self.running = False
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.block_threshold / 2):
+            beat = self._beat
+            if self._capture is not None and self._capture['beat'] == beat:
+                continue
+            if time.monotonic() - beat - self.interval < self.block_threshold:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.stack_depth)
+            self._capture = {
+                'beat': beat,
+                'stack': [f'{entry.filename}:{entry.lineno} in {entry.name}' for entry in reversed(stack)]
+            }
+
+    def _record_block(self, lag: float, beat: float):
+        # Only a capture taken since the last beat belongs to this stall
+        capture = self._capture
+        stack = capture['stack'] if capture is not None and capture['beat'] == beat else []
+        self.blocked_count += 1
+        self.blocked_seconds += lag
+        self.blocked.append({'at': time.time(), 'blocked_seconds': round(lag, 3), 'stack': stack})
+        logger.warning(f"Event loop blocked for {lag:.3f}s" + (f" at {stack[0]}" if stack else ''))
+
+    def stats(self) -> Dict:
+        lag = self.histogram.labels()
+        return {
+            'interval': self.interval,
+            'block_threshold': self.block_threshold,
+            'lag': lag.to_dict(),
+            'max_lag_ms': round(self.max_lag * 1000, 2),
+            'blocked_count': self.blocked_count,
+            'blocked_seconds': round(self.blocked_seconds, 3),
+            'recent_blocks': list(reversed(self.blocked))
+        }
+
+# Per-process metrics surface shared by the services: request latency by
+# route, named stage timers registered by the service, and event loop lag.
+class Instrumentation:
+    def __init__(self, loop_interval: float = 0.25, block_threshold: float = 0.1):
+        self.families: Dict[str, HistogramFamily] = {}
+        self.requests = self.histogram('cryonix_http_request_duration_seconds', 'HTTP request latency by route',
+                                       ('method', 'route', 'status'))
+        self.loop_monitor = LoopLagMonitor(
+            self.histogram('cryonix_event_loop_lag_seconds', 'Event loop wake-up delay', buckets=LAG_BUCKETS),
+            interval=loop_interval,
+            block_threshold=block_threshold
+        ) if loop_interval > 0 else None
+        self._task: Optional[asyncio.Task] = None
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> HistogramFamily:
+        family = self.families.get(name)
+        if family is None:
+            family = self.families[name] = HistogramFamily(name, help_text, labelnames, buckets)
+        return family
+
+    def instrument(self, app):
+        app.add_middleware(RequestTimer, histogram=self.requests)
+
+    def start(self):
+        if self.loop_monitor:
+            self._task = asyncio.create_task(self.loop_monitor.run())
+
+    async def stop(self):
+        if self._task:
+            self.loop_monitor.stop()
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def render_prometheus(self) -> str:
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        if self.loop_monitor:
+            lines.extend([
+                '# HELP cryonix_event_loop_blocked_total Loop stalls longer than the block threshold',
+                '# TYPE cryonix_event_loop_blocked_total counter',
+                f'cryonix_event_loop_blocked_total {self.loop_monitor.blocked_count}'
+            ])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> Dict:
+        return {
+            'timers': {
+                name: family.to_dict() for name, family in self.families.items()
+                if name != 'cryonix_event_loop_lag_seconds'
+            },
+            'event_loop': self.loop_monitor.stats() if self.loop_monitor else None
+        }
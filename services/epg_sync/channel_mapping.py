@@ -0,0 +1,346 @@
+# File: cryonix/services/epg_sync/channel_mapping.py
+
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from db_pool import execute_statement
+from epg_index import to_epoch
+from xmltv_time import utc_now
+
+logger = logging.getLogger(__name__)
+
+CHANNELS_SQL = """
+    SELECT c.source_id, c.channel_id, c.name
+    FROM epg_channels c
+    JOIN epg_sources s ON s.id = c.source_id AND s.generation = c.generation
+    WHERE s.is_active = 1
+    ORDER BY c.source_id, c.channel_id
+"""
+
+STREAMS_SQL = """
+    SELECT id, name FROM streams WHERE type = 'live' AND is_active = 1
+"""
+
+MAPPINGS_SQL = """
+    SELECT stream_id, source_id, channel_id, match_type, score FROM epg_channel_mappings
+"""
+
+# IGNORE: a manual override set while the matcher ran wins over the automatic row
+INSERT_MAPPING_SQL = """
+    INSERT IGNORE INTO epg_channel_mappings (stream_id, source_id, channel_id, match_type, score, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+UPSERT_OVERRIDE_SQL = """
+    INSERT INTO epg_channel_mappings (stream_id, source_id, channel_id, match_type, score, created_at, updated_at)
+    VALUES (%s, %s, %s, 'manual', 1, %s, %s)
+    ON DUPLICATE KEY UPDATE source_id = VALUES(source_id), channel_id = VALUES(channel_id),
+        match_type = 'manual', score = 1, updated_at = VALUES(updated_at)
+"""
+
+# Provider decorations that say nothing about which channel it is
+QUALITY_TAGS = {
+    'hd', 'fhd', 'uhd', 'sd', 'hq', 'lq', '4k', '8k', 'hevc', 'h264', 'h265', 'x264', 'x265',
+    '720p', '1080p', '1080i', '2160p', '50fps', '60fps', 'raw', 'backup', 'vip', 'live'
+}
+NUMBER_WORDS = {'one': '1', 'two': '2', 'three': '3', 'four': '4', 'five': '5', 'six': '6', 'seven': '7',
+                'eight': '8', 'nine': '9', 'ten': '10', 'first': '1', 'second': '2', 'third': '3',
+                'fourth': '4', 'fifth': '5'}
+
+COUNTRY_PREFIX = re.compile(r'^\s*[a-z]{2,4}\s*[:|]\s*')
+BRACKETED = re.compile(r'\([^)]*\)|\[[^\]]*\]|\{[^}]*\}')
+TOKEN = re.compile(r'[a-z0-9]+')
+# XMLTV ids are usually 'name.cc' ('bbcone.uk', 'ard.de')
+ID_SUFFIX = re.compile(r'\.[a-z]{2,3}$')
+DIGITS = re.compile(r'\d+')
+
+def normalize_name(name: Optional[str]) -> str:
+    # 'UK: BBC One HD (Backup)' and 'bbc 1' both become 'bbc1'
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFKD', name.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = COUNTRY_PREFIX.sub('', text)
+    text = BRACKETED.sub(' ', text).replace('&', ' and ').replace('+', ' plus ')
+    tokens = [NUMBER_WORDS.get(token, token) for token in TOKEN.findall(text) if token not in QUALITY_TAGS]
+    return ''.join(tokens)
+
+def normalize_channel_id(channel_id: Optional[str]) -> str:
+    return normalize_name(ID_SUFFIX.sub('', (channel_id or '').lower()))
+
+def numbers(key: str) -> Tuple[str, ...]:
+    # 'bbc3' -> ('3',); '2nd' counts as 2
+    return tuple(str(int(digits)) for digits in DIGITS.findall(key))
+
+def trigrams(key: str) -> Set[str]:
+    padded = f'  {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Matching structures over every channel of the active sources, built once
+# per sync. Exact lookups go through a dict of normalized keys; fuzzy ones
+# through a trigram inverted index, so a stream name is only compared with
+# channels sharing a trigram with it (Dice coefficient over trigram sets),
+# never with all of them. A fuzzy candidate must carry the same numbers as
+# the name: 'BBC Three' is close to 'BBC One' by trigrams but a different
+# channel, and no guide beats the wrong one. Channels are added in source
+# order, so when the same channel comes from several sources the lowest
+# source id wins, as in the now/next index.
+class ChannelMatchIndex:
+    def __init__(self, channels: List[Tuple[int, str, str]], fuzzy_threshold: float = 0.75):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.channels = channels
+        self.exact: Dict[str, int] = {}
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        # (channel index, trigram count, numbers) per indexed key
+        self.keys: List[Tuple[int, int, Tuple[str, ...]]] = []
+
+        for index, (_, channel_id, name) in enumerate(channels):
+            for key in {normalize_name(name), normalize_channel_id(channel_id)}:
+                if not key:
+                    continue
+                self.exact.setdefault(key, index)
+                grams = trigrams(key)
+                key_index = len(self.keys)
+                self.keys.append((index, len(grams), numbers(key)))
+                for gram in grams:
+                    self.postings[gram].append(key_index)
+
+    def match(self, name: str) -> Optional[Tuple[int, str, str, float]]:
+        # (source_id, channel_id, match type, score), None below the fuzzy threshold
+        key = normalize_name(name)
+        if not key:
+            return None
+        index = self.exact.get(key)
+        if index is not None:
+            source_id, channel_id, _ = self.channels[index]
+            return source_id, channel_id, 'exact', 1.0
+        if len(key) < 3:
+            return None
+
+        grams = trigrams(key)
+        key_numbers = numbers(key)
+        shared: Dict[int, int] = defaultdict(int)
+        for gram in grams:
+            for key_index in self.postings.get(gram, ()):
+                shared[key_index] += 1
+
+        best_score, best_index = 0.0, None
+        for key_index, count in shared.items():
+            index, size, candidate_numbers = self.keys[key_index]
+            if candidate_numbers != key_numbers:
+                continue
+            score = 2 * count / (len(grams) + size)
+            if score > best_score or (score == best_score and best_index is not None and index < best_index):
+                best_score, best_index = score, index
+        if best_index is None or best_score < self.fuzzy_threshold:
+            return None
+        source_id, channel_id, _ = self.channels[best_index]
+        return source_id, channel_id, 'fuzzy', round(best_score, 3)
+
+    def stats(self) -> Dict:
+        return {'channels': len(self.channels), 'keys': len(self.keys), 'trigrams': len(self.postings)}
+
+def load_rows(connection, sql: str) -> List[Tuple]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql)
+        rows = cursor.fetchall()
+        connection.commit()
+        return rows
+    finally:
+        cursor.close()
+
+def store_auto_mappings(connection, rows: List[Tuple], batch_size: int = 1000):
+    # One transaction: the panel never sees the table without its automatic rows
+    cursor = connection.cursor()
+    try:
+        cursor.execute("DELETE FROM epg_channel_mappings WHERE match_type <> 'manual'")
+        for offset in range(0, len(rows), batch_size):
+            cursor.executemany(INSERT_MAPPING_SQL, rows[offset:offset + batch_size])
+        connection.commit()
+    except BaseException:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def match_streams(index: ChannelMatchIndex, streams: List[Tuple[int, str]], skip: Set[int]) -> Dict[int, Dict]:
+    mappings = {}
+    for stream_id, name in streams:
+        if stream_id in skip:
+            continue
+        match = index.match(name)
+        if match is not None:
+            source_id, channel_id, match_type, score = match
+            mappings[stream_id] = mapping_record(stream_id, source_id, channel_id, match_type, score)
+    return mappings
+
+def mapping_record(stream_id: int, source_id: Optional[int], channel_id: Optional[str], match_type: str,
+                   score: float) -> Dict:
+    return {'stream_id': stream_id, 'source_id': source_id, 'channel_id': channel_id,
+            'match_type': match_type, 'score': score}
+
+# Links panel streams to EPG channels. Automatic matches are recomputed after
+# syncs (coalesced like the exports) and stored in epg_channel_mappings next
+# to manual overrides, which the matcher never touches; an override with no
+# channel marks a stream as having no EPG. Lookups are answered from the
+# in-memory mapping and the now/next index, without a database round-trip.
+class ChannelMapper:
+    def __init__(self, service, fuzzy_threshold: float = 0.75, debounce: float = 5):
+        self.service = service
+        self.fuzzy_threshold = fuzzy_threshold
+        self.debounce = debounce
+        self.index = ChannelMatchIndex([], fuzzy_threshold)
+        self.mappings: Dict[int, Dict] = {}
+        self.overrides: Dict[int, Dict] = {}
+        self.stats_counters = {'rebuilds': 0, 'failures': 0, 'exact': 0, 'fuzzy': 0, 'unmatched': 0}
+        self.last_build_seconds = 0.0
+        self.built_at: Optional[float] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run_loop())
+        # Serve the stored mapping right away; the matcher refreshes it in the background
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Could not load stored channel mappings: {e!r}")
+        self.schedule()
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+
+    def schedule(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+            try:
+                await self.rebuild()
+            except Exception as e:
+                self.stats_counters['failures'] += 1
+                logger.error(f"Channel mapping rebuild failed: {e!r}")
+
+    async def _query(self, sql: str) -> List[Tuple]:
+        async with self.service.db_connection() as connection:
+            return await self.service.db_pool.run(load_rows, connection, sql)
+
+    async def load(self):
+        mappings = {}
+        for stream_id, source_id, channel_id, match_type, score in await self._query(MAPPINGS_SQL):
+            mappings[stream_id] = mapping_record(stream_id, source_id, channel_id, match_type, score)
+        self.overrides = {stream_id: mapping for stream_id, mapping in mappings.items()
+                          if mapping['match_type'] == 'manual'}
+        self.mappings = mappings
+
+    async def rebuild(self):
+        started = time.perf_counter()
+        channels = await self._query(CHANNELS_SQL)
+        streams = await self._query(STREAMS_SQL)
+        skipped = set(self.overrides)
+
+        # Index build and matching are pure CPU: keep them off the event loop
+        loop = asyncio.get_running_loop()
+        index = await loop.run_in_executor(None, ChannelMatchIndex, channels, self.fuzzy_threshold)
+        auto = await loop.run_in_executor(None, match_streams, index, streams, skipped)
+
+        now = datetime.now()
+        rows = [(m['stream_id'], m['source_id'], m['channel_id'], m['match_type'], m['score'], now, now)
+                for m in auto.values()]
+        async with self.service.db_connection() as connection:
+            await self.service.db_pool.run(store_auto_mappings, connection, rows)
+
+        # Overrides set or cleared while this ran win over what it computed
+        mappings = {stream_id: mapping for stream_id, mapping in auto.items() if stream_id not in self.overrides}
+        for stream_id in skipped - set(self.overrides):
+            if stream_id in self.mappings:
+                mappings[stream_id] = self.mappings[stream_id]
+        mappings.update(self.overrides)
+        self.index = index
+        self.mappings = mappings
+
+        self.stats_counters['rebuilds'] += 1
+        self.stats_counters['exact'] = sum(1 for m in auto.values() if m['match_type'] == 'exact')
+        self.stats_counters['fuzzy'] = len(auto) - self.stats_counters['exact']
+        self.stats_counters['unmatched'] = len({stream_id for stream_id, _ in streams} - set(mappings))
+        self.last_build_seconds = time.perf_counter() - started
+        self.built_at = time.time()
+        logger.info(f"Channel mapping rebuilt: {len(streams)} streams, {len(channels)} EPG channels, "
+                    f"{self.stats_counters['exact']} exact, {self.stats_counters['fuzzy']} fuzzy, "
+                    f"{len(self.overrides)} manual in {self.last_build_seconds:.2f}s")
+
+    async def set_override(self, stream_id: int, source_id: Optional[int], channel_id: Optional[str]) -> Dict:
+        now = datetime.now()
+        async with self.service.db_connection() as connection:
+            await self.service.db_pool.run(execute_statement, connection, UPSERT_OVERRIDE_SQL,
+                                           (stream_id, source_id, channel_id, now, now))
+        mapping = mapping_record(stream_id, source_id, channel_id, 'manual', 1.0)
+        self.overrides[stream_id] = mapping
+        self.mappings[stream_id] = mapping
+        return mapping
+
+    async def clear_override(self, stream_id: int, name: Optional[str]) -> Optional[Dict]:
+        # Back to automatic matching, straight away against the current index
+        async with self.service.db_connection() as connection:
+            await self.service.db_pool.run(execute_statement, connection,
+                                           "DELETE FROM epg_channel_mappings WHERE stream_id = %s", (stream_id,))
+        self.overrides.pop(stream_id, None)
+        self.mappings.pop(stream_id, None)
+
+        match = self.index.match(name) if name else None
+        if match is None:
+            return None
+        source_id, channel_id, match_type, score = match
+        mapping = mapping_record(stream_id, source_id, channel_id, match_type, score)
+        now = datetime.now()
+        async with self.service.db_connection() as connection:
+            await self.service.db_pool.run(execute_statement, connection, INSERT_MAPPING_SQL,
+                                           (stream_id, source_id, channel_id, match_type, score, now, now))
+        self.mappings[stream_id] = mapping
+        return mapping
+
+    def mapping(self, stream_id: int) -> Optional[Dict]:
+        return self.mappings.get(stream_id)
+
+    def lookup(self, stream_ids: List[int], at: Optional[datetime] = None, hours: float = 0) -> Dict[int, Optional[Dict]]:
+        # Now/next (and optionally the next `hours` of programmes) per stream;
+        # None for streams with no mapping
+        snapshot = self.service.epg_index.snapshot
+        moment = to_epoch(at or utc_now())
+        result = {}
+        for stream_id in stream_ids:
+            mapping = self.mappings.get(stream_id)
+            if mapping is None:
+                result[stream_id] = None
+                continue
+            timeline = None
+            if mapping['channel_id'] is not None:
+                timeline = snapshot.timeline(mapping['channel_id'], mapping['source_id'])
+            entry = {**mapping, **(timeline.now_next(moment) if timeline is not None else {'now': None, 'next': None})}
+            if hours > 0:
+                entry['programmes'] = timeline.window(moment, moment + int(hours * 3600)) if timeline is not None else []
+            result[stream_id] = entry
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            'mapped': len(self.mappings),
+            'manual': len(self.overrides),
+            'index': self.index.stats(),
+            'built_at': self.built_at,
+            'last_build_seconds': round(self.last_build_seconds, 3)
+        }
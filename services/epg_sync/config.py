@@ -0,0 +1,64 @@
+# File: cryonix/services/epg_sync/config.py
+
+import os
+
+class Config:
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+
+    # Event loop lag sampling (seconds, 0 disables); stalls longer than
+    # LOOP_BLOCK_THRESHOLD are logged with the stack of the blocking call
+    LOOP_LAG_INTERVAL = float(os.getenv('EPG_LOOP_LAG_INTERVAL', '0.25'))
+    LOOP_BLOCK_THRESHOLD = float(os.getenv('EPG_LOOP_BLOCK_THRESHOLD', '0.1'))
+
+    # Streaming XMLTV ingestion
+    STREAMING_PARSE = os.getenv('EPG_STREAMING_PARSE', '1') == '1'
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv('EPG_DOWNLOAD_CHUNK_SIZE', '65536'))
+    PARSE_BATCH_SIZE = int(os.getenv('EPG_PARSE_BATCH_SIZE', '5000'))
+
+    # Bulk EPG writes
+    BULK_WRITE = os.getenv('EPG_BULK_WRITE', '1') == '1'
+    WRITE_BATCH_SIZE = int(os.getenv('EPG_WRITE_BATCH_SIZE', '1000'))
+
+    # 'incremental' diffs against stored fingerprints, 'full' deletes and reinserts
+    SYNC_MODE = os.getenv('EPG_SYNC_MODE', 'incremental')
+
+    # Shared MySQL connection pool
+    DB_POOL_ENABLED = os.getenv('EPG_DB_POOL', '1') == '1'
+    DB_POOL_MIN_SIZE = int(os.getenv('EPG_DB_POOL_MIN_SIZE', '2'))
+    DB_POOL_MAX_SIZE = int(os.getenv('EPG_DB_POOL_MAX_SIZE', '10'))
+    DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv('EPG_DB_POOL_HEALTH_CHECK_IDLE', '30'))
+    DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('EPG_DB_POOL_ACQUIRE_TIMEOUT', '10'))
+
+    # On-disk cache of guide downloads (conditional GET + content hash)
+    DOWNLOAD_CACHE = os.getenv('EPG_DOWNLOAD_CACHE', '1') == '1'
+    CACHE_DIR = os.getenv('EPG_CACHE_DIR', 'epg_cache')
+
+    # Multi-source sync scheduler
+    SYNC_INTERVAL_HOURS = float(os.getenv('EPG_SYNC_INTERVAL_HOURS', '6'))
+    SCHEDULER_ENABLED = os.getenv('EPG_SCHEDULER_ENABLED', '1') == '1'
+    SCHEDULER_POLL_SECONDS = int(os.getenv('EPG_SCHEDULER_POLL_SECONDS', '300'))
+    MAX_CONCURRENT_SYNCS = int(os.getenv('EPG_MAX_CONCURRENT_SYNCS', '4'))
+    MAX_SYNCS_PER_HOST = int(os.getenv('EPG_MAX_SYNCS_PER_HOST', '2'))
+    PARSE_WORKERS = int(os.getenv('EPG_PARSE_WORKERS', '2'))
+    JOB_HISTORY_SIZE = int(os.getenv('EPG_JOB_HISTORY_SIZE', '200'))
+    # Failed sources are retried after a jittered exponential backoff (seconds)
+    RETRY_BACKOFF_BASE = float(os.getenv('EPG_RETRY_BACKOFF_BASE', '300'))
+    RETRY_BACKOFF_MAX = float(os.getenv('EPG_RETRY_BACKOFF_MAX', '21600'))
+
+    # In-memory now/next index
+    INDEX_PAST_HOURS = float(os.getenv('EPG_INDEX_PAST_HOURS', '6'))
+    INDEX_HORIZON_HOURS = float(os.getenv('EPG_INDEX_HORIZON_HOURS', '48'))
+    INDEX_REFRESH_SECONDS = int(os.getenv('EPG_INDEX_REFRESH_SECONDS', '3600'))
+
+    # Precomputed guide exports (gzipped XMLTV/JSON on disk), rebuilt after each sync
+    EXPORT_ENABLED = os.getenv('EPG_EXPORT', '1') == '1'
+    EXPORT_DIR = os.getenv('EPG_EXPORT_DIR', 'epg_export')
+    EXPORT_SHORT_HOURS = float(os.getenv('EPG_EXPORT_SHORT_HOURS', '36'))
+    EXPORT_DEBOUNCE_SECONDS = float(os.getenv('EPG_EXPORT_DEBOUNCE_SECONDS', '5'))
+    EXPORT_COMPRESS_LEVEL = int(os.getenv('EPG_EXPORT_COMPRESS_LEVEL', '6'))
+    EXPORT_MAX_AGE = int(os.getenv('EPG_EXPORT_MAX_AGE', '300'))
+
+    # Stream <-> EPG channel mapping, recomputed after each sync
+    MAPPING_ENABLED = os.getenv('EPG_MAPPING', '1') == '1'
+    MAPPING_FUZZY_THRESHOLD = float(os.getenv('EPG_MAPPING_FUZZY_THRESHOLD', '0.75'))
+    MAPPING_DEBOUNCE_SECONDS = float(os.getenv('EPG_MAPPING_DEBOUNCE_SECONDS', '5'))
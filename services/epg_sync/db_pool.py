@@ -0,0 +1,177 @@
+# File: cryonix/services/epg_sync/db_pool.py
+
+import asyncio
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import mysql.connector
+
+logger = logging.getLogger(__name__)
+
+# Application-lifetime pool of blocking mysql-connector connections. Every
+# driver call runs on a bounded thread executor (one thread per connection),
+# so the event loop never blocks on the TCP/auth handshake or on a query.
+# Connections idle for longer than health_check_idle are pinged on checkout
+# and replaced if the server has gone away.
+class DBPool:
+    def __init__(self, db_config: Dict, min_size: int = 2, max_size: int = 10,
+                 health_check_idle: float = 30.0, acquire_timeout: float = 10.0, pooled: bool = True):
+        self.db_config = db_config
+        self.min_size = max(0, min(min_size, max_size))
+        self.max_size = max(1, max_size)
+        self.health_check_idle = health_check_idle
+        self.acquire_timeout = acquire_timeout
+        self.pooled = pooled
+
+        self._executor = ThreadPoolExecutor(max_workers=self.max_size, thread_name_prefix='epg-db')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._idle: List = []
+        self._last_used: Dict[int, float] = {}
+        self._size = 0
+        self._closed = False
+
+        self.stats_counters = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'created': 0,
+            'discarded': 0,
+            'health_checks': 0,
+            'health_check_failures': 0,
+            'timeouts': 0
+        }
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: fn(*args, **kwargs))
+
+    async def open(self):
+        # Created here so the semaphore belongs to the server's event loop
+        self._semaphore = asyncio.Semaphore(self.max_size)
+        if not self.pooled:
+            return
+        for _ in range(self.min_size):
+            connection = await self._connect()
+            self._release_idle(connection)
+        logger.info(f"Database pool opened with {self._size} connections (max {self.max_size})")
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await self._discard(connection, count=False)
+        self._executor.shutdown(wait=False)
+
+    async def _connect(self):
+        connection = await self.run(mysql.connector.connect, **self.db_config)
+        self._size += 1
+        self.stats_counters['created'] += 1
+        return connection
+
+    async def _discard(self, connection, count: bool = True):
+        self._size -= 1
+        self._last_used.pop(id(connection), None)
+        if count:
+            self.stats_counters['discarded'] += 1
+        try:
+            await self.run(connection.close)
+        except Exception:
+            pass
+
+    def _release_idle(self, connection):
+        self._last_used[id(connection)] = time.monotonic()
+        self._idle.append(connection)
+
+    async def _healthy(self, connection) -> bool:
+        idle_for = time.monotonic() - self._last_used.get(id(connection), 0)
+        if idle_for < self.health_check_idle:
+            return True
+
+        self.stats_counters['health_checks'] += 1
+        try:
+            await self.run(connection.ping, reconnect=False)
+            return True
+        except Exception as e:
+            self.stats_counters['health_check_failures'] += 1
+            logger.warning(f"Discarding unhealthy pooled connection: {e}")
+            return False
+
+    async def acquire(self):
+        if self._closed or self._semaphore is None:
+            raise RuntimeError("Database pool is not open")
+
+        started = time.monotonic()
+        if self._semaphore.locked():
+            self.stats_counters['waits'] += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.stats_counters['timeouts'] += 1
+            raise
+        self.stats_counters['wait_seconds'] += time.monotonic() - started
+        self.stats_counters['checkouts'] += 1
+
+        try:
+            while self._idle:
+                connection = self._idle.pop()
+                if await self._healthy(connection):
+                    return connection
+                await self._discard(connection)
+            return await self._connect()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def release(self, connection):
+        try:
+            if not self.pooled or self._closed:
+                await self._discard(connection, count=False)
+                return
+
+            # Never hand a connection with an open transaction to the next caller
+            try:
+                if connection.in_transaction:
+                    await self.run(connection.rollback)
+            except Exception:
+                await self._discard(connection)
+                return
+
+            self._release_idle(connection)
+        finally:
+            self._semaphore.release()
+
+    def stats(self) -> Dict:
+        checkouts = self.stats_counters['checkouts']
+        return {
+            'pooled': self.pooled,
+            'min_size': self.min_size,
+            'max_size': self.max_size,
+            'size': self._size,
+            'idle': len(self._idle),
+            'in_use': self._size - len(self._idle),
+            **self.stats_counters,
+            'wait_seconds': round(self.stats_counters['wait_seconds'], 3),
+            'avg_wait_ms': round(self.stats_counters['wait_seconds'] / checkouts * 1000, 3) if checkouts else 0.0
+        }
+
+def fetch_rows(connection, sql: str, params: Optional[tuple], dictionary: bool, many: bool):
+    cursor = connection.cursor(dictionary=dictionary, buffered=True)
+    try:
+        cursor.execute(sql, params)
+        result = cursor.fetchall() if many else cursor.fetchone()
+        # Plain SELECTs still open a transaction under autocommit=False
+        connection.commit()
+        return result
+    finally:
+        cursor.close()
+
+def execute_statement(connection, sql: str, params: Optional[tuple] = None) -> int:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        connection.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
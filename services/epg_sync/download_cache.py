@@ -0,0 +1,286 @@
+# File: cryonix/services/epg_sync/download_cache.py
+
+import asyncio
+import hashlib
+import json
+import logging
+import lzma
+import os
+import time
+import uuid
+import zlib
+from typing import AsyncIterator, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+XZ_MAGIC = b'\xfd7zXZ\x00'
+
+def detect_compression(head: bytes) -> Optional[str]:
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(XZ_MAGIC):
+        return 'xz'
+    return None
+
+# Incremental gzip/xz decoder. The format is sniffed from the first bytes, so
+# .gz/.xz guides and gzip Content-Encoding are handled alike; anything else
+# passes through untouched.
+class StreamDecompressor:
+    def __init__(self):
+        self.compression: Optional[str] = None
+        self._decoder = None
+        self._head = b''
+        self.detected = False
+
+    def _new_decoder(self):
+        if self.compression == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+    def decompress(self, data: bytes) -> bytes:
+        if not self.detected:
+            self._head += data
+            if len(self._head) < len(XZ_MAGIC):
+                return b''
+            data, self._head = self._head, b''
+            self.compression = detect_compression(data)
+            self.detected = True
+            if self.compression:
+                self._decoder = self._new_decoder()
+
+        if self._decoder is None:
+            return data
+
+        output = []
+        while data:
+            output.append(self._decoder.decompress(data))
+            data = self._decoder.unused_data if self._decoder.eof else b''
+            if data:
+                # Concatenated gzip members / xz streams
+                self._decoder = self._new_decoder()
+        return b''.join(output)
+
+    def flush(self) -> bytes:
+        if not self.detected:
+            # Body shorter than the magic: nothing to sniff, pass it through
+            data, self._head = self._head, b''
+            self.detected = True
+            return data
+        if self.compression == 'gzip':
+            return self._decoder.flush()
+        return b''
+
+async def decompress_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    decompressor = StreamDecompressor()
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    tail = decompressor.flush()
+    if tail:
+        yield tail
+
+# Synchronous side of a download: hashes the decompressed content and writes
+# the body to disk compressed (gzipping plain XML on the way). Runs on an
+# executor thread, one chunk at a time and in order.
+class CacheBodyWriter:
+    def __init__(self, path: str):
+        self.path = path
+        self.digest = hashlib.sha256()
+        self.decompressor = StreamDecompressor()
+        self.compressor = None
+        self.pending = b''
+        self.size = 0
+        self._file = open(path, 'wb')
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        self.digest.update(self.decompressor.decompress(chunk))
+
+        self.pending += chunk
+        if not self.decompressor.detected:
+            return
+        if self.compressor is None and self.decompressor.compression is None:
+            # Plain XML: gzip it on the way to disk
+            self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._file.write(self.compressor.compress(self.pending) if self.compressor else self.pending)
+        self.pending = b''
+
+    def finish(self) -> str:
+        self.digest.update(self.decompressor.flush())
+        if self.pending:
+            self.compressor = self.compressor or zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._file.write(self.compressor.compress(self.pending))
+        if self.compressor:
+            self._file.write(self.compressor.flush())
+        self._file.close()
+        return self.digest.hexdigest()
+
+    def discard(self):
+        self._file.close()
+        os.unlink(self.path)
+
+class DownloadError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"Failed to fetch EPG: {status}")
+        self.status = status
+
+class CachedDownload:
+    def __init__(self, status: str, url: str, body_path: str, meta: Dict, pending: bool = False):
+        # status: 'updated', 'not_modified' (HTTP 304) or 'unchanged' (same content hash)
+        self.status = status
+        self.url = url
+        self.body_path = body_path
+        self.meta = meta
+        # An updated body is staged until the guide has been written; see DownloadCache.commit
+        self.pending = pending
+
+    @property
+    def changed(self) -> bool:
+        return self.status == 'updated'
+
+# On-disk cache of guide downloads keyed by source URL. Each entry keeps the
+# body compressed (as served for .gz/.xz/gzip-encoded responses, otherwise
+# gzipped on the way to disk) next to a JSON file with the ETag,
+# Last-Modified and the SHA-256 of the decompressed content, so a re-sync can
+# send conditional headers and skip the parse when nothing changed.
+# A new body and its meta are only published by commit(), once the guide was
+# written to the database: publishing them on download would make a failed
+# sync look 'not_modified'/'unchanged' to every retry.
+class DownloadCache:
+    def __init__(self, cache_dir: str, chunk_size: int = 65536):
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size
+        os.makedirs(cache_dir, exist_ok=True)
+        # Staged bodies left behind by a process that died mid-sync
+        for name in os.listdir(cache_dir):
+            if name.endswith('.tmp'):
+                os.unlink(os.path.join(cache_dir, name))
+
+        self.stats_counters = {'updated': 0, 'not_modified': 0, 'unchanged': 0, 'bytes_downloaded': 0}
+
+    def _paths(self, url: str):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + '.body', base + '.json'
+
+    def load_meta(self, url: str) -> Optional[Dict]:
+        body_path, meta_path = self._paths(url)
+        if not os.path.exists(body_path):
+            return None
+        try:
+            with open(meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_meta(self, meta_path: str, meta: Dict):
+        tmp_path = meta_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    async def fetch(self, session, url: str, force: bool = False) -> CachedDownload:
+        body_path, meta_path = self._paths(url)
+        meta = self.load_meta(url)
+
+        headers = {'Accept-Encoding': 'gzip'}
+        if meta and not force:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304 and meta:
+                meta['checked_at'] = time.time()
+                self._save_meta(meta_path, meta)
+                self.stats_counters['not_modified'] += 1
+                return CachedDownload('not_modified', url, body_path, meta)
+
+            if response.status != 200:
+                raise DownloadError(response.status)
+
+            # Only the socket reads stay on the event loop; decompressing,
+            # hashing, recompressing and the file writes of a guide that can
+            # be hundreds of MB run on the executor. One chunk is in flight
+            # there while the next one is read.
+            loop = asyncio.get_running_loop()
+            tmp_path = f'{body_path}.{uuid.uuid4().hex[:12]}.tmp'
+            writer = await loop.run_in_executor(None, CacheBodyWriter, tmp_path)
+            in_flight = None
+            try:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    if in_flight is not None:
+                        await in_flight
+                    in_flight = loop.run_in_executor(None, writer.feed, chunk)
+                if in_flight is not None:
+                    await in_flight
+                    in_flight = None
+                content_hash = await loop.run_in_executor(None, writer.finish)
+            except BaseException:
+                if in_flight is not None:
+                    # Let the running feed finish before the file goes away
+                    await asyncio.wait([in_flight])
+                await loop.run_in_executor(None, writer.discard)
+                raise
+
+            size = writer.size
+            self.stats_counters['bytes_downloaded'] += size
+
+            new_meta = {
+                'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_hash': content_hash,
+                'compression': writer.decompressor.compression or 'gzip',
+                'size': size,
+                'fetched_at': time.time(),
+                'checked_at': time.time()
+            }
+
+        if meta and not force and meta.get('content_hash') == content_hash:
+            await asyncio.get_running_loop().run_in_executor(None, os.unlink, tmp_path)
+            self._save_meta(meta_path, new_meta)
+            self.stats_counters['unchanged'] += 1
+            return CachedDownload('unchanged', url, body_path, new_meta)
+
+        self.stats_counters['updated'] += 1
+        return CachedDownload('updated', url, tmp_path, new_meta, pending=True)
+
+    def commit(self, download: CachedDownload):
+        # The guide from this body is in the database: make it the cached entry
+        if not download.pending:
+            return
+        body_path, meta_path = self._paths(download.url)
+        os.replace(download.body_path, body_path)
+        self._save_meta(meta_path, download.meta)
+        download.body_path = body_path
+        download.pending = False
+
+    def discard(self, download: CachedDownload):
+        # Sync failed: keep the previous entry so the next attempt downloads again
+        if not download.pending:
+            return
+        try:
+            os.unlink(download.body_path)
+        except FileNotFoundError:
+            pass
+        download.pending = False
+
+    async def iter_body(self, download: CachedDownload) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        with open(download.body_path, 'rb') as f:
+            async def read_chunks():
+                while True:
+                    chunk = await loop.run_in_executor(None, f.read, self.chunk_size)
+                    if not chunk:
+                        return
+                    yield chunk
+
+            async for data in decompress_chunks(read_chunks()):
+                yield data
+
+    def stats(self) -> Dict:
+        return dict(self.stats_counters)
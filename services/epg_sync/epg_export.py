@@ -0,0 +1,548 @@
+# File: cryonix/services/epg_sync/epg_export.py
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from datetime import datetime, timedelta
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, List, Optional, Set, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from epg_writer import CURRENT_GENERATION
+from xmltv_time import utc_now
+
+logger = logging.getLogger(__name__)
+
+CHANNELS_SQL = f"""
+    SELECT channel_id, name, icon FROM epg_channels
+    WHERE source_id = %s AND {CURRENT_GENERATION}
+    ORDER BY channel_id
+"""
+
+PROGRAMMES_SQL = f"""
+    SELECT channel_id, start_time, stop_time, title, description, category
+    FROM epg_programmes
+    WHERE source_id = %s AND {CURRENT_GENERATION}
+    ORDER BY channel_id, start_time
+"""
+
+MEDIA_TYPES = {'xmltv': 'application/xml', 'json': 'application/json', 'short': 'application/json'}
+
+XMLTV_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE tv SYSTEM "xmltv.dtd">\n<tv generator-info-name="Cryonix">\n'
+XMLTV_FOOTER = '</tv>\n'
+
+# Characters XML 1.0 does not allow, even escaped; some providers send them
+INVALID_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+def xml_text(value: Optional[str]) -> str:
+    return escape(INVALID_XML.sub('', value or ''))
+
+def xml_attr(value: Optional[str]) -> str:
+    return quoteattr(INVALID_XML.sub('', value or ''))
+
+def xmltv_time(value: datetime) -> str:
+    # Stored programme times are naive UTC
+    return value.strftime('%Y%m%d%H%M%S +0000')
+
+def xmltv_channel(channel_id: str, name: Optional[str], icon: Optional[str]) -> str:
+    icon_tag = f'    <icon src={xml_attr(icon)} />\n' if icon else ''
+    return (f'  <channel id={xml_attr(channel_id)}>\n'
+            f'    <display-name>{xml_text(name or channel_id)}</display-name>\n'
+            f'{icon_tag}  </channel>\n')
+
+def xmltv_programme(channel_id: str, start_time: datetime, stop_time: datetime, title: Optional[str],
+                    description: Optional[str], category: Optional[str]) -> str:
+    desc_tag = f'    <desc>{xml_text(description)}</desc>\n' if description else ''
+    category_tag = f'    <category>{xml_text(category)}</category>\n' if category else ''
+    return (f'  <programme start="{xmltv_time(start_time)}" stop="{xmltv_time(stop_time)}" '
+            f'channel={xml_attr(channel_id)}>\n'
+            f'    <title>{xml_text(title)}</title>\n{desc_tag}{category_tag}  </programme>\n')
+
+def json_programme(start_time: datetime, stop_time: datetime, title: Optional[str], description: Optional[str],
+                   category: Optional[str]) -> str:
+    # Same fields as the /epg/grid and /epg/now-next entries
+    return json.dumps({
+        'start_time': start_time.isoformat(),
+        'stop_time': stop_time.isoformat(),
+        'title': title,
+        'description': description,
+        'category': category
+    }, ensure_ascii=False, separators=(',', ':'))
+
+class HashingWriter:
+    # File wrapper hashing the bytes that reach the disk, i.e. exactly what is served
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+# One gzipped artifact being written. The gzip header carries no name or
+# mtime, so an unchanged guide compresses to the same bytes and keeps its
+# ETag across syncs: clients revalidate with a 304 instead of a download.
+class ExportWriter:
+    BUFFER_SIZE = 65536
+
+    def __init__(self, directory: str, name: str, compress_level: int = 6):
+        self.directory = directory
+        self.name = name
+        self.tmp_path = os.path.join(directory, f'.{name}.tmp')
+        self._file = open(self.tmp_path, 'wb')
+        self._hashing = HashingWriter(self._file)
+        self._gzip = gzip.GzipFile(fileobj=self._hashing, mode='wb', compresslevel=compress_level, mtime=0)
+        self._buffer: List[str] = []
+        self._buffered = 0
+        self.raw_size = 0
+        self.started = time.perf_counter()
+
+    def write(self, text: str):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        if self._buffered >= self.BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        data = ''.join(self._buffer).encode('utf-8')
+        self.raw_size += len(data)
+        self._gzip.write(data)
+        self._buffer = []
+        self._buffered = 0
+
+    def finish(self, **counts) -> Dict:
+        self._flush()
+        self._gzip.close()
+        self._file.close()
+
+        etag = self._hashing.digest.hexdigest()[:32]
+        path = os.path.join(self.directory, f'{self.name}.{etag[:12]}.gz')
+        os.replace(self.tmp_path, path)
+        return {
+            'name': self.name,
+            'path': path,
+            'etag': etag,
+            'size': self._hashing.size,
+            'raw_size': self.raw_size,
+            'generated_at': time.time(),
+            'build_seconds': round(time.perf_counter() - self.started, 3),
+            **counts
+        }
+
+    def discard(self):
+        self._gzip.close()
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.unlink(self.tmp_path)
+
+def fetch_channels(connection, source_id: int) -> List[Tuple]:
+    cursor = connection.cursor()
+    try:
+        cursor.execute(CHANNELS_SQL, (source_id, source_id))
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+def write_source_exports(connection, source_id: int, directory: str, short_window: Tuple[datetime, datetime],
+                         compress_level: int = 6) -> List[Dict]:
+    # Runs on the DB executor. One pass over the source's programmes feeds
+    # the XMLTV, the full JSON guide and the short (upcoming) JSON guide.
+    channels = fetch_channels(connection, source_id)
+    writers = [ExportWriter(directory, f'{kind}_{source_id}', compress_level) for kind in ('xmltv', 'json', 'short')]
+    xmltv, full, short = writers
+    short_start, short_end = short_window
+    programmes = short_programmes = 0
+
+    try:
+        xmltv.write(XMLTV_HEADER)
+        for channel_id, name, icon in channels:
+            xmltv.write(xmltv_channel(channel_id, name, icon))
+
+        # No generation time in the body (it is in Last-Modified), so the
+        # ETag only changes when the guide does
+        full.write(f'{{"source_id":{source_id},"channels":')
+        full.write(json.dumps([{'id': channel_id, 'name': name, 'icon': icon} for channel_id, name, icon in channels],
+                              ensure_ascii=False, separators=(',', ':')))
+        full.write(',"programmes":{')
+        # The window moves with every export; it goes in the manifest, not the body
+        short.write(f'{{"source_id":{source_id},"programmes":{{')
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute(PROGRAMMES_SQL, (source_id, source_id))
+            current_id = None
+            full_first = short_first = True
+            short_open = False
+            for channel_id, start_time, stop_time, title, description, category in cursor:
+                if channel_id != current_id:
+                    if current_id is not None:
+                        full.write(']')
+                    if short_open:
+                        short.write(']')
+                        short_open = False
+                    full.write(('' if full_first else ',') + json.dumps(channel_id, ensure_ascii=False) + ':[')
+                    full_first = False
+                    current_id = channel_id
+                    channel_first = short_channel_first = True
+
+                xmltv.write(xmltv_programme(channel_id, start_time, stop_time, title, description, category))
+                entry = json_programme(start_time, stop_time, title, description, category)
+                full.write(entry if channel_first else ',' + entry)
+                channel_first = False
+                programmes += 1
+
+                if stop_time > short_start and start_time < short_end:
+                    if not short_open:
+                        short.write(('' if short_first else ',') + json.dumps(channel_id, ensure_ascii=False) + ':[')
+                        short_first = False
+                        short_open = True
+                    short.write(entry if short_channel_first else ',' + entry)
+                    short_channel_first = False
+                    short_programmes += 1
+
+            if current_id is not None:
+                full.write(']')
+            if short_open:
+                short.write(']')
+            connection.commit()
+        finally:
+            cursor.close()
+
+        xmltv.write(XMLTV_FOOTER)
+        full.write('}}')
+        short.write('}}')
+    except BaseException:
+        for writer in writers:
+            writer.discard()
+        raise
+
+    return [
+        xmltv.finish(channels=len(channels), programmes=programmes),
+        full.finish(channels=len(channels), programmes=programmes),
+        short.finish(channels=len(channels), programmes=short_programmes,
+                     window_start=short_start.isoformat(), window_end=short_end.isoformat())
+    ]
+
+def write_full_xmltv(connection, source_ids: List[int], directory: str, compress_level: int = 6) -> Dict:
+    # Every active source in one guide. A channel id carried by several
+    # sources comes from the lowest source id, like the now/next index.
+    writer = ExportWriter(directory, 'xmltv', compress_level)
+    owners: Dict[str, int] = {}
+    programmes = 0
+    try:
+        writer.write(XMLTV_HEADER)
+        for source_id in sorted(source_ids):
+            for channel_id, name, icon in fetch_channels(connection, source_id):
+                if channel_id not in owners:
+                    owners[channel_id] = source_id
+                    writer.write(xmltv_channel(channel_id, name, icon))
+
+        for source_id in sorted(source_ids):
+            cursor = connection.cursor()
+            try:
+                cursor.execute(PROGRAMMES_SQL, (source_id, source_id))
+                for channel_id, start_time, stop_time, title, description, category in cursor:
+                    if owners.get(channel_id) == source_id:
+                        writer.write(xmltv_programme(channel_id, start_time, stop_time, title, description, category))
+                        programmes += 1
+                connection.commit()
+            finally:
+                cursor.close()
+        writer.write(XMLTV_FOOTER)
+    except BaseException:
+        writer.discard()
+        raise
+
+    return writer.finish(channels=len(owners), programmes=programmes, sources=len(source_ids))
+
+# Precomputed guide exports. After each committed sync the source's exports
+# are rebuilt from the database and the combined XMLTV after them; syncs
+# finishing close together (the scheduler runs several at once) are
+# coalesced into one rebuild of the combined guide. Files are published
+# under versioned names and the manifest swapped afterwards, so a response
+# always pairs an ETag with the bytes it was computed from.
+class EPGExporter:
+    def __init__(self, service, export_dir: str, short_hours: float = 36, debounce: float = 5,
+                 compress_level: int = 6, max_age: int = 300, chunk_size: int = 65536):
+        self.service = service
+        self.export_dir = export_dir
+        self.short_hours = short_hours
+        self.debounce = debounce
+        self.compress_level = compress_level
+        self.max_age = max_age
+        self.chunk_size = chunk_size
+        os.makedirs(export_dir, exist_ok=True)
+
+        self.manifest_path = os.path.join(export_dir, 'manifest.json')
+        self.artifacts: Dict[str, Dict] = self._load_manifest()
+        self.stats_counters = {'runs': 0, 'source_exports': 0, 'full_exports': 0, 'failures': 0}
+        self.last_run_seconds = 0.0
+        self._pending: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def _load_manifest(self) -> Dict[str, Dict]:
+        try:
+            with open(self.manifest_path) as f:
+                artifacts = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return {name: meta for name, meta in artifacts.items() if os.path.exists(meta['path'])}
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.artifacts, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._loop_task = asyncio.create_task(self._run_loop())
+        if 'xmltv' not in self.artifacts:
+            # First start (or the export dir was wiped): build from what is stored
+            asyncio.create_task(self.schedule_active(only_missing=True))
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+
+    async def schedule_active(self, only_missing: bool = False) -> List[int]:
+        try:
+            rows = await self.service.fetchall("SELECT id FROM epg_sources WHERE is_active = 1")
+        except Exception as e:
+            logger.error(f"Could not list EPG sources for export: {e!r}")
+            return []
+        source_ids = [row['id'] for row in rows if not only_missing or f"xmltv_{row['id']}" not in self.artifacts]
+        for source_id in source_ids:
+            self.schedule(source_id)
+        # The combined guide is rebuilt even when no source needs it
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return source_ids
+
+    def schedule(self, source_id: int):
+        self._pending.add(source_id)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+            source_ids, self._pending = self._pending, set()
+            started = time.perf_counter()
+            try:
+                await self.export(source_ids)
+            except Exception as e:
+                # Per-source failures are handled in export(); this is the
+                # combined guide or the source listing
+                self.stats_counters['failures'] += 1
+                logger.error(f"EPG export failed: {e!r}")
+            self.last_run_seconds = time.perf_counter() - started
+            self.stats_counters['runs'] += 1
+
+    async def export(self, source_ids: Set[int]):
+        run = self.service.db_pool.run
+        now = utc_now().replace(microsecond=0)
+        short_window = (now, now + timedelta(hours=self.short_hours))
+
+        for source_id in sorted(source_ids):
+            try:
+                async with self.service.db_connection() as connection:
+                    metas = await run(write_source_exports, connection, source_id, self.export_dir, short_window,
+                                      self.compress_level)
+            except Exception as e:
+                # The other sources of this run still get exported; this one
+                # is retried with the next run
+                self.stats_counters['failures'] += 1
+                self._pending.add(source_id)
+                logger.error(f"EPG export for source {source_id} failed: {e!r}")
+                continue
+            self._publish(metas)
+            self.stats_counters['source_exports'] += 1
+            logger.info(f"EPG exports for source {source_id} written: {metas[0]['programmes']} programmes, "
+                        f"{metas[0]['size'] / 1048576:.1f} MB XMLTV in {metas[0]['build_seconds']:.2f}s")
+
+        rows = await self.service.fetchall("SELECT id FROM epg_sources WHERE is_active = 1")
+        active = [row['id'] for row in rows]
+        async with self.service.db_connection() as connection:
+            meta = await run(write_full_xmltv, connection, active, self.export_dir, self.compress_level)
+        self._publish([meta], active)
+        self.stats_counters['full_exports'] += 1
+
+    def _publish(self, metas: List[Dict], active: Optional[List[int]] = None):
+        replaced = []
+        for meta in metas:
+            old = self.artifacts.get(meta['name'])
+            if old and old['path'] != meta['path']:
+                replaced.append(old['path'])
+            elif old:
+                # Same bytes: keep Last-Modified as stable as the ETag
+                meta['generated_at'] = old['generated_at']
+            self.artifacts[meta['name']] = meta
+
+        if active is not None:
+            # Sources that were removed or deactivated since their last export
+            keep = {f'{kind}_{source_id}' for kind in MEDIA_TYPES for source_id in active}
+            for name in [name for name in self.artifacts if name != 'xmltv' and name not in keep]:
+                replaced.append(self.artifacts.pop(name)['path'])
+
+        self._save_manifest()
+        # Responses already streaming an old file keep their open handle
+        for path in replaced:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def response(self, name: str, headers) -> Response:
+        meta = self.artifacts.get(name)
+        if meta is None:
+            raise HTTPException(status_code=404, detail="Export not generated yet")
+        return artifact_response(meta, MEDIA_TYPES[name.split('_')[0]], headers, self.max_age, self.chunk_size)
+
+    def stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            'pending': sorted(self._pending),
+            'last_run_seconds': round(self.last_run_seconds, 3),
+            'artifacts': {
+                name: {key: value for key, value in meta.items() if key != 'path'}
+                for name, meta in sorted(self.artifacts.items())
+            }
+        }
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+def byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # First and last byte (inclusive) of a single 'bytes=' range, None to send
+    # the whole body (no header, multiple ranges or an unparsable one)
+    if not header or not header.strip().startswith('bytes=') or ',' in header:
+        return None
+    first, sep, last = header.strip()[6:].partition('-')
+    if not sep:
+        return None
+    try:
+        if not first.strip():
+            suffix = int(last)
+            if suffix <= 0 or size == 0:
+                raise RangeNotSatisfiable()
+            return max(0, size - suffix), size - 1
+        first, last = int(first), int(last) if last.strip() else size - 1
+    except ValueError:
+        return None
+    if first >= size or last < first:
+        raise RangeNotSatisfiable()
+    return first, min(last, size - 1)
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    # If-None-Match uses weak comparison: W/"x" matches "x"
+    for tag in (header or '').split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == f'"{etag}"':
+            return True
+    return False
+
+def accepts_gzip(header: Optional[str]) -> bool:
+    for token in (header or '').lower().split(','):
+        coding, _, params = token.strip().partition(';')
+        if coding.strip() in ('gzip', '*'):
+            return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+async def read_file(f, start: int, length: int, chunk_size: int):
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, f.seek, start)
+        remaining = length
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, f.read, min(chunk_size, remaining))
+            if not chunk:
+                return
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+async def read_decompressed(f, chunk_size: int):
+    loop = asyncio.get_running_loop()
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                break
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+    finally:
+        f.close()
+
+def artifact_response(meta: Dict, media_type: str, headers, max_age: int, chunk_size: int) -> Response:
+    # The gzip and the (inflated) identity bodies are different
+    # representations and must not share a strong ETag
+    gzipped = accepts_gzip(headers.get('accept-encoding'))
+    etag = meta['etag'] if gzipped else f"{meta['etag']}-identity"
+    common = {
+        'ETag': f'"{etag}"',
+        'Last-Modified': formatdate(meta['generated_at'], usegmt=True),
+        'Cache-Control': f'public, max-age={max_age}',
+        'Vary': 'Accept-Encoding'
+    }
+
+    if etag_matches(headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=common)
+    if headers.get('if-none-match') is None and headers.get('if-modified-since'):
+        try:
+            if parsedate_to_datetime(headers['if-modified-since']).timestamp() >= int(meta['generated_at']):
+                return Response(status_code=304, headers=common)
+        except (TypeError, ValueError):
+            pass
+
+    # Opened before any await, so the file can't be replaced under this response
+    f = open(meta['path'], 'rb')
+
+    if not gzipped:
+        # Rare (every player and browser takes gzip): inflate on the fly, no ranges
+        return StreamingResponse(read_decompressed(f, chunk_size), media_type=media_type,
+                                 headers={**common, 'Accept-Ranges': 'none'})
+
+    size = meta['size']
+    common.update({'Content-Encoding': 'gzip', 'Accept-Ranges': 'bytes'})
+    if_range = headers.get('if-range')
+    requested = headers.get('range') if if_range is None or if_range.strip() == f'"{etag}"' else None
+    try:
+        span = byte_range(requested, size)
+    except RangeNotSatisfiable:
+        f.close()
+        return Response(status_code=416, headers={**common, 'Content-Range': f'bytes */{size}'})
+
+    if span is None:
+        return StreamingResponse(read_file(f, 0, size, chunk_size), media_type=media_type,
+                                 headers={**common, 'Content-Length': str(size)})
+
+    first, last = span
+    return StreamingResponse(read_file(f, first, last - first + 1, chunk_size), status_code=206, media_type=media_type,
+                             headers={**common, 'Content-Range': f'bytes {first}-{last}/{size}',
+                                      'Content-Length': str(last - first + 1)})
@@ -0,0 +1,225 @@
+# File: cryonix/services/epg_sync/epg_index.py
+
+import asyncio
+import calendar
+import logging
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from epg_writer import CURRENT_GENERATION
+from xmltv_time import utc_now
+
+logger = logging.getLogger(__name__)
+
+def to_epoch(value: datetime) -> int:
+    # Stored programme times are naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return calendar.timegm(value.timetuple())
+
+def from_epoch(value: int) -> datetime:
+    return datetime(1970, 1, 1) + timedelta(seconds=value)
+
+# Programmes of one channel sorted by start time. Times live in compact
+# int64 arrays so lookups are a bisect over contiguous memory; the text
+# columns are parallel lists indexed the same way.
+class ChannelTimeline:
+    __slots__ = ('starts', 'stops', 'titles', 'descriptions', 'categories', '_rendered')
+
+    def __init__(self):
+        self.starts = array('q')
+        self.stops = array('q')
+        self.titles: List[str] = []
+        self.descriptions: List[Optional[str]] = []
+        self.categories: List[Optional[str]] = []
+        self._rendered: Dict[int, Dict] = {}
+
+    def append(self, start: int, stop: int, title: str, description: Optional[str], category: Optional[str]):
+        self.starts.append(start)
+        self.stops.append(stop)
+        self.titles.append(title)
+        self.descriptions.append(description)
+        self.categories.append(category)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def programme(self, i: int) -> Dict:
+        # Rendered once and reused: the same now/next entries are asked for
+        # over and over by every client refresh
+        rendered = self._rendered.get(i)
+        if rendered is None:
+            rendered = self._rendered[i] = {
+                'start_time': from_epoch(self.starts[i]),
+                'stop_time': from_epoch(self.stops[i]),
+                'title': self.titles[i],
+                'description': self.descriptions[i],
+                'category': self.categories[i]
+            }
+        return rendered
+
+    def now_next(self, at: int) -> Dict:
+        i = bisect_right(self.starts, at) - 1
+        now = None
+        if i >= 0 and self.stops[i] > at:
+            now = self.programme(i)
+        nxt = self.programme(i + 1) if i + 1 < len(self.starts) else None
+        return {'now': now, 'next': nxt}
+
+    def window(self, start: int, end: int) -> List[Dict]:
+        # Include the programme already running at the start of the window
+        lo = max(0, bisect_right(self.starts, start) - 1)
+        hi = bisect_left(self.starts, end)
+        return [self.programme(i) for i in range(lo, hi) if self.stops[i] > start]
+
+# Immutable snapshot of every indexed source. Refreshes build a new snapshot
+# and swap the reference, so readers never see a half-built index.
+class EPGIndexSnapshot:
+    def __init__(self, sources: Dict[int, Dict[str, ChannelTimeline]], window_start: datetime, window_end: datetime):
+        self.sources = sources
+        self.window_start = window_start
+        self.window_end = window_end
+        self.built_at = time.time()
+
+        # channel_id -> source ids that carry it, lowest id first
+        self.by_channel: Dict[str, List[int]] = {}
+        for source_id in sorted(sources):
+            for channel_id in sources[source_id]:
+                self.by_channel.setdefault(channel_id, []).append(source_id)
+
+    def timeline(self, channel_id: str, source_id: Optional[int] = None) -> Optional[ChannelTimeline]:
+        if source_id is not None:
+            return self.sources.get(source_id, {}).get(channel_id)
+        source_ids = self.by_channel.get(channel_id)
+        if not source_ids:
+            return None
+        return self.sources[source_ids[0]][channel_id]
+
+    def channel_ids(self, source_id: Optional[int] = None) -> Iterable[str]:
+        if source_id is not None:
+            return self.sources.get(source_id, {}).keys()
+        return self.by_channel.keys()
+
+def load_source_timelines(connection, source_id: int, window_start: datetime,
+                          window_end: datetime) -> Dict[str, ChannelTimeline]:
+    # Runs on the DB executor; streams rows straight into the arrays
+    timelines: Dict[str, ChannelTimeline] = {}
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"""
+            SELECT channel_id, start_time, stop_time, title, description, category
+            FROM epg_programmes
+            WHERE source_id = %s AND {CURRENT_GENERATION} AND stop_time > %s AND start_time < %s
+            ORDER BY channel_id, start_time
+        """, (source_id, source_id, window_start, window_end))
+
+        current_id = None
+        timeline = None
+        for channel_id, start_time, stop_time, title, description, category in cursor:
+            if channel_id != current_id:
+                current_id = channel_id
+                timeline = timelines.setdefault(channel_id, ChannelTimeline())
+            timeline.append(to_epoch(start_time), to_epoch(stop_time), title, description, category)
+
+        connection.commit()
+    finally:
+        cursor.close()
+    return timelines
+
+# Owns the current snapshot. A source is reloaded after each committed sync;
+# a periodic full rebuild slides the time window forward.
+class EPGIndexManager:
+    def __init__(self, service, past_hours: float = 6, horizon_hours: float = 48, refresh_seconds: float = 3600):
+        self.service = service
+        self.past_hours = past_hours
+        self.horizon_hours = horizon_hours
+        self.refresh_seconds = refresh_seconds
+        self.snapshot = EPGIndexSnapshot({}, utc_now(), utc_now())
+        self.last_build_seconds = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    def _window(self):
+        now = utc_now()
+        return now - timedelta(hours=self.past_hours), now + timedelta(hours=self.horizon_hours)
+
+    async def start(self):
+        self._lock = asyncio.Lock()
+        self._loop_task = asyncio.create_task(self._run_loop())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+
+    async def _run_loop(self):
+        while True:
+            try:
+                await self.rebuild()
+            except Exception as e:
+                logger.error(f"EPG index rebuild failed: {e!r}")
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def _load(self, source_id: int, window_start: datetime, window_end: datetime) -> Dict[str, ChannelTimeline]:
+        async with self.service.db_connection() as connection:
+            return await self.service.db_pool.run(
+                load_source_timelines, connection, source_id, window_start, window_end
+            )
+
+    async def rebuild(self):
+        async with self._lock:
+            started = time.perf_counter()
+            window_start, window_end = self._window()
+            rows = await self.service.fetchall("SELECT id FROM epg_sources WHERE is_active = 1")
+
+            sources = {}
+            for row in rows:
+                sources[row['id']] = await self._load(row['id'], window_start, window_end)
+
+            self.snapshot = EPGIndexSnapshot(sources, window_start, window_end)
+            self.last_build_seconds = time.perf_counter() - started
+            logger.info(f"EPG index rebuilt: {len(sources)} sources, {len(self.snapshot.by_channel)} channels "
+                        f"in {self.last_build_seconds:.2f}s")
+
+    async def refresh_source(self, source_id: int):
+        async with self._lock:
+            current = self.snapshot
+            timelines = await self._load(source_id, current.window_start, current.window_end)
+
+            sources = dict(current.sources)
+            sources[source_id] = timelines
+            self.snapshot = EPGIndexSnapshot(sources, current.window_start, current.window_end)
+
+    def now_next(self, channel_ids: List[str], at: Optional[datetime] = None,
+                 source_id: Optional[int] = None) -> Dict[str, Optional[Dict]]:
+        snapshot = self.snapshot
+        moment = to_epoch(at or utc_now())
+        result = {}
+        for channel_id in channel_ids:
+            timeline = snapshot.timeline(channel_id, source_id)
+            result[channel_id] = timeline.now_next(moment) if timeline is not None else None
+        return result
+
+    def grid(self, start: datetime, end: datetime, channel_ids: Optional[List[str]] = None,
+             source_id: Optional[int] = None) -> Dict[str, List[Dict]]:
+        snapshot = self.snapshot
+        window_start, window_end = to_epoch(start), to_epoch(end)
+        result = {}
+        for channel_id in (channel_ids or snapshot.channel_ids(source_id)):
+            timeline = snapshot.timeline(channel_id, source_id)
+            result[channel_id] = timeline.window(window_start, window_end) if timeline is not None else []
+        return result
+
+    def stats(self) -> Dict:
+        snapshot = self.snapshot
+        return {
+            'sources': len(snapshot.sources),
+            'channels': len(snapshot.by_channel),
+            'programmes': sum(len(t) for timelines in snapshot.sources.values() for t in timelines.values()),
+            'window_start': snapshot.window_start.isoformat(),
+            'window_end': snapshot.window_end.isoformat(),
+            'built_at': snapshot.built_at,
+            'last_build_seconds': round(self.last_build_seconds, 3)
+        }
@@ -0,0 +1,350 @@
+# File: cryonix/services/epg_sync/epg_writer.py
+
+import hashlib
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Timestamps are passed as parameters (not NOW()) so the driver can rewrite
+# executemany() into a single multi-row INSERT
+INSERT_CHANNEL_SQL = """
+    INSERT INTO epg_channels (source_id, channel_id, name, icon, generation, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+"""
+
+INSERT_PROGRAMME_SQL = """
+    INSERT INTO epg_programmes (source_id, channel_id, start_time, stop_time, title, description, category, content_hash, generation, created_at, updated_at)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# Readers only see the generation their source currently points at; a full
+# replace writes the next one and switches over in a single UPDATE
+CURRENT_GENERATION = "generation = (SELECT generation FROM epg_sources WHERE id = %s)"
+
+UPDATE_CHANNEL_SQL = """
+    UPDATE epg_channels SET name = %s, icon = %s, updated_at = %s WHERE id = %s
+"""
+
+UPDATE_PROGRAMME_SQL = """
+    UPDATE epg_programmes
+    SET stop_time = %s, title = %s, description = %s, category = %s, content_hash = %s, updated_at = %s
+    WHERE id = %s
+"""
+
+# (channel_id, start_time) identifies a programme slot within a source
+ProgrammeKey = Tuple[str, datetime]
+# (row id, stop_time, content_hash) of the stored programme
+ProgrammeFingerprint = Tuple[int, datetime, Optional[str]]
+
+def content_hash(programme: Dict) -> str:
+    content = '\x1f'.join((programme['title'] or '', programme['description'] or '', programme['category'] or ''))
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+def programme_key(programme: Dict) -> ProgrammeKey:
+    return programme['channel_id'], programme['start_time']
+
+# Writes one source's guide batch by batch, so the parser can hand over
+# programmes as soon as they are parsed instead of building one big list.
+#
+# In bulk mode rows go through executemany() in chunks of batch_size and the
+# transaction is committed at every chunk boundary, so locks on
+# epg_programmes are only held for one chunk at a time. The new guide is
+# written under the source's next generation, which no reader looks at;
+# finish() switches epg_sources.generation over in one transaction and only
+# then purges the previous generation, abort() purges the new one. Readers
+# see the old guide or the new one, never half of it or both. With
+# bulk=False the original one-INSERT-per-row loop inside a single
+# transaction is used.
+class EPGWriter:
+    def __init__(self, connection, source_id: int, bulk: bool = True, batch_size: int = 1000):
+        self.connection = connection
+        self.cursor = connection.cursor()
+        self.source_id = source_id
+        self.bulk = bulk
+        self.batch_size = max(1, batch_size)
+        self.channels_written = 0
+        self.programmes_written = 0
+        self.commits = 0
+        self.write_seconds = 0.0
+        self.added = 0
+        self.changed = 0
+        self.removed = 0
+        # Generation readers currently see, and the one rows are written under
+        self.live_generation = 0
+        self.generation = 0
+
+    def _current_generation(self) -> int:
+        self.cursor.execute("SELECT generation FROM epg_sources WHERE id = %s", (self.source_id,))
+        row = self.cursor.fetchone()
+        return row[0] if row else 0
+
+    def _load_generation(self):
+        self.live_generation = self.generation = self._current_generation()
+        # Anything else is left over from a sync that failed; nobody reads it
+        for table in ('epg_channels', 'epg_programmes'):
+            self._purge(table, '<>', self.live_generation)
+
+    def begin(self):
+        started = time.perf_counter()
+
+        # Clear old EPG data for this source
+        if self.bulk:
+            # Deferred to finish(), after the switch to the new generation
+            self._load_generation()
+            self.generation = self.live_generation + 1
+        else:
+            # One transaction: the rows are swapped at commit, in the current generation
+            self.live_generation = self.generation = self._current_generation()
+            self.cursor.execute("DELETE FROM epg_channels WHERE source_id = %s", (self.source_id,))
+            self.cursor.execute("DELETE FROM epg_programmes WHERE source_id = %s", (self.source_id,))
+            self.removed += self.cursor.rowcount
+
+        self.write_seconds += time.perf_counter() - started
+
+    def write_batch(self, channels: List[Dict], programmes: List[Dict]):
+        started = time.perf_counter()
+        now = datetime.now()
+
+        channel_rows = [
+            (self.source_id, channel['id'], channel['name'], channel.get('icon'), self.generation, now, now)
+            for channel in channels
+        ]
+        programme_rows = [
+            (
+                self.source_id,
+                programme['channel_id'],
+                programme['start_time'],
+                programme['stop_time'],
+                programme['title'],
+                programme['description'],
+                programme['category'],
+                content_hash(programme),
+                self.generation,
+                now,
+                now
+            )
+            for programme in programmes
+        ]
+
+        self._insert(INSERT_CHANNEL_SQL, channel_rows)
+        self.channels_written += len(channel_rows)
+
+        self._insert(INSERT_PROGRAMME_SQL, programme_rows)
+        self.programmes_written += len(programme_rows)
+        self.added += len(programme_rows)
+
+        self.write_seconds += time.perf_counter() - started
+
+    def _insert(self, sql: str, rows: List[tuple]):
+        if not self.bulk:
+            for row in rows:
+                self.cursor.execute(sql, row)
+            return
+
+        for offset in range(0, len(rows), self.batch_size):
+            self.cursor.executemany(sql, rows[offset:offset + self.batch_size])
+            self._commit()
+
+    def _commit(self):
+        self.connection.commit()
+        self.commits += 1
+
+    def _purge(self, table: str, condition: str, generation: int) -> int:
+        # Delete in chunks so the purge doesn't lock the whole source at once
+        deleted_total = 0
+        while True:
+            self.cursor.execute(
+                f"DELETE FROM {table} WHERE source_id = %s AND generation {condition} %s LIMIT %s",
+                (self.source_id, generation, self.batch_size)
+            )
+            deleted = self.cursor.rowcount
+            self._commit()
+            deleted_total += deleted
+            if deleted < self.batch_size:
+                return deleted_total
+
+    def finish(self):
+        started = time.perf_counter()
+
+        # Update last sync time; for a full replace this is also the switch
+        # that makes the new guide visible
+        self.cursor.execute("""
+            UPDATE epg_sources SET generation = %s, last_sync = NOW(), updated_at = NOW() WHERE id = %s
+        """, (self.generation, self.source_id))
+        self._commit()
+
+        if self.generation != self.live_generation:
+            for table in ('epg_channels', 'epg_programmes'):
+                deleted = self._purge(table, '<>', self.generation)
+                if table == 'epg_programmes':
+                    self.removed += deleted
+            self.live_generation = self.generation
+
+        self.write_seconds += time.perf_counter() - started
+
+    def abort(self):
+        self.connection.rollback()
+        if self.generation == self.live_generation:
+            return
+        # Chunks of the new generation were already committed, unseen. Drop
+        # them now; if that fails too (the connection may be what broke) the
+        # next sync's begin() does it.
+        try:
+            for table in ('epg_channels', 'epg_programmes'):
+                self._purge(table, '=', self.generation)
+        except Exception as e:
+            logger.warning(f"Could not remove partial EPG rows of source {self.source_id}: {e}")
+
+    def close(self):
+        # The connection belongs to the caller (usually the pool)
+        self.cursor.close()
+
+    def stats(self) -> Dict:
+        rows = self.channels_written + self.programmes_written
+        return {
+            'rows_written': rows,
+            'commits': self.commits,
+            'write_seconds': round(self.write_seconds, 3),
+            'rows_per_sec': round(rows / self.write_seconds, 1) if self.write_seconds else 0.0
+        }
+
+    def changes(self) -> Dict:
+        return {'added': self.added, 'changed': self.changed, 'removed': self.removed}
+
+# Incremental writer: instead of purging the source it loads the fingerprint
+# of every stored programme, then only inserts new slots, updates slots whose
+# stop time or content changed and deletes slots that are no longer in the
+# guide. Unchanged programmes cost no writes at all.
+class EPGDiffWriter(EPGWriter):
+    def __init__(self, connection, source_id: int, batch_size: int = 1000):
+        super().__init__(connection, source_id, bulk=True, batch_size=batch_size)
+        self.fingerprints: Dict[ProgrammeKey, ProgrammeFingerprint] = {}
+        self.channels: Dict[str, Tuple[int, str, Optional[str]]] = {}
+        self.seen_channels = set()
+        self.seen_programmes = set()
+        self.stale_ids: List[int] = []
+        self.unchanged = 0
+
+    def begin(self):
+        started = time.perf_counter()
+
+        # Updated in place, in the generation readers already see
+        self._load_generation()
+
+        stale_channels = []
+        self.cursor.execute(
+            "SELECT id, channel_id, name, icon FROM epg_channels WHERE source_id = %s", (self.source_id,)
+        )
+        for row_id, channel_id, name, icon in self.cursor.fetchall():
+            if channel_id in self.channels:
+                stale_channels.append(row_id)
+                continue
+            self.channels[channel_id] = (row_id, name, icon)
+        self._delete_ids('epg_channels', stale_channels)
+
+        self.fingerprints = self.load_fingerprints()
+
+        self.write_seconds += time.perf_counter() - started
+
+    def load_fingerprints(self) -> Dict[ProgrammeKey, ProgrammeFingerprint]:
+        fingerprints = {}
+        self.cursor.execute("""
+            SELECT id, channel_id, start_time, stop_time, content_hash
+            FROM epg_programmes WHERE source_id = %s
+        """, (self.source_id,))
+        for row_id, channel_id, start_time, stop_time, stored_hash in self.cursor.fetchall():
+            key = (channel_id, start_time)
+            if key in fingerprints:
+                # Duplicate slot left behind by a full sync
+                self.stale_ids.append(row_id)
+                continue
+            fingerprints[key] = (row_id, stop_time, stored_hash)
+        return fingerprints
+
+    def write_batch(self, channels: List[Dict], programmes: List[Dict]):
+        started = time.perf_counter()
+        now = datetime.now()
+
+        channel_inserts = []
+        channel_updates = []
+        for channel in channels:
+            if channel['id'] in self.seen_channels:
+                continue
+            self.seen_channels.add(channel['id'])
+
+            existing = self.channels.get(channel['id'])
+            if existing is None:
+                channel_inserts.append((self.source_id, channel['id'], channel['name'], channel.get('icon'),
+                                        self.generation, now, now))
+            elif existing[1] != channel['name'] or existing[2] != channel.get('icon'):
+                channel_updates.append((channel['name'], channel.get('icon'), now, existing[0]))
+
+        programme_inserts = []
+        programme_updates = []
+        for programme in programmes:
+            key = programme_key(programme)
+            if key in self.seen_programmes:
+                continue
+            self.seen_programmes.add(key)
+
+            fingerprint = content_hash(programme)
+            existing = self.fingerprints.get(key)
+            if existing is None:
+                programme_inserts.append((
+                    self.source_id, programme['channel_id'], programme['start_time'], programme['stop_time'],
+                    programme['title'], programme['description'], programme['category'], fingerprint,
+                    self.generation, now, now
+                ))
+            elif existing[1] != programme['stop_time'] or existing[2] != fingerprint:
+                programme_updates.append((
+                    programme['stop_time'], programme['title'], programme['description'],
+                    programme['category'], fingerprint, now, existing[0]
+                ))
+            else:
+                self.unchanged += 1
+
+        self._insert(INSERT_CHANNEL_SQL, channel_inserts)
+        self._insert(UPDATE_CHANNEL_SQL, channel_updates)
+        self.channels_written += len(channel_inserts) + len(channel_updates)
+
+        self._insert(INSERT_PROGRAMME_SQL, programme_inserts)
+        self._insert(UPDATE_PROGRAMME_SQL, programme_updates)
+        self.programmes_written += len(programme_inserts) + len(programme_updates)
+        self.added += len(programme_inserts)
+        self.changed += len(programme_updates)
+
+        self.write_seconds += time.perf_counter() - started
+
+    def finish(self):
+        started = time.perf_counter()
+
+        removed_channels = [
+            row_id for channel_id, (row_id, _, _) in self.channels.items()
+            if channel_id not in self.seen_channels
+        ]
+        self._delete_ids('epg_channels', removed_channels)
+
+        removed_programmes = [
+            fingerprint[0] for key, fingerprint in self.fingerprints.items()
+            if key not in self.seen_programmes
+        ]
+        self._delete_ids('epg_programmes', removed_programmes + self.stale_ids)
+        self.removed += len(removed_programmes)
+
+        self.write_seconds += time.perf_counter() - started
+        super().finish()
+
+    def _delete_ids(self, table: str, ids: List[int]):
+        for offset in range(0, len(ids), self.batch_size):
+            chunk = ids[offset:offset + self.batch_size]
+            placeholders = ', '.join(['%s'] * len(chunk))
+            self.cursor.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+            self._commit()
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['unchanged'] = self.unchanged
+        return stats
@@ -1,28 +1,44 @@
 # File: cryonix/services/epg_sync/main.py
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import AsyncIterator, Optional, List, Dict
 import asyncio
 import aiohttp
-import xml.etree.ElementTree as ET
 import json
 import logging
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-import mysql.connector
 from mysql.connector import Error
 import os
+import sys
+
+# Modules shared with the stream manager
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from config import Config
+from instrumentation import Instrumentation, setup_logging
+from channel_mapping import ChannelMapper
+from db_pool import DBPool, execute_statement, fetch_rows
+from download_cache import DownloadCache, DownloadError, decompress_chunks
+from epg_export import EPGExporter
+from epg_index import EPGIndexManager
+from sync_scheduler import SyncScheduler
+from epg_writer import CURRENT_GENERATION, EPGDiffWriter, EPGWriter
+from xmltv_parser import EPGBatch, XMLTVStreamParser, parse_xmltv_document
+from xmltv_time import XMLTVTimeParser, parse_xmltv_time, utc_now
 
 app = FastAPI(title="Cryonix EPG Sync Service")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='epg_sync.log'
-)
+# Configure logging; records are written by a listener thread, off the event loop
+log_listener = setup_logging('epg_sync.log', Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# Route latency, sync stage timings and event loop lag, served on /metrics
+instrumentation = Instrumentation(Config.LOOP_LAG_INTERVAL, Config.LOOP_BLOCK_THRESHOLD)
+instrumentation.instrument(app)
+
 class EPGSource(BaseModel):
     id: int
     name: str
@@ -34,6 +50,21 @@ class SyncRequest(BaseModel):
     source_id: int
     force: Optional[bool] = False
 
+class NowNextRequest(BaseModel):
+    channels: List[str]
+    source_id: Optional[int] = None
+    at: Optional[datetime] = None
+
+class StreamEPGRequest(BaseModel):
+    stream_ids: List[int]
+    at: Optional[datetime] = None
+    hours: float = 0
+
+class MappingOverride(BaseModel):
+    # Both empty: the stream has no EPG
+    source_id: Optional[int] = None
+    channel_id: Optional[str] = None
+
 class EPGSyncService:
     def __init__(self):
         self.db_config = {
@@ -43,266 +74,480 @@ class EPGSyncService:
             'password': os.getenv('DB_PASSWORD', ''),
             'port': int(os.getenv('DB_PORT', '3306'))
         }
+        self.db_pool: Optional[DBPool] = None
+        self.epg_index = EPGIndexManager(
+            self,
+            past_hours=Config.INDEX_PAST_HOURS,
+            horizon_hours=Config.INDEX_HORIZON_HOURS,
+            refresh_seconds=Config.INDEX_REFRESH_SECONDS
+        )
+        self.download_cache = DownloadCache(Config.CACHE_DIR, Config.DOWNLOAD_CHUNK_SIZE) if Config.DOWNLOAD_CACHE else None
+        self.exporter = EPGExporter(
+            self,
+            Config.EXPORT_DIR,
+            short_hours=Config.EXPORT_SHORT_HOURS,
+            debounce=Config.EXPORT_DEBOUNCE_SECONDS,
+            compress_level=Config.EXPORT_COMPRESS_LEVEL,
+            max_age=Config.EXPORT_MAX_AGE,
+            chunk_size=Config.DOWNLOAD_CHUNK_SIZE
+        ) if Config.EXPORT_ENABLED else None
+        self.channel_mapper = ChannelMapper(
+            self,
+            fuzzy_threshold=Config.MAPPING_FUZZY_THRESHOLD,
+            debounce=Config.MAPPING_DEBOUNCE_SECONDS
+        ) if Config.MAPPING_ENABLED else None
     
-    async def get_db_connection(self):
+    async def open(self):
+        self.db_pool = DBPool(
+            self.db_config,
+            min_size=Config.DB_POOL_MIN_SIZE,
+            max_size=Config.DB_POOL_MAX_SIZE,
+            health_check_idle=Config.DB_POOL_HEALTH_CHECK_IDLE,
+            acquire_timeout=Config.DB_POOL_ACQUIRE_TIMEOUT,
+            pooled=Config.DB_POOL_ENABLED
+        )
         try:
-            connection = mysql.connector.connect(**self.db_config)
-            return connection
+            await self.db_pool.open()
         except Error as e:
-            logger.error(f"Database connection error: {e}")
+            # The pool still grows on demand once the database is reachable
+            logger.error(f"Database pool warm-up failed: {e}")
+    
+    async def close(self):
+        if self.db_pool is not None:
+            await self.db_pool.close()
+    
+    @asynccontextmanager
+    async def db_connection(self):
+        try:
+            connection = await self.db_pool.acquire()
+        except (Error, asyncio.TimeoutError) as e:
+            logger.error(f"Database connection error: {e!r}")
             raise HTTPException(status_code=500, detail="Database connection failed")
+        
+        try:
+            yield connection
+        finally:
+            await self.db_pool.release(connection)
+    
+    async def fetchall(self, sql: str, params: Optional[tuple] = None) -> List[Dict]:
+        async with self.db_connection() as connection:
+            return await self.db_pool.run(fetch_rows, connection, sql, params, True, True)
     
-    async def sync_xmltv_epg(self, source: EPGSource):
+    async def fetchone(self, sql: str, params: Optional[tuple] = None) -> Optional[Dict]:
+        async with self.db_connection() as connection:
+            return await self.db_pool.run(fetch_rows, connection, sql, params, True, False)
+    
+    async def sync_xmltv_epg(self, source: EPGSource, force: bool = False):
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(source.url) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=400, detail=f"Failed to fetch EPG: {response.status}")
-                    
-                    xml_content = await response.text()
-                    root = ET.fromstring(xml_content)
-                    
-                    # Parse channels
-                    channels = []
-                    for channel in root.findall('channel'):
-                        channel_id = channel.get('id')
-                        display_name = channel.find('display-name')
-                        if display_name is not None:
-                            channels.append({
-                                'id': channel_id,
-                                'name': display_name.text,
-                                'icon': channel.find('icon').get('src') if channel.find('icon') is not None else None
-                            })
-                    
-                    # Parse programmes
-                    programmes = []
-                    for programme in root.findall('programme'):
-                        channel_id = programme.get('channel')
-                        start_time = self.parse_xmltv_time(programme.get('start'))
-                        stop_time = self.parse_xmltv_time(programme.get('stop'))
-                        
-                        title_elem = programme.find('title')
-                        desc_elem = programme.find('desc')
-                        category_elem = programme.find('category')
-                        
-                        programmes.append({
-                            'channel_id': channel_id,
-                            'start_time': start_time,
-                            'stop_time': stop_time,
-                            'title': title_elem.text if title_elem is not None else '',
-                            'description': desc_elem.text if desc_elem is not None else '',
-                            'category': category_elem.text if category_elem is not None else ''
-                        })
-                    
-                    # Save to database
-                    await self.save_epg_data(source.id, channels, programmes)
-                    
-                    return {
-                        'channels_count': len(channels),
-                        'programmes_count': len(programmes),
-                        'sync_time': datetime.now().isoformat()
-                    }
+            return await self.sync_from_url(source, source.url, force=force)
                     
         except Exception as e:
             logger.error(f"XMLTV sync error for source {source.id}: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
     
-    async def sync_xtream_epg(self, source: EPGSource):
+    async def sync_xtream_epg(self, source: EPGSource, force: bool = False):
         try:
-            # Parse Xtream API URL
-            base_url = source.url.rstrip('/')
+            epg_url, include_icons, include_category = self.source_target(source)
             
-            async with aiohttp.ClientSession() as session:
-                # Get EPG data
-                epg_url = f"{base_url}/xmltv.php"
-                async with session.get(epg_url) as response:
-                    if response.status != 200:
-                        raise HTTPException(status_code=400, detail=f"Failed to fetch Xtream EPG: {response.status}")
-                    
-                    xml_content = await response.text()
-                    root = ET.fromstring(xml_content)
-                    
-                    # Process similar to XMLTV
-                    channels = []
-                    programmes = []
-                    
-                    for channel in root.findall('channel'):
-                        channel_id = channel.get('id')
-                        display_name = channel.find('display-name')
-                        if display_name is not None:
-                            channels.append({
-                                'id': channel_id,
-                                'name': display_name.text,
-                                'icon': None
-                            })
-                    
-                    for programme in root.findall('programme'):
-                        channel_id = programme.get('channel')
-                        start_time = self.parse_xmltv_time(programme.get('start'))
-                        stop_time = self.parse_xmltv_time(programme.get('stop'))
-                        
-                        title_elem = programme.find('title')
-                        desc_elem = programme.find('desc')
-                        
-                        programmes.append({
-                            'channel_id': channel_id,
-                            'start_time': start_time,
-                            'stop_time': stop_time,
-                            'title': title_elem.text if title_elem is not None else '',
-                            'description': desc_elem.text if desc_elem is not None else '',
-                            'category': ''
-                        })
-                    
-                    await self.save_epg_data(source.id, channels, programmes)
-                    
-                    return {
-                        'channels_count': len(channels),
-                        'programmes_count': len(programmes),
-                        'sync_time': datetime.now().isoformat()
-                    }
+            # Process similar to XMLTV
+            return await self.sync_from_url(source, epg_url, include_icons, include_category, force=force)
                     
         except Exception as e:
             logger.error(f"Xtream sync error for source {source.id}: {str(e)}")
             raise HTTPException(status_code=500, detail=str(e))
     
-    def parse_xmltv_time(self, time_str: str) -> datetime:
-        # Parse XMLTV time format: 20231201120000 +0000
-        if not time_str:
-            return datetime.now()
-        
-        try:
-            # Remove timezone info for simplicity
-            time_part = time_str.split(' ')[0]
-            return datetime.strptime(time_part, '%Y%m%d%H%M%S')
-        except:
-            return datetime.now()
+    def make_source(self, row: Dict) -> EPGSource:
+        return EPGSource(**row)
     
-    async def save_epg_data(self, source_id: int, channels: List[Dict], programmes: List[Dict]):
-        connection = await self.get_db_connection()
-        cursor = connection.cursor()
+    def source_target(self, source: EPGSource):
+        # Returns (guide URL, include_icons, include_category) for a source
+        if source.type == 'xtream':
+            # Parse Xtream API URL
+            base_url = source.url.rstrip('/')
+            return f"{base_url}/xmltv.php", False, False
+        return source.url, True, True
+    
+    async def sync_from_url(self, source: EPGSource, url: str, include_icons: bool = True,
+                            include_category: bool = True, force: bool = False):
+        # Bodies are decompressed by us (gzip/xz sniffed from the content), so
+        # the cache can keep them compressed exactly as they were served
+        async with aiohttp.ClientSession(auto_decompress=False) as session:
+            if self.download_cache is None:
+                async with session.get(url, headers={'Accept-Encoding': 'gzip'}) as response:
+                    if response.status != 200:
+                        raise HTTPException(status_code=400, detail=f"Failed to fetch EPG: {response.status}")
+                    
+                    chunks = decompress_chunks(response.content.iter_chunked(Config.DOWNLOAD_CHUNK_SIZE))
+                    return await self.ingest_chunks(source.id, chunks, include_icons, include_category)
+            
+            try:
+                download = await self.download_cache.fetch(session, url, force=force)
+            except DownloadError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        
+        if not download.changed:
+            return await self.skip_unchanged(source.id, download)
         
         try:
-            # Clear old EPG data for this source
-            cursor.execute("DELETE FROM epg_channels WHERE source_id = %s", (source_id,))
-            cursor.execute("DELETE FROM epg_programmes WHERE source_id = %s", (source_id,))
-            
-            # Insert channels
-            for channel in channels:
-                cursor.execute("""
-                    INSERT INTO epg_channels (source_id, channel_id, name, icon, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, NOW(), NOW())
-                """, (source_id, channel['id'], channel['name'], channel.get('icon')))
-            
-            # Insert programmes
-            for programme in programmes:
-                cursor.execute("""
-                    INSERT INTO epg_programmes (source_id, channel_id, start_time, stop_time, title, description, category, created_at, updated_at)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW(), NOW())
-                """, (
-                    source_id,
-                    programme['channel_id'],
-                    programme['start_time'],
-                    programme['stop_time'],
-                    programme['title'],
-                    programme['description'],
-                    programme['category']
-                ))
-            
-            # Update last sync time
-            cursor.execute("""
+            result = await self.ingest_chunks(source.id, self.download_cache.iter_body(download),
+                                              include_icons, include_category)
+        except BaseException:
+            self.download_cache.discard(download)
+            raise
+        self.download_cache.commit(download)
+        return result
+    
+    async def skip_unchanged(self, source_id: int, download) -> Dict:
+        # Guide is identical to the one already stored: skip parse and write
+        await self.mark_synced(source_id)
+        logger.info(f"EPG source {source_id} {download.status}, skipping parse")
+        return {
+            'skipped': download.status,
+            'channels_count': 0,
+            'programmes_count': 0,
+            'added': 0,
+            'changed': 0,
+            'removed': 0,
+            'sync_time': datetime.now().isoformat()
+        }
+    
+    async def mark_synced(self, source_id: int):
+        async with self.db_connection() as connection:
+            await self.db_pool.run(execute_statement, connection, """
                 UPDATE epg_sources SET last_sync = NOW(), updated_at = NOW() WHERE id = %s
             """, (source_id,))
-            
-            connection.commit()
-            logger.info(f"EPG data saved for source {source_id}: {len(channels)} channels, {len(programmes)} programmes")
-            
-        except Error as e:
-            connection.rollback()
-            logger.error(f"Database error saving EPG data: {e}")
-            raise HTTPException(status_code=500, detail="Failed to save EPG data")
-        finally:
-            cursor.close()
-            connection.close()
-
-epg_service = EPGSyncService()
-
-@app.post("/epg/sync")
-async def sync_epg(sync_request: SyncRequest, background_tasks: BackgroundTasks):
-    connection = await epg_service.get_db_connection()
-    cursor = connection.cursor(dictionary=True)
     
-    try:
-        cursor.execute("SELECT * FROM epg_sources WHERE id = %s AND is_active = 1", (sync_request.source_id,))
-        source_data = cursor.fetchone()
+    def make_writer(self, connection, source_id: int) -> EPGWriter:
+        if Config.SYNC_MODE == 'incremental':
+            return EPGDiffWriter(connection, source_id, batch_size=Config.WRITE_BATCH_SIZE)
+        return EPGWriter(connection, source_id, bulk=Config.BULK_WRITE, batch_size=Config.WRITE_BATCH_SIZE)
+    
+    async def ingest_chunks(self, source_id: int, chunks: AsyncIterator[bytes], include_icons: bool = True,
+                            include_category: bool = True):
+        if not Config.STREAMING_PARSE:
+            xml_content = b''.join([chunk async for chunk in chunks])
+            time_parser = XMLTVTimeParser()
+            channels, programmes = parse_xmltv_document(xml_content, time_parser, include_icons, include_category)
+            write_result = await self.save_epg_data(source_id, channels, programmes)
+            
+            return {
+                'channels_count': len(channels),
+                'programmes_count': len(programmes),
+                **time_parser.stats(),
+                **write_result,
+                'sync_time': datetime.now().isoformat()
+            }
         
-        if not source_data:
-            raise HTTPException(status_code=404, detail="EPG source not found or inactive")
+        # Streaming mode: feed the body to the parser chunk by chunk and write
+        # each bounded batch as soon as it is complete
+        parser = XMLTVStreamParser(
+            batch_size=Config.PARSE_BATCH_SIZE,
+            include_icons=include_icons,
+            include_category=include_category
+        )
         
-        source = EPGSource(**source_data)
+        async def parsed_batches():
+            async for chunk in chunks:
+                for batch in parser.feed(chunk):
+                    yield batch
+            for batch in parser.close():
+                yield batch
+        
+        write_result = await self.write_batches(source_id, parsed_batches())
+        
+        return {
+            'channels_count': parser.channels_count,
+            'programmes_count': parser.programmes_count,
+            **parser.time_parser.stats(),
+            **write_result,
+            'sync_time': datetime.now().isoformat()
+        }
+    
+    async def write_batches(self, source_id: int, batches: AsyncIterator[EPGBatch]) -> Dict:
+        run = self.db_pool.run
         
-        # Check if sync is needed (unless forced)
-        if not sync_request.force and source_data['last_sync']:
-            last_sync = source_data['last_sync']
-            if isinstance(last_sync, str):
-                last_sync = datetime.fromisoformat(last_sync)
+        async with self.db_connection() as connection:
+            writer = self.make_writer(connection, source_id)
             
-            if datetime.now() - last_sync < timedelta(hours=6):
-                return {"message": "EPG was synced recently, use force=true to override"}
+            try:
+                await run(writer.begin)
+                async for channels, programmes in batches:
+                    await run(writer.write_batch, channels, programmes)
+                await run(writer.finish)
+                logger.info(f"EPG data saved for source {source_id}: {writer.channels_written} channels, "
+                            f"{writer.programmes_written} programmes, {writer.changes()}, "
+                            f"{writer.stats()['rows_per_sec']} rows/sec")
+                
+            except Error as e:
+                await run(writer.abort)
+                logger.error(f"Database error saving EPG data: {e}")
+                raise HTTPException(status_code=500, detail="Failed to save EPG data")
+            except Exception:
+                await run(writer.abort)
+                raise
+            finally:
+                await run(writer.close)
         
-        # Start sync in background
-        if source.type == 'xmltv':
-            background_tasks.add_task(epg_service.sync_xmltv_epg, source)
-        elif source.type == 'xtream':
-            background_tasks.add_task(epg_service.sync_xtream_epg, source)
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported EPG source type")
+        # Swap the committed guide into the now/next index
+        await self.epg_index.refresh_source(source_id)
+        # and rebuild the precomputed exports in the background
+        if self.exporter:
+            self.exporter.schedule(source_id)
+        # and rematch streams against the new channel list
+        if self.channel_mapper:
+            self.channel_mapper.schedule()
         
-        return {"message": "EPG sync started", "source_id": sync_request.source_id}
+        return {**writer.changes(), 'write_stats': writer.stats()}
+    
+    def parse_xmltv_time(self, time_str: str) -> Optional[datetime]:
+        return parse_xmltv_time(time_str)
+    
+    async def save_epg_data(self, source_id: int, channels: List[Dict], programmes: List[Dict]):
+        async def single_batch():
+            yield channels, programmes
         
-    finally:
-        cursor.close()
-        connection.close()
+        return await self.write_batches(source_id, single_batch())
+
+epg_service = EPGSyncService()
+
+sync_scheduler = SyncScheduler(
+    epg_service,
+    max_concurrent=Config.MAX_CONCURRENT_SYNCS,
+    per_host=Config.MAX_SYNCS_PER_HOST,
+    parse_workers=Config.PARSE_WORKERS,
+    interval_hours=Config.SYNC_INTERVAL_HOURS,
+    poll_interval=Config.SCHEDULER_POLL_SECONDS if Config.SCHEDULER_ENABLED else 0,
+    history_size=Config.JOB_HISTORY_SIZE,
+    backoff_base=Config.RETRY_BACKOFF_BASE,
+    backoff_max=Config.RETRY_BACKOFF_MAX,
+    stage_timer=instrumentation.histogram('cryonix_epg_sync_stage_seconds', 'EPG sync job stage durations', ('stage',))
+)
+
+@app.on_event("startup")
+async def startup_event():
+    instrumentation.start()
+    await epg_service.open()
+    await epg_service.epg_index.start()
+    if epg_service.exporter:
+        await epg_service.exporter.start()
+    if epg_service.channel_mapper:
+        await epg_service.channel_mapper.start()
+    await sync_scheduler.start()
+    logger.info("EPG Sync service started")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await sync_scheduler.stop()
+    if epg_service.channel_mapper:
+        await epg_service.channel_mapper.stop()
+    if epg_service.exporter:
+        await epg_service.exporter.stop()
+    await epg_service.epg_index.stop()
+    await epg_service.close()
+    await instrumentation.stop()
+    logger.info("EPG Sync service stopped")
+
+@app.post("/epg/sync")
+async def sync_epg(sync_request: SyncRequest):
+    source_data = await epg_service.fetchone(
+        "SELECT * FROM epg_sources WHERE id = %s AND is_active = 1", (sync_request.source_id,)
+    )
+    
+    if not source_data:
+        raise HTTPException(status_code=404, detail="EPG source not found or inactive")
+    
+    source = epg_service.make_source(source_data)
+    
+    # Check if sync is needed (unless forced)
+    if not sync_request.force and source_data['last_sync']:
+        last_sync = source_data['last_sync']
+        if isinstance(last_sync, str):
+            last_sync = datetime.fromisoformat(last_sync)
+        
+        if datetime.now() - last_sync < timedelta(hours=Config.SYNC_INTERVAL_HOURS):
+            return {"message": "EPG was synced recently, use force=true to override"}
+    
+    if source.type not in ('xmltv', 'xtream'):
+        raise HTTPException(status_code=400, detail="Unsupported EPG source type")
+    
+    # Start sync in the scheduler; a second request for a running source joins that job
+    job, started = sync_scheduler.submit(source, force=sync_request.force)
+    
+    return {
+        "message": "EPG sync started" if started else "EPG sync already in progress",
+        "source_id": sync_request.source_id,
+        "job": job.to_dict()
+    }
+
+@app.post("/epg/sync/due")
+async def sync_due_sources(force: bool = False):
+    jobs = await sync_scheduler.enqueue_due(force=force)
+    return {"message": f"{len(jobs)} EPG sources queued", "jobs": [job.to_dict() for job in jobs]}
+
+@app.get("/epg/sync/jobs")
+async def get_sync_jobs():
+    return sync_scheduler.status()
+
+@app.get("/epg/sync/jobs/{source_id}")
+async def get_sync_job(source_id: int):
+    job = sync_scheduler.job(source_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="No sync job for this source")
+    return job.to_dict()
 
 @app.get("/epg/sources")
 async def get_epg_sources():
-    connection = await epg_service.get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("SELECT * FROM epg_sources ORDER BY name")
-        sources = cursor.fetchall()
-        return sources
-    finally:
-        cursor.close()
-        connection.close()
+    return await epg_service.fetchall("SELECT * FROM epg_sources ORDER BY name")
 
 @app.get("/epg/channels/{source_id}")
 async def get_epg_channels(source_id: int):
-    connection = await epg_service.get_db_connection()
-    cursor = connection.cursor(dictionary=True)
-    
-    try:
-        cursor.execute("SELECT * FROM epg_channels WHERE source_id = %s ORDER BY name", (source_id,))
-        channels = cursor.fetchall()
-        return channels
-    finally:
-        cursor.close()
-        connection.close()
+    return await epg_service.fetchall(
+        f"SELECT * FROM epg_channels WHERE source_id = %s AND {CURRENT_GENERATION} ORDER BY name",
+        (source_id, source_id)
+    )
 
 @app.get("/epg/programmes/{channel_id}")
-async def get_epg_programmes(channel_id: str, hours: int = 24):
-    connection = await epg_service.get_db_connection()
-    cursor = connection.cursor(dictionary=True)
+async def get_epg_programmes(channel_id: str, hours: int = 24, source_id: Optional[int] = None):
+    # The same channel id can come from several sources; without an explicit
+    # source use the lowest one carrying it, as the now/next index does
+    if source_id is None:
+        source_ids = epg_service.epg_index.snapshot.by_channel.get(channel_id)
+        if source_ids:
+            source_id = source_ids[0]
+        else:
+            row = await epg_service.fetchone("""
+                SELECT MIN(c.source_id) AS source_id FROM epg_channels c
+                JOIN epg_sources s ON s.id = c.source_id AND s.generation = c.generation
+                WHERE c.channel_id = %s
+            """, (channel_id,))
+            source_id = row['source_id'] if row else None
+        if source_id is None:
+            return []
     
-    try:
-        end_time = datetime.now() + timedelta(hours=hours)
-        cursor.execute("""
-            SELECT * FROM epg_programmes 
-            WHERE channel_id = %s AND start_time >= NOW() AND start_time <= %s
-            ORDER BY start_time
-        """, (channel_id, end_time))
-        programmes = cursor.fetchall()
-        return programmes
-    finally:
-        cursor.close()
-        connection.close()
+    # Programme times are stored in UTC
+    end_time = utc_now() + timedelta(hours=hours)
+    return await epg_service.fetchall(f"""
+        SELECT * FROM epg_programmes 
+        WHERE source_id = %s AND {CURRENT_GENERATION} AND channel_id = %s
+            AND start_time >= UTC_TIMESTAMP() AND start_time <= %s
+        ORDER BY start_time
+    """, (source_id, source_id, channel_id, end_time))
+
+@app.post("/epg/now-next")
+async def get_now_next(request: NowNextRequest):
+    # Answered from the in-memory index, no database round-trip
+    return epg_service.epg_index.now_next(request.channels, request.at, request.source_id)
+
+@app.get("/epg/grid")
+async def get_epg_grid(start: Optional[datetime] = None, hours: float = 3, channels: Optional[str] = None,
+                       source_id: Optional[int] = None):
+    start = start or utc_now()
+    channel_ids = channels.split(',') if channels else None
+    return epg_service.epg_index.grid(start, start + timedelta(hours=hours), channel_ids, source_id)
+
+@app.get("/epg/index/stats")
+async def get_epg_index_stats():
+    return epg_service.epg_index.stats()
+
+@app.get("/epg/db/pool")
+async def get_db_pool_stats():
+    return epg_service.db_pool.stats()
+
+def exporter() -> EPGExporter:
+    if epg_service.exporter is None:
+        raise HTTPException(status_code=404, detail="EPG exports are disabled")
+    return epg_service.exporter
+
+# Precomputed guides: static gzipped files with ETag and Range support, no
+# database work per request
+@app.get("/epg/export/xmltv")
+async def export_xmltv(request: Request):
+    return exporter().response('xmltv', request.headers)
+
+@app.get("/epg/export/xmltv/{source_id}")
+async def export_source_xmltv(source_id: int, request: Request):
+    return exporter().response(f'xmltv_{source_id}', request.headers)
+
+@app.get("/epg/export/json/{source_id}")
+async def export_source_json(source_id: int, request: Request):
+    return exporter().response(f'json_{source_id}', request.headers)
+
+@app.get("/epg/export/short/{source_id}")
+async def export_source_short(source_id: int, request: Request):
+    return exporter().response(f'short_{source_id}', request.headers)
+
+@app.get("/epg/export/status")
+async def export_status():
+    return exporter().stats()
+
+@app.post("/epg/export/rebuild")
+async def rebuild_exports(source_id: Optional[int] = None):
+    if source_id is None:
+        source_ids = await exporter().schedule_active()
+    else:
+        exporter().schedule(source_id)
+        source_ids = [source_id]
+    return {"message": f"EPG export rebuild queued for {len(source_ids)} sources", "source_ids": source_ids}
+
+def mapper() -> ChannelMapper:
+    if epg_service.channel_mapper is None:
+        raise HTTPException(status_code=404, detail="Channel mapping is disabled")
+    return epg_service.channel_mapper
+
+# EPG by panel stream id, through the stream <-> channel mapping
+@app.post("/epg/streams/lookup")
+async def lookup_stream_epg(request: StreamEPGRequest):
+    return mapper().lookup(request.stream_ids, request.at, request.hours)
+
+@app.get("/epg/mappings")
+async def get_channel_mappings():
+    channel_mapper = mapper()
+    return {"stats": channel_mapper.stats(), "mappings": list(channel_mapper.mappings.values())}
+
+@app.get("/epg/mappings/{stream_id}")
+async def get_channel_mapping(stream_id: int):
+    mapping = mapper().mapping(stream_id)
+    if mapping is None:
+        raise HTTPException(status_code=404, detail="Stream has no EPG mapping")
+    return mapping
+
+@app.put("/epg/mappings/{stream_id}")
+async def set_channel_mapping(stream_id: int, override: MappingOverride):
+    channel_mapper = mapper()
+    if override.channel_id is not None:
+        if override.source_id is None:
+            raise HTTPException(status_code=400, detail="source_id is required with channel_id")
+        channel = await epg_service.fetchone(
+            f"SELECT id FROM epg_channels WHERE source_id = %s AND {CURRENT_GENERATION} AND channel_id = %s LIMIT 1",
+            (override.source_id, override.source_id, override.channel_id)
+        )
+        if not channel:
+            raise HTTPException(status_code=404, detail="EPG channel not found")
+    stream = await epg_service.fetchone("SELECT id FROM streams WHERE id = %s", (stream_id,))
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    
+    return await channel_mapper.set_override(stream_id, override.source_id if override.channel_id else None,
+                                             override.channel_id)
+
+@app.delete("/epg/mappings/{stream_id}")
+async def clear_channel_mapping(stream_id: int):
+    channel_mapper = mapper()
+    stream = await epg_service.fetchone("SELECT name FROM streams WHERE id = %s", (stream_id,))
+    if not stream:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    mapping = await channel_mapper.clear_override(stream_id, stream['name'])
+    return {"message": "Manual EPG mapping removed", "mapping": mapping}
+
+@app.post("/epg/mappings/rebuild")
+async def rebuild_channel_mappings():
+    mapper().schedule()
+    return {"message": "Channel mapping rebuild queued"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    return instrumentation.render_prometheus()
+
+@app.get("/metrics/summary")
+async def metrics_summary():
+    return instrumentation.summary()
@@ -0,0 +1,286 @@
+# File: cryonix/services/epg_sync/sync_scheduler.py
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import random
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from config import Config
+from xmltv_parser import iter_spill, parse_file_to_spill
+
+logger = logging.getLogger(__name__)
+
+class SyncJob:
+    def __init__(self, source, trigger: str, force: bool):
+        self.source_id = source.id
+        self.source_name = source.name
+        self.trigger = trigger  # manual or schedule
+        self.force = force
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'source_id': self.source_id,
+            'source_name': self.source_name,
+            'trigger': self.trigger,
+            'force': self.force,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timings': self.timings,
+            'result': self.result,
+            'error': self.error
+        }
+
+# Runs EPG syncs for many sources at once. Jobs are admitted through a global
+# semaphore, downloads through a per-host semaphore so one provider is never
+# hit by every source at the same time, and XML parsing happens in a process
+# pool so it can't stall the API's event loop. A source that is already
+# being synced is never started twice: the running job is returned instead.
+# A source whose sync failed is left out of scheduled runs for a jittered
+# exponential backoff, reset by its next successful sync.
+class SyncScheduler:
+    def __init__(self, service, max_concurrent: int = 4, per_host: int = 2, parse_workers: int = 2,
+                 interval_hours: float = 6, poll_interval: float = 300, history_size: int = 200,
+                 backoff_base: float = 300, backoff_max: float = 21600, stage_timer=None):
+        self.service = service
+        self.max_concurrent = max(1, max_concurrent)
+        self.per_host = max(1, per_host)
+        self.parse_workers = max(1, parse_workers)
+        self.interval_hours = interval_hours
+        self.poll_interval = poll_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Optional histogram (instrumentation.HistogramFamily) fed with every job timing
+        self.stage_timer = stage_timer
+
+        self.in_flight: Dict[int, SyncJob] = {}
+        self.last_jobs: Dict[int, SyncJob] = {}
+        self.history = deque(maxlen=history_size)
+        self.stats_counters = {'submitted': 0, 'deduplicated': 0, 'done': 0, 'skipped': 0, 'failed': 0,
+                               'backed_off': 0}
+        # source id -> (consecutive failures, time.time() before which it isn't retried)
+        self.retries: Dict[int, Tuple[int, float]] = {}
+
+        self._global: Optional[asyncio.Semaphore] = None
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._loop_task: Optional[asyncio.Task] = None
+        self.spill_dir = os.path.join(Config.CACHE_DIR, 'spill')
+
+    def _new_process_pool(self) -> ProcessPoolExecutor:
+        # spawn, not fork: the API process already runs DB executor threads
+        return ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=multiprocessing.get_context('spawn'))
+
+    async def start(self):
+        self._global = asyncio.Semaphore(self.max_concurrent)
+        self._process_pool = self._new_process_pool()
+        os.makedirs(self.spill_dir, exist_ok=True)
+
+        if self.poll_interval > 0:
+            self._loop_task = asyncio.create_task(self._run_loop())
+        logger.info(f"EPG sync scheduler started: {self.max_concurrent} concurrent, "
+                    f"{self.per_host} per host, {self.parse_workers} parse workers")
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+
+        tasks = [job.task for job in self.in_flight.values() if job.task]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False)
+
+    async def _run_loop(self):
+        while True:
+            try:
+                jobs = await self.enqueue_due(trigger='schedule')
+                if jobs:
+                    logger.info(f"Scheduled sync for {len(jobs)} due EPG sources")
+            except Exception as e:
+                logger.error(f"EPG scheduler poll failed: {e!r}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def enqueue_due(self, trigger: str = 'manual', force: bool = False) -> List[SyncJob]:
+        if force:
+            rows = await self.service.fetchall("SELECT * FROM epg_sources WHERE is_active = 1")
+        else:
+            rows = await self.service.fetchall("""
+                SELECT * FROM epg_sources
+                WHERE is_active = 1 AND (last_sync IS NULL OR last_sync < NOW() - INTERVAL %s MINUTE)
+            """, (int(self.interval_hours * 60),))
+
+        jobs = []
+        now = time.time()
+        for row in rows:
+            source = self.service.make_source(row)
+            if source.type not in ('xmltv', 'xtream'):
+                continue
+            # A forced run retries everything; otherwise failed sources wait out their backoff
+            if not force and self.retries.get(source.id, (0, 0))[1] > now:
+                self.stats_counters['backed_off'] += 1
+                continue
+            jobs.append(self.submit(source, trigger=trigger, force=force)[0])
+        return jobs
+
+    def submit(self, source, trigger: str = 'manual', force: bool = False) -> Tuple[SyncJob, bool]:
+        existing = self.in_flight.get(source.id)
+        if existing is not None:
+            self.stats_counters['deduplicated'] += 1
+            return existing, False
+
+        job = SyncJob(source, trigger, force)
+        self.in_flight[source.id] = job
+        self.stats_counters['submitted'] += 1
+        job.task = asyncio.create_task(self._run(job, source))
+        return job, True
+
+    def backoff(self, failures: int) -> float:
+        # Exponential step with +-50% jitter so sources failing together spread out
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _track_retry(self, job: SyncJob):
+        if job.status == 'failed':
+            failures = self.retries.get(job.source_id, (0, 0))[0] + 1
+            delay = self.backoff(failures)
+            self.retries[job.source_id] = (failures, time.time() + delay)
+            logger.info(f"EPG source {job.source_id} retried in {delay:.0f}s (failure {failures})")
+        elif job.status in ('done', 'skipped'):
+            self.retries.pop(job.source_id, None)
+
+    def _host_semaphore(self, url: str) -> asyncio.Semaphore:
+        host = urlparse(url).hostname or ''
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host)
+        return self._hosts[host]
+
+    @contextmanager
+    def _stage(self, job: SyncJob, name: str):
+        job.status = name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(job, name, time.perf_counter() - started)
+
+    def _record(self, job: SyncJob, name: str, seconds: float):
+        job.timings[name] = round(seconds, 3)
+        if self.stage_timer:
+            self.stage_timer.observe(seconds, stage=name)
+
+    async def _run(self, job: SyncJob, source):
+        queued = time.perf_counter()
+        try:
+            async with self._global:
+                self._record(job, 'queued', time.perf_counter() - queued)
+                job.started_at = time.time()
+                job.result = await self._sync(job, source)
+                job.status = 'skipped' if job.result.get('skipped') else 'done'
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+            raise
+        except Exception as e:
+            job.status = 'failed'
+            job.error = str(getattr(e, 'detail', None) or e)
+            logger.error(f"EPG sync job for source {job.source_id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            self._record(job, 'total', time.perf_counter() - queued)
+            if job.status in self.stats_counters:
+                self.stats_counters[job.status] += 1
+            self._track_retry(job)
+            self.in_flight.pop(job.source_id, None)
+            self.last_jobs[job.source_id] = job
+            self.history.append(job)
+
+    async def _sync(self, job: SyncJob, source) -> Dict:
+        url, include_icons, include_category = self.service.source_target(source)
+        cache = self.service.download_cache
+
+        if cache is None:
+            # Nothing on disk to hand to a worker process: use the in-loop streaming path
+            async with self._host_semaphore(url):
+                with self._stage(job, 'sync'):
+                    return await self.service.sync_from_url(source, url, include_icons, include_category, job.force)
+
+        async with self._host_semaphore(url):
+            with self._stage(job, 'download'):
+                async with aiohttp.ClientSession(auto_decompress=False) as session:
+                    download = await cache.fetch(session, url, force=job.force)
+
+        if not download.changed:
+            return await self.service.skip_unchanged(source.id, download)
+
+        spill_path = os.path.join(self.spill_dir, f"source_{source.id}.spill")
+        try:
+            with self._stage(job, 'parse'):
+                loop = asyncio.get_running_loop()
+                try:
+                    parse_result = await loop.run_in_executor(
+                        self._process_pool, parse_file_to_spill, download.body_path, spill_path,
+                        Config.PARSE_BATCH_SIZE, include_icons, include_category, Config.DOWNLOAD_CHUNK_SIZE
+                    )
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM-killed); replace the pool so later jobs can still parse
+                    logger.error("EPG parse worker died, restarting process pool")
+                    self._process_pool.shutdown(wait=False)
+                    self._process_pool = self._new_process_pool()
+                    raise
+
+            with self._stage(job, 'write'):
+                write_result = await self.service.write_batches(source.id, self._read_spill(spill_path))
+        except BaseException:
+            cache.discard(download)
+            raise
+        finally:
+            if os.path.exists(spill_path):
+                os.unlink(spill_path)
+        cache.commit(download)
+
+        return {**parse_result, **write_result, 'sync_time': datetime.now().isoformat()}
+
+    async def _read_spill(self, spill_path: str):
+        loop = asyncio.get_running_loop()
+        batches = iter_spill(spill_path)
+        while True:
+            batch = await loop.run_in_executor(None, next, batches, None)
+            if batch is None:
+                return
+            yield batch
+
+    def job(self, source_id: int) -> Optional[SyncJob]:
+        return self.in_flight.get(source_id) or self.last_jobs.get(source_id)
+
+    def status(self) -> Dict:
+        return {
+            'stats': dict(self.stats_counters),
+            'in_flight': [job.to_dict() for job in self.in_flight.values()],
+            'backoff': {
+                source_id: {'failures': failures, 'retry_at': retry_at}
+                for source_id, (failures, retry_at) in self.retries.items()
+            },
+            'recent': [job.to_dict() for job in reversed(self.history)]
+        }
@@ -0,0 +1,164 @@
+# File: cryonix/services/epg_sync/xmltv_parser.py
+
+import pickle
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from download_cache import StreamDecompressor
+from xmltv_time import XMLTVTimeParser
+
+# A batch handed to the writer: (channels, programmes)
+EPGBatch = Tuple[List[Dict], List[Dict]]
+
+def parse_channel(element: ET.Element, include_icon: bool = True) -> Optional[Dict]:
+    display_name = element.find('display-name')
+    if display_name is None:
+        return None
+
+    icon = element.find('icon') if include_icon else None
+    return {
+        'id': element.get('id'),
+        'name': display_name.text,
+        'icon': icon.get('src') if icon is not None else None
+    }
+
+def parse_programme(element: ET.Element, include_category: bool = True) -> Dict:
+    # start/stop stay raw strings here; XMLTVTimeParser converts whole batches
+    title_elem = element.find('title')
+    desc_elem = element.find('desc')
+    category_elem = element.find('category') if include_category else None
+
+    return {
+        'channel_id': element.get('channel'),
+        'start_time': element.get('start'),
+        'stop_time': element.get('stop'),
+        'title': title_elem.text if title_elem is not None else '',
+        'description': desc_elem.text if desc_elem is not None else '',
+        'category': category_elem.text if category_elem is not None else ''
+    }
+
+def parse_xmltv_document(content, time_parser: Optional[XMLTVTimeParser] = None,
+                         include_icons: bool = True, include_category: bool = True) -> EPGBatch:
+    # Whole-document parse, kept for small guides and as the non-streaming fallback
+    root = ET.fromstring(content)
+
+    channels = []
+    for element in root.findall('channel'):
+        channel = parse_channel(element, include_icons)
+        if channel is not None:
+            channels.append(channel)
+
+    programmes = [parse_programme(element, include_category) for element in root.findall('programme')]
+
+    return channels, (time_parser or XMLTVTimeParser()).convert_programmes(programmes)
+
+# Incremental XMLTV parser: bytes are fed in as they arrive from the network,
+# each finished <channel>/<programme> is converted to a dict and dropped from
+# the tree, so memory is bounded by batch_size rather than by the guide size.
+class XMLTVStreamParser:
+    def __init__(self, batch_size: int = 5000, time_parser: Optional[XMLTVTimeParser] = None,
+                 include_icons: bool = True, include_category: bool = True):
+        self.batch_size = max(1, batch_size)
+        self.time_parser = time_parser or XMLTVTimeParser()
+        self.include_icons = include_icons
+        self.include_category = include_category
+
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root = None
+        self._channels: List[Dict] = []
+        self._programmes: List[Dict] = []
+
+        self.channels_count = 0
+        self.programmes_count = 0
+        self.bytes_read = 0
+
+    def feed(self, data: bytes) -> List[EPGBatch]:
+        self.bytes_read += len(data)
+        self._parser.feed(data)
+        return self._drain()
+
+    def close(self) -> List[EPGBatch]:
+        self._parser.close()
+        batches = self._drain()
+        if self._channels or self._programmes:
+            batches.append(self._take_batch())
+        return batches
+
+    def _drain(self) -> List[EPGBatch]:
+        batches = []
+
+        for event, element in self._parser.read_events():
+            if event == 'start':
+                if self._root is None:
+                    self._root = element
+                continue
+
+            if element.tag == 'programme':
+                self._programmes.append(parse_programme(element, self.include_category))
+            elif element.tag == 'channel':
+                channel = parse_channel(element, self.include_icons)
+                if channel is not None:
+                    self._channels.append(channel)
+                    self.channels_count += 1
+            else:
+                continue
+
+            # Drop the finished element (and any other completed top-level
+            # siblings) so the tree never grows past the current element
+            element.clear()
+            if self._root is not None:
+                del self._root[:]
+
+            if len(self._programmes) >= self.batch_size:
+                batches.append(self._take_batch())
+
+        return batches
+
+    def _take_batch(self) -> EPGBatch:
+        programmes = self.time_parser.convert_programmes(self._programmes)
+        self.programmes_count += len(programmes)
+        batch = (self._channels, programmes)
+        self._channels = []
+        self._programmes = []
+        return batch
+
+# Process-pool entry point: parse a cached (possibly compressed) guide and
+# spill the batches to a pickle stream, so neither the worker nor the API
+# process ever holds the whole guide in memory
+def parse_file_to_spill(body_path: str, spill_path: str, batch_size: int = 5000, include_icons: bool = True,
+                        include_category: bool = True, chunk_size: int = 65536) -> Dict:
+    parser = XMLTVStreamParser(batch_size=batch_size, include_icons=include_icons, include_category=include_category)
+    decompressor = StreamDecompressor()
+    batches = 0
+
+    with open(body_path, 'rb') as source, open(spill_path, 'wb') as spill:
+        def dump(ready: List[EPGBatch]):
+            nonlocal batches
+            for batch in ready:
+                pickle.dump(batch, spill, pickle.HIGHEST_PROTOCOL)
+                batches += 1
+
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            dump(parser.feed(decompressor.decompress(chunk)))
+
+        dump(parser.feed(decompressor.flush()))
+        dump(parser.close())
+
+    return {
+        'channels_count': parser.channels_count,
+        'programmes_count': parser.programmes_count,
+        'batches': batches,
+        'bytes_read': parser.bytes_read,
+        **parser.time_parser.stats()
+    }
+
+def iter_spill(spill_path: str) -> Iterator[EPGBatch]:
+    with open(spill_path, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
@@ -0,0 +1,120 @@
+# File: cryonix/services/epg_sync/xmltv_time.py
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+def utc_now() -> datetime:
+    # Programme times are stored as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def parse_offset(offset: str) -> Optional[timedelta]:
+    # '+hhmm' / '-hhmm'; an empty offset means UTC
+    if not offset:
+        return timedelta(0)
+    if len(offset) != 5 or offset[0] not in '+-' or not offset[1:].isdigit():
+        return None
+    delta = timedelta(hours=int(offset[1:3]), minutes=int(offset[3:5]))
+    return -delta if offset[0] == '-' else delta
+
+# Parser for XMLTV 'YYYYMMDDhhmmss ±hhmm' timestamps. Fields are sliced at
+# fixed positions instead of going through strptime, offsets are parsed once
+# and cached, and results are normalized to naive UTC. Because every
+# programme's stop is usually the next one's start and all channels share
+# the same slot boundaries, whole timestamps are memoized too.
+#
+# Malformed values return None and are counted instead of being replaced
+# by the current time.
+class XMLTVTimeParser:
+    def __init__(self, cache_size: int = 65536):
+        self.cache_size = cache_size
+        self.parsed = 0
+        self.malformed = 0
+        self.missing_stop = 0
+        self._cache: Dict[str, Optional[datetime]] = {}
+        self._offsets: Dict[str, Optional[timedelta]] = {}
+
+    def _parse_uncached(self, value: str) -> Optional[datetime]:
+        value = value.strip()
+        digits = len(value)
+        for i, char in enumerate(value):
+            if not char.isdigit():
+                digits = i
+                break
+
+        # XMLTV allows truncated precision: YYYYMMDD[hh[mm[ss]]]
+        if digits not in (8, 10, 12, 14):
+            return None
+
+        offset_str = value[digits:].strip()
+        offset = self._offsets.get(offset_str)
+        if offset is None and offset_str not in self._offsets:
+            offset = self._offsets[offset_str] = parse_offset(offset_str)
+        if offset is None:
+            return None
+
+        fields = value[:digits]
+        try:
+            local = datetime(
+                int(fields[0:4]), int(fields[4:6]), int(fields[6:8]),
+                int(fields[8:10] or 0), int(fields[10:12] or 0), int(fields[12:14] or 0)
+            )
+        except ValueError:
+            return None
+        return local - offset
+
+    def parse(self, value: Optional[str]) -> Optional[datetime]:
+        self.parsed += 1
+        if not value:
+            self.malformed += 1
+            return None
+
+        try:
+            result = self._cache[value]
+        except KeyError:
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            result = self._cache[value] = self._parse_uncached(value)
+
+        if result is None:
+            self.malformed += 1
+        return result
+
+    def parse_many(self, values: List[Optional[str]]) -> List[Optional[datetime]]:
+        parse = self.parse
+        return [parse(value) for value in values]
+
+    def convert_programmes(self, programmes: List[Dict]) -> List[Dict]:
+        # Batch variant: converts the raw start/stop strings of a whole
+        # programme batch in place and drops programmes with unusable times
+        parse = self.parse
+        converted = []
+        for programme in programmes:
+            start = parse(programme['start_time'])
+            if start is None:
+                continue
+
+            if programme['stop_time']:
+                stop = parse(programme['stop_time'])
+                if stop is None:
+                    continue
+            else:
+                # stop is optional in XMLTV; keep the programme as zero-length
+                self.missing_stop += 1
+                stop = start
+
+            programme['start_time'] = start
+            programme['stop_time'] = stop
+            converted.append(programme)
+        return converted
+
+    def stats(self) -> Dict:
+        return {
+            'timestamps_parsed': self.parsed,
+            'malformed_timestamps': self.malformed,
+            'missing_stop': self.missing_stop
+        }
+
+_default_parser = XMLTVTimeParser()
+
+def parse_xmltv_time(time_str: Optional[str]) -> Optional[datetime]:
+    return _default_parser.parse(time_str)
@@ -1,12 +1,90 @@
 # File: cryonix/services/stream_manager/config.py
 
 import os
+import socket
 
 class Config:
     FFMPEG_PATH = os.getenv('FFMPEG_PATH', 'ffmpeg')
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
     MAX_STREAMS = int(os.getenv('MAX_STREAMS', '100'))
-    HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', '30'))
+    HEALTH_CHECK_INTERVAL = int(os.getenv('HEALTH_CHECK_INTERVAL', '5'))
+    
+    # Supervisor: restart backoff (seconds), crash-loop cap and stall detection
+    RESTART_BACKOFF_BASE = float(os.getenv('RESTART_BACKOFF_BASE', '2'))
+    RESTART_BACKOFF_MAX = float(os.getenv('RESTART_BACKOFF_MAX', '300'))
+    RESTART_MAX_ATTEMPTS = int(os.getenv('RESTART_MAX_ATTEMPTS', '10'))
+    RESTART_STABLE_PERIOD = float(os.getenv('RESTART_STABLE_PERIOD', '300'))
+    RESTART_STAGGER = float(os.getenv('RESTART_STAGGER', '0.5'))
+    STALL_TIMEOUT = float(os.getenv('STALL_TIMEOUT', '60'))
+    
+    # Event loop lag sampling (seconds, 0 disables); stalls longer than
+    # LOOP_BLOCK_THRESHOLD are logged with the stack of the blocking call
+    LOOP_LAG_INTERVAL = float(os.getenv('LOOP_LAG_INTERVAL', '0.25'))
+    LOOP_BLOCK_THRESHOLD = float(os.getenv('LOOP_BLOCK_THRESHOLD', '0.1'))
+    
+    # Recent stderr lines kept in memory per stream
+    STDERR_BUFFER_LINES = int(os.getenv('STDERR_BUFFER_LINES', '200'))
+    # Seconds to wait after SIGTERM before SIGKILL
+    STOP_TIMEOUT = float(os.getenv('STOP_TIMEOUT', '10'))
+    
+    # Stream registry (SQLite): ffmpeg processes survive restarts of the manager
+    # and are re-adopted; DETACH_ON_SHUTDOWN leaves them running on shutdown
+    REGISTRY_ENABLED = os.getenv('REGISTRY_ENABLED', 'true').lower() == 'true'
+    REGISTRY_PATH = os.getenv('REGISTRY_PATH', 'stream_registry.db')
+    DETACH_ON_SHUTDOWN = os.getenv('DETACH_ON_SHUTDOWN', 'true').lower() == 'true'
+    
+    # Cluster placement: nodes sharing CLUSTER_BACKEND ('redis', or 'memory' for a
+    # single node) split the streams between them. NODE_ID must be unique per
+    # instance and NODE_URL reachable by the other nodes; a node silent for
+    # NODE_TTL seconds is considered gone and its streams are moved. With the
+    # redis backend NODE_ID has no default: several workers on one host would
+    # all get the hostname and claim each other's streams
+    CLUSTER_ENABLED = os.getenv('CLUSTER_ENABLED', 'false').lower() == 'true'
+    CLUSTER_BACKEND = os.getenv('CLUSTER_BACKEND', 'redis')
+    REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+    CLUSTER_PREFIX = os.getenv('CLUSTER_PREFIX', 'cryonix:streams')
+    NODE_ID = os.getenv('NODE_ID', '' if CLUSTER_BACKEND == 'redis' else socket.gethostname())
+    NODE_URL = os.getenv('NODE_URL', 'http://127.0.0.1:8000')
+    NODE_HEARTBEAT_INTERVAL = float(os.getenv('NODE_HEARTBEAT_INTERVAL', '5'))
+    NODE_TTL = float(os.getenv('NODE_TTL', '30'))
+    # Load average per core above which a node takes no new streams
+    NODE_CPU_LIMIT = float(os.getenv('NODE_CPU_LIMIT', '0.9'))
+    FORWARD_TIMEOUT = float(os.getenv('FORWARD_TIMEOUT', '60'))
+    # Shared by all nodes; requests forwarded between them are signed with it
+    # (HMAC) and only accepted within FORWARD_MAX_SKEW seconds of signing
+    CLUSTER_SECRET = os.getenv('CLUSTER_SECRET', '')
+    FORWARD_MAX_SKEW = float(os.getenv('FORWARD_MAX_SKEW', '30'))
+    
+    # Spawn admission: ffmpeg starts per second (bucket size SPAWN_BURST) and
+    # streams allowed to be starting at once; a start ends at the first
+    # progress report or after STARTUP_TIMEOUT seconds
+    SPAWN_RATE = float(os.getenv('SPAWN_RATE', '10'))
+    SPAWN_BURST = int(os.getenv('SPAWN_BURST', '10'))
+    MAX_CONCURRENT_STARTS = int(os.getenv('MAX_CONCURRENT_STARTS', '20'))
+    STARTUP_TIMEOUT = float(os.getenv('STARTUP_TIMEOUT', '15'))
+    
+    # Input probing: ffprobe runs before a start (cached per URL), dead inputs
+    # are rejected without taking a start slot and probed inputs are opened
+    # with a smaller probesize (bytes) / analyzeduration (microseconds)
+    PROBE_ENABLED = os.getenv('PROBE_ENABLED', 'true').lower() == 'true'
+    FFPROBE_PATH = os.getenv('FFPROBE_PATH', 'ffprobe')
+    PROBE_MAX_CONCURRENT = int(os.getenv('PROBE_MAX_CONCURRENT', '8'))
+    PROBE_TIMEOUT = float(os.getenv('PROBE_TIMEOUT', '10'))
+    PROBE_CACHE_TTL = float(os.getenv('PROBE_CACHE_TTL', '300'))
+    PROBE_FAILURE_TTL = float(os.getenv('PROBE_FAILURE_TTL', '15'))
+    PROBE_REJECT_DEAD = os.getenv('PROBE_REJECT_DEAD', 'true').lower() == 'true'
+    PROBE_FAST_PROBESIZE = os.getenv('PROBE_FAST_PROBESIZE', '1000000')
+    PROBE_FAST_ANALYZEDURATION = os.getenv('PROBE_FAST_ANALYZEDURATION', '1000000')
+    
+    # Remux fast path: tracks the probed input already has in the profile's
+    # codec/resolution (bitrate up to TOLERANCE x the target) are copied
+    # instead of transcoded; per stream, options.remux=false turns it off
+    REMUX_ENABLED = os.getenv('REMUX_ENABLED', 'true').lower() == 'true'
+    REMUX_BITRATE_TOLERANCE = float(os.getenv('REMUX_BITRATE_TOLERANCE', '1.25'))
+    
+    # ffmpeg -progress telemetry; -stats_period is only passed when the probed ffmpeg is 4.4+
+    PROGRESS_ENABLED = os.getenv('PROGRESS_ENABLED', 'true').lower() == 'true'
+    STATS_PERIOD = os.getenv('STATS_PERIOD', '1')
     
     # Default transcoding profiles
     TRANSCODING_PROFILES = {
@@ -0,0 +1,217 @@
+# File: cryonix/services/stream_manager/input_probe.py
+
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+def frame_rate(value: Optional[str]) -> Optional[float]:
+    # ffprobe reports rates as fractions ("25/1", "30000/1001", "0/0")
+    num, _, den = (value or '').partition('/')
+    try:
+        num, den = float(num), float(den or 1)
+    except ValueError:
+        return None
+    return round(num / den, 3) if num and den else None
+
+def redact_url(url: str) -> str:
+    # Input URLs often carry credentials (user:pass@ or ?token=); logs get the
+    # scheme, host and path only
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return '<invalid url>'
+    if not parts.netloc:
+        return url
+    host = parts.netloc.rpartition('@')[2]
+    return urlunsplit((parts.scheme, host, parts.path, '', ''))
+
+def int_or_none(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+class InputInfo:
+    def __init__(self, url: str, format_name: Optional[str] = None, video: Optional[Dict] = None,
+                 audio: Optional[Dict] = None, bit_rate: Optional[int] = None, error: Optional[str] = None,
+                 probe_seconds: float = 0.0):
+        self.url = url
+        self.format_name = format_name
+        self.video = video
+        self.audio = audio
+        self.bit_rate = bit_rate
+        self.error = error
+        self.probe_seconds = probe_seconds
+        self.probed_at = time.time()
+        self._expires = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @classmethod
+    def from_ffprobe(cls, url: str, data: Dict, probe_seconds: float) -> 'InputInfo':
+        streams = data.get('streams') or []
+        video = next((s for s in streams if s.get('codec_type') == 'video'), None)
+        audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+        if video is None and audio is None:
+            return cls(url, error='No audio or video streams found', probe_seconds=probe_seconds)
+
+        container = data.get('format') or {}
+        return cls(
+            url,
+            format_name=container.get('format_name'),
+            video={
+                'codec': video.get('codec_name'),
+                'profile': video.get('profile'),
+                'width': int_or_none(video.get('width')),
+                'height': int_or_none(video.get('height')),
+                'pix_fmt': video.get('pix_fmt'),
+                'fps': frame_rate(video.get('avg_frame_rate')) or frame_rate(video.get('r_frame_rate')),
+                'bit_rate': int_or_none(video.get('bit_rate'))
+            } if video else None,
+            audio={
+                'codec': audio.get('codec_name'),
+                'sample_rate': int_or_none(audio.get('sample_rate')),
+                'channels': int_or_none(audio.get('channels')),
+                'bit_rate': int_or_none(audio.get('bit_rate'))
+            } if audio else None,
+            bit_rate=int_or_none(container.get('bit_rate')),
+            probe_seconds=probe_seconds
+        )
+
+    def to_dict(self) -> Dict:
+        return {
+            'url': self.url,
+            'ok': self.ok,
+            'error': self.error,
+            'format': self.format_name,
+            'video': self.video,
+            'audio': self.audio,
+            'bit_rate': self.bit_rate,
+            'probe_seconds': round(self.probe_seconds, 3),
+            'probed_at': self.probed_at
+        }
+
+# ffprobe front end for stream inputs. Probes don't hold a spawn slot, run
+# at most max_concurrent at a time, and concurrent starts of the same URL
+# share one probe. Results are cached per URL for ttl seconds, failures for
+# failure_ttl, so repeated starts of a channel skip probing and dead
+# upstreams are rejected before they take a process slot.
+class InputProber:
+    def __init__(self, ffprobe_path: str, max_concurrent: int = 8, timeout: float = 10,
+                 ttl: float = 300, failure_ttl: float = 15, cache_size: int = 4096):
+        self.ffprobe_path = ffprobe_path
+        self.max_concurrent = max(1, max_concurrent)
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.cache_size = cache_size
+        self.available = True
+        self.stats_counters = {'hits': 0, 'misses': 0, 'shared': 0, 'failures': 0}
+        self._cache: 'OrderedDict[str, InputInfo]' = OrderedDict()
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def open(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    def cached(self, url: str) -> Optional[InputInfo]:
+        info = self._cache.get(url)
+        if info is None:
+            return None
+        if info._expires <= time.monotonic():
+            del self._cache[url]
+            return None
+        self._cache.move_to_end(url)
+        return info
+
+    def invalidate(self, url: str):
+        self._cache.pop(url, None)
+
+    async def probe(self, url: str, refresh: bool = False) -> Optional[InputInfo]:
+        # None when ffprobe itself can't be run: the input is then simply not checked
+        if not self.available:
+            return None
+        if not refresh:
+            info = self.cached(url)
+            if info is not None:
+                self.stats_counters['hits'] += 1
+                return info
+
+        task = self._pending.get(url)
+        if task is not None:
+            self.stats_counters['shared'] += 1
+        else:
+            self.stats_counters['misses'] += 1
+            task = asyncio.create_task(self._probe(url))
+            self._pending[url] = task
+            task.add_done_callback(lambda _: self._pending.pop(url, None))
+        # One caller going away must not cancel the probe for the others
+        return await asyncio.shield(task)
+
+    async def _probe(self, url: str) -> Optional[InputInfo]:
+        if self._semaphore is None:
+            self.open()
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                data, error = await self._run(url)
+            except OSError as e:
+                logger.error(f"Could not run {self.ffprobe_path}, inputs will not be probed: {e!r}")
+                self.available = False
+                return None
+            elapsed = time.monotonic() - started
+
+        if error is None:
+            info = InputInfo.from_ffprobe(url, data, elapsed)
+        else:
+            # ffprobe's error line usually starts with the full input URL
+            info = InputInfo(url, error=error.replace(url, redact_url(url)), probe_seconds=elapsed)
+        if not info.ok:
+            self.stats_counters['failures'] += 1
+            logger.warning(f"Probe of {redact_url(url)} failed after {elapsed:.2f}s: {info.error}")
+
+        info._expires = time.monotonic() + (self.ttl if info.ok else self.failure_ttl)
+        self._cache[url] = info
+        self._cache.move_to_end(url)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return info
+
+    async def _run(self, url: str):
+        process = await asyncio.create_subprocess_exec(
+            self.ffprobe_path, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', url,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return None, f'Probe timed out after {self.timeout}s'
+
+        if process.returncode != 0:
+            lines = stderr.decode('utf-8', 'replace').strip().splitlines()
+            return None, lines[-1] if lines else f'ffprobe exited with code {process.returncode}'
+        try:
+            return json.loads(stdout), None
+        except ValueError:
+            return None, 'Unreadable ffprobe output'
+
+    def stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            'available': self.available,
+            'cached': len(self._cache),
+            'probing': len(self._pending),
+            'max_concurrent': self.max_concurrent
+        }
@@ -1,77 +1,436 @@
 # File: cryonix/services/stream_manager/main.py
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, List
+from typing import Optional, Dict, List, Set, Tuple, Union
 import asyncio
 import json
 import logging
 import os
-import signal
-import subprocess
-from datetime import datetime
+import sys
+import time
+
+# Modules shared with the EPG sync service
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+
+from config import Config
+from instrumentation import Instrumentation, setup_logging
+from input_probe import InputInfo, InputProber
+from profile_compiler import CompiledProfile, ProfileCompiler, ProfileError
+from spawn_limiter import SpawnLimiter
+from stream_cluster import FORWARDED_HEADER, ClusterError, MemoryClusterBackend, RedisClusterBackend, StreamScheduler
+from stream_metrics import render_prometheus
+from stream_monitor import StreamMonitor, exit_reason
+from stream_process import StreamProcess
+from stream_registry import StreamRegistry
 
 app = FastAPI(title="Cryonix Stream Manager")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='stream_manager.log'
-)
+# Configure logging; records are written by a listener thread, off the event loop
+log_listener = setup_logging('stream_manager.log', Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
+# Route latency, ffmpeg spawn times and event loop lag, served on /metrics
+instrumentation = Instrumentation(Config.LOOP_LAG_INTERVAL, Config.LOOP_BLOCK_THRESHOLD)
+instrumentation.instrument(app)
+spawn_timer = instrumentation.histogram('cryonix_ffmpeg_spawn_seconds', 'Time to spawn ffmpeg and attach its pipes',
+                                        ('trigger',))
+
 # Store active streams
-active_streams: Dict[str, subprocess.Popen] = {}
+active_streams: Dict[str, StreamProcess] = {}
+
+# Persistent record of active_streams, used to re-adopt ffmpeg processes after a restart
+registry = StreamRegistry(Config.REGISTRY_PATH) if Config.REGISTRY_ENABLED else None
+
+profile_compiler = ProfileCompiler(
+    Config.FFMPEG_PATH,
+    Config.TRANSCODING_PROFILES,
+    progress=Config.PROGRESS_ENABLED,
+    stats_period=Config.STATS_PERIOD
+)
+
+spawn_limiter = SpawnLimiter(
+    rate=Config.SPAWN_RATE,
+    burst=Config.SPAWN_BURST,
+    max_concurrent=Config.MAX_CONCURRENT_STARTS,
+    startup_timeout=Config.STARTUP_TIMEOUT
+)
+
+# ffprobe results per input URL, checked before a stream takes a start slot
+input_prober = InputProber(
+    Config.FFPROBE_PATH,
+    max_concurrent=Config.PROBE_MAX_CONCURRENT,
+    timeout=Config.PROBE_TIMEOUT,
+    ttl=Config.PROBE_CACHE_TTL,
+    failure_ttl=Config.PROBE_FAILURE_TTL
+) if Config.PROBE_ENABLED else None
+
+# Stream ids admitted but not spawned yet; they count against MAX_STREAMS
+starting_streams: Set[str] = set()
+
+# Sub-stream id -> parent stream id for multi-rendition streams
+rendition_parents: Dict[str, str] = {}
+
+# Cluster mode: stream ownership lives in the shared backend, new streams go
+# to the least-loaded node and requests are forwarded to the owning node
+cluster: Optional[StreamScheduler] = None
+if Config.CLUSTER_ENABLED:
+    if not Config.NODE_ID:
+        raise RuntimeError("CLUSTER_ENABLED with the redis backend needs a NODE_ID unique to this instance")
+    if Config.CLUSTER_BACKEND == 'redis' and not Config.CLUSTER_SECRET:
+        raise RuntimeError("CLUSTER_ENABLED with the redis backend needs CLUSTER_SECRET to sign forwarded requests")
+    cluster = StreamScheduler(
+        RedisClusterBackend(Config.REDIS_URL, Config.CLUSTER_PREFIX) if Config.CLUSTER_BACKEND == 'redis'
+        else MemoryClusterBackend(),
+        Config.NODE_ID,
+        Config.NODE_URL,
+        Config.MAX_STREAMS,
+        local_streams=lambda: len(active_streams) + len(starting_streams),
+        start_local=lambda spec: start_assigned(spec),
+        heartbeat_interval=Config.NODE_HEARTBEAT_INTERVAL,
+        node_ttl=Config.NODE_TTL,
+        cpu_limit=Config.NODE_CPU_LIMIT,
+        forward_timeout=Config.FORWARD_TIMEOUT,
+        secret=Config.CLUSTER_SECRET,
+        max_skew=Config.FORWARD_MAX_SKEW
+    )
+cluster_task: Optional[asyncio.Task] = None
+
+stream_monitor = StreamMonitor(
+    active_streams,
+    check_interval=Config.HEALTH_CHECK_INTERVAL,
+    backoff_base=Config.RESTART_BACKOFF_BASE,
+    backoff_max=Config.RESTART_BACKOFF_MAX,
+    max_restarts=Config.RESTART_MAX_ATTEMPTS,
+    stable_period=Config.RESTART_STABLE_PERIOD,
+    stall_timeout=Config.STALL_TIMEOUT,
+    restart_stagger=Config.RESTART_STAGGER,
+    stop_timeout=Config.STOP_TIMEOUT,
+    registry=registry,
+    spawn_timer=spawn_timer,
+    cluster=cluster,
+    input_prober=input_prober
+)
+monitor_task: Optional[asyncio.Task] = None
+
+class RenditionInput(BaseModel):
+    name: str
+    output_url: str
+    profile: Union[str, dict]  # name from Config.TRANSCODING_PROFILES or an inline profile
+    options: Optional[dict] = None
 
 class StreamInput(BaseModel):
     stream_id: str
     input_url: str
-    output_url: str
-    profile: dict
+    output_url: Optional[str] = None
+    profile: Optional[Union[str, dict]] = None  # name from Config.TRANSCODING_PROFILES or an inline profile
     options: Optional[dict] = None
+    # Multi-rendition mode: one ingest/decode, one encode per rendition
+    renditions: Optional[List[RenditionInput]] = None
+
+class BatchStartRequest(BaseModel):
+    streams: List[StreamInput]
+
+class BatchStopRequest(BaseModel):
+    stream_ids: List[str]
+
+class ProbeRequest(BaseModel):
+    input_url: str
+    refresh: bool = False
 
 class StreamStatus(BaseModel):
     stream_id: str
     status: str
     uptime: Optional[float] = None
     error: Optional[str] = None
+    exit_code: Optional[int] = None
+    metrics: Optional[dict] = None
+    restarts: Optional[int] = None
+    last_exit_reason: Optional[str] = None
+    renditions: Optional[List[dict]] = None
+    startup: Optional[dict] = None
+    remux: Optional[dict] = None
+
+def rendition_id(stream_id: str, name: str) -> str:
+    return f"{stream_id}:{name}"
+
+def validate_stream(stream: StreamInput):
+    try:
+        if stream.renditions is None:
+            if not stream.output_url:
+                raise HTTPException(status_code=400, detail="output_url is required")
+            profile_compiler.resolve(stream.profile)
+            return
+        if not stream.renditions:
+            raise HTTPException(status_code=400, detail="renditions must not be empty")
+        names = [rendition.name for rendition in stream.renditions]
+        if len(set(names)) != len(names):
+            raise HTTPException(status_code=400, detail="Rendition names must be unique")
+        for rendition in stream.renditions:
+            profile_compiler.resolve(rendition.profile)
+    except ProfileError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def rendition_info(stream_id: str, stream: StreamInput, plan: List[Tuple[CompiledProfile, Dict]]) -> Optional[List[Dict]]:
+    if not stream.renditions:
+        return None
+    return [
+        {
+            "stream_id": rendition_id(stream_id, rendition.name),
+            "name": rendition.name,
+            "output_url": rendition.output_url,
+            "profile": dict(profile_compiler.resolve(rendition.profile)),
+            "remux": decision
+        }
+        for rendition, (_, decision) in zip(stream.renditions, plan)
+    ]
+
+def plan_outputs(stream: StreamInput, info: Optional[InputInfo]) -> List[Tuple[CompiledProfile, Dict]]:
+    # Per output: the profile actually encoded with and why. Tracks the
+    # probed input already has in the wanted format are copied, not re-encoded.
+    profiles = [rendition.profile for rendition in stream.renditions] if stream.renditions else [stream.profile]
+    if not Config.REMUX_ENABLED or (stream.options or {}).get('remux') is False:
+        reason = 'remux disabled'
+    elif info is None or not info.ok:
+        reason = 'input not probed'
+    else:
+        return [
+            profile_compiler.passthrough(profile_compiler.resolve(profile), info.video, info.audio,
+                                         Config.REMUX_BITRATE_TOLERANCE)
+            for profile in profiles
+        ]
+    return [(profile_compiler.resolve(profile), {"mode": "transcode", "reasons": [reason]}) for profile in profiles]
+
+def remux_summary(plan: List[Tuple[CompiledProfile, Dict]]) -> Dict:
+    if len(plan) == 1:
+        return plan[0][1]
+    modes = {decision["mode"] for _, decision in plan}
+    return {"mode": modes.pop() if len(modes) == 1 else "partial"}
+
+def forget_renditions(stream_id: str):
+    for sub_id in [sub_id for sub_id, parent in rendition_parents.items() if parent == stream_id]:
+        del rendition_parents[sub_id]
+
+def register_stream(process: StreamProcess):
+    stream_monitor.forget(process.stream_id)
+    forget_renditions(process.stream_id)
+    active_streams[process.stream_id] = process
+    for rendition in process.renditions or []:
+        rendition_parents[rendition['stream_id']] = process.stream_id
+
+async def forwarded(request: Request) -> bool:
+    # A request another node forwarded is handled here as-is (no placement,
+    # no forwarding). The header alone proves nothing: without a valid
+    # signature any client could pin a stream to this node
+    if FORWARDED_HEADER not in request.headers:
+        return False
+    if cluster is None or not cluster.verify(request.method, request.scope['path'], await request.body(),
+                                             request.headers):
+        logger.warning(f"Rejected unsigned forwarded request {request.method} {request.scope['path']} "
+                       f"from {request.client.host if request.client else 'unknown'}")
+        raise HTTPException(status_code=403, detail="Invalid forwarded request signature")
+    return True
 
 @app.post("/stream/start")
-async def start_stream(stream: StreamInput):
-    if stream.stream_id in active_streams:
+async def start_stream(stream: StreamInput, request: Request):
+    if await forwarded(request):
+        return await start_stream_local(stream)
+    return await place_stream(stream)
+
+async def place_stream(stream: StreamInput) -> Dict:
+    if cluster is None:
+        return await start_stream_local(stream)
+    # Rejected before anything is claimed in the cluster
+    validate_stream(stream)
+    try:
+        return await cluster.start(stream.stream_id, stream.dict())
+    except ClusterError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def start_assigned(spec: Dict) -> Dict:
+    # Streams the scheduler placed on this node
+    try:
+        return await start_stream_local(StreamInput(**spec))
+    except HTTPException as e:
+        raise ClusterError(e.status_code, e.detail)
+
+async def owner_response(stream_id: str, method: str, action: str, params: Optional[Dict] = None) -> Optional[Dict]:
+    # The owning node's answer for a stream placed elsewhere, None to handle it here
+    if cluster is None:
+        return None
+    node_id = await cluster.remote_owner(stream_id)
+    if node_id is None:
+        return None
+    try:
+        return await cluster.forward(node_id, method, cluster.stream_path(action, stream_id), params=params)
+    except ClusterError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def start_stream_local(stream: StreamInput):
+    if stream.stream_id in active_streams or stream.stream_id in starting_streams:
         raise HTTPException(status_code=400, detail="Stream already running")
+    validate_stream(stream)
+    if len(active_streams) + len(starting_streams) >= Config.MAX_STREAMS:
+        raise HTTPException(status_code=503, detail=f"Stream limit reached ({Config.MAX_STREAMS})")
     
+    requested_at = time.monotonic()
+    starting_streams.add(stream.stream_id)
     try:
-        command = build_ffmpeg_command(stream)
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            preexec_fn=os.setsid
-        )
+        # Dead inputs are turned away here, before they take a start slot
+        info = await probe_input(stream.input_url)
+        probed_at = time.monotonic()
         
-        active_streams[stream.stream_id] = {
-            'process': process,
-            'start_time': datetime.now(),
-            'command': command
-        }
+        # Waits for a spawn token and a free start slot
+        queued = await spawn_limiter.acquire()
+        try:
+            plan = plan_outputs(stream, info)
+            command = build_ffmpeg_command(stream, info, plan)
+            renditions = rendition_info(stream.stream_id, stream, plan)
+            process = StreamProcess(stream.stream_id, command, Config.STDERR_BUFFER_LINES, Config.PROGRESS_ENABLED,
+                                    renditions)
+            process.remux = remux_summary(plan)
+            process.requested_at = requested_at
+            spawn_started = time.monotonic()
+            await process.start()
+            process.timings = {
+                "probe_seconds": round(probed_at - requested_at, 3),
+                "queued_seconds": round(queued, 3),
+                "spawn_seconds": round(time.monotonic() - spawn_started, 3)
+            }
+            spawn_timer.observe(time.monotonic() - spawn_started, trigger='start')
+        except Exception as e:
+            spawn_limiter.release()
+            logger.error(f"Failed to start stream {stream.stream_id}: {str(e)}")
+            raise HTTPException(status_code=500, detail=str(e))
         
-        logger.info(f"Started stream {stream.stream_id}")
-        return {"status": "started", "stream_id": stream.stream_id}
+        # The start slot is held until ffmpeg reports progress
+        spawn_limiter.release_when_ready(process.ready)
         
-    except Exception as e:
-        logger.error(f"Failed to start stream {stream.stream_id}: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        register_stream(process)
+        if registry:
+            await registry.save(process)
+        
+        logger.info(f"Started stream {stream.stream_id} ({process.remux['mode']})")
+        result = {"status": "started", "stream_id": stream.stream_id, "queued_seconds": round(queued, 3),
+                  "startup": process.timings, "remux": process.remux}
+        if renditions:
+            result["renditions"] = [rendition['stream_id'] for rendition in renditions]
+        return result
+    finally:
+        starting_streams.discard(stream.stream_id)
+
+async def probe_input(input_url: str) -> Optional[InputInfo]:
+    if input_prober is None:
+        return None
+    info = await input_prober.probe(input_url)
+    if info is not None and not info.ok and Config.PROBE_REJECT_DEAD:
+        raise HTTPException(status_code=422, detail=f"Input not usable: {info.error}")
+    return info
+
+@app.post("/streams/probe")
+async def probe_stream_input(request: ProbeRequest):
+    if input_prober is None:
+        raise HTTPException(status_code=404, detail="Input probing is disabled")
+    info = await input_prober.probe(request.input_url, refresh=request.refresh)
+    if info is None:
+        raise HTTPException(status_code=503, detail=f"{Config.FFPROBE_PATH} is not available")
+    return info.to_dict()
+
+def startup_summary() -> Dict:
+    # Time from start request to first muxed output, over the active streams
+    values = sorted(
+        process.time_to_first_output for process in active_streams.values()
+        if process.time_to_first_output is not None
+    )
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "avg": round(sum(values) / len(values), 3),
+        "p50": round(values[len(values) // 2], 3),
+        "p95": round(values[min(len(values) - 1, int(len(values) * 0.95))], 3),
+        "max": round(values[-1], 3)
+    }
+
+async def batch_result(stream_id: str, call) -> Dict:
+    try:
+        return await call
+    except HTTPException as e:
+        return {"status": "error", "stream_id": stream_id, "status_code": e.status_code, "detail": e.detail}
+
+def batch_summary(results: List[Dict]) -> Dict:
+    failed = sum(1 for result in results if result["status"] == "error")
+    return {"succeeded": len(results) - failed, "failed": failed, "results": results}
+
+@app.post("/streams/start-batch")
+async def start_batch(request: BatchStartRequest):
+    # Everything is queued at once; the spawn limiter decides the pace
+    results = await asyncio.gather(*(
+        batch_result(stream.stream_id, place_stream(stream)) for stream in request.streams
+    ))
+    return batch_summary(list(results))
+
+@app.post("/streams/stop-batch")
+async def stop_batch(request: BatchStopRequest):
+    results = await asyncio.gather(*(
+        batch_result(stream_id, stop_anywhere(stream_id)) for stream_id in request.stream_ids
+    ))
+    return batch_summary(list(results))
+
+@app.get("/streams/capacity")
+async def streams_capacity():
+    return {
+        "max_streams": Config.MAX_STREAMS,
+        "active": len(active_streams),
+        "starting": len(starting_streams),
+        "spawn_limiter": spawn_limiter.stats(),
+        "input_probe": input_prober.stats() if input_prober else None,
+        "time_to_first_output": startup_summary()
+    }
 
 @app.post("/stream/stop/{stream_id}")
-async def stop_stream(stream_id: str):
+async def stop_stream(stream_id: str, request: Request):
+    if await forwarded(request):
+        return await stop_stream_local(stream_id)
+    return await stop_anywhere(stream_id)
+
+async def stop_anywhere(stream_id: str):
+    response = await owner_response(stream_id, 'POST', 'stop')
+    if response is not None:
+        # Normally released by the owner already; idempotent
+        await cluster.release(stream_id)
+        return response
+    return await stop_stream_local(stream_id)
+
+async def stop_stream_local(stream_id: str):
+    if stream_id in rendition_parents:
+        raise HTTPException(
+            status_code=400,
+            detail=f"{stream_id} is a rendition of {rendition_parents[stream_id]}; stop the parent stream"
+        )
     if stream_id not in active_streams:
+        state = stream_monitor.state(stream_id)
+        if state and state.crash_looped:
+            stream_monitor.forget(stream_id)
+            if cluster:
+                await cluster.release(stream_id)
+            return {"status": "stopped", "stream_id": stream_id}
+        if cluster and await cluster.owner(stream_id):
+            # Owned by a node that is gone: keep the rebalancer from moving it
+            await cluster.release(stream_id)
+            return {"status": "stopped", "stream_id": stream_id}
         raise HTTPException(status_code=404, detail="Stream not found")
     
     try:
-        os.killpg(os.getpgid(active_streams[stream_id]['process'].pid), signal.SIGTERM)
-        del active_streams[stream_id]
+        stream_monitor.forget(stream_id)
+        forget_renditions(stream_id)
+        process = active_streams.pop(stream_id)
+        if registry:
+            await registry.remove(stream_id)
+        if cluster:
+            await cluster.release(stream_id)
+        await process.stop(Config.STOP_TIMEOUT)
         logger.info(f"Stopped stream {stream_id}")
         return {"status": "stopped", "stream_id": stream_id}
         
@@ -80,84 +439,282 @@ async def stop_stream(stream_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/stream/status/{stream_id}")
-async def get_stream_status(stream_id: str):
+async def get_stream_status(stream_id: str, request: Request):
+    if not await forwarded(request):
+        response = await owner_response(stream_id, 'GET', 'status')
+        if response is not None:
+            return response
+    
+    # A rendition shares its parent's process
+    requested_id = stream_id
+    stream_id = rendition_parents.get(stream_id, stream_id)
+    state = stream_monitor.state(stream_id)
     if stream_id not in active_streams:
+        if state and state.crash_looped:
+            # Supervisor gave up on it
+            return StreamStatus(
+                stream_id=stream_id,
+                status="failed",
+                error=state.last_error,
+                restarts=state.restarts,
+                last_exit_reason=state.last_exit_reason
+            )
         return StreamStatus(
-            stream_id=stream_id,
+            stream_id=requested_id,
             status="stopped"
         )
     
-    stream_data = active_streams[stream_id]
-    process = stream_data['process']
+    process = active_streams[stream_id]
+    restarts = state.restarts if state else 0
+    last_exit_reason = state.last_exit_reason if state else None
     
-    if process.poll() is None:
-        uptime = (datetime.now() - stream_data['start_time']).total_seconds()
+    if process.running:
         return StreamStatus(
-            stream_id=stream_id,
+            stream_id=requested_id,
             status="running",
-            uptime=uptime
+            uptime=process.uptime,
+            metrics=process.metrics.to_dict(),
+            restarts=restarts,
+            last_exit_reason=last_exit_reason,
+            renditions=process.renditions,
+            startup=process.startup(),
+            remux=process.remux
         )
-    else:
-        error_output = process.stderr.read().decode()
-        del active_streams[stream_id]
+    
+    # Let the reader drain whatever ffmpeg wrote before exiting
+    await process.wait()
+    if stream_monitor.running:
+        # Left in place for the supervisor to restart
         return StreamStatus(
-            stream_id=stream_id,
-            status="failed",
-            error=error_output
+            stream_id=requested_id,
+            status="restarting",
+            uptime=process.uptime,
+            error=process.error(),
+            exit_code=process.returncode,
+            metrics=process.metrics.to_dict(),
+            restarts=restarts,
+            last_exit_reason=exit_reason(process),
+            renditions=process.renditions
         )
+    
+    del active_streams[stream_id]
+    forget_renditions(stream_id)
+    if registry:
+        await registry.remove(stream_id)
+    if cluster:
+        await cluster.release(stream_id)
+    return StreamStatus(
+        stream_id=requested_id,
+        status="failed",
+        uptime=process.uptime,
+        error=process.error(),
+        exit_code=process.returncode,
+        metrics=process.metrics.to_dict()
+    )
+
+@app.get("/stream/logs/{stream_id}")
+async def get_stream_logs(stream_id: str, request: Request, lines: int = 50):
+    if not await forwarded(request):
+        response = await owner_response(stream_id, 'GET', 'logs', params={'lines': lines})
+        if response is not None:
+            return response
+    
+    if stream_id not in active_streams:
+        raise HTTPException(status_code=404, detail="Stream not found")
+    
+    process = active_streams[stream_id]
+    return {
+        "stream_id": stream_id,
+        "lines_read": process.lines_read,
+        "lines": process.recent_output(lines)
+    }
 
 @app.get("/streams/list")
 async def list_streams():
-    return [
-        {
+    streams = []
+    for stream_id, process in active_streams.items():
+        state = stream_monitor.state(stream_id)
+        streams.append({
             "stream_id": stream_id,
-            "uptime": (datetime.now() - data['start_time']).total_seconds(),
-            "command": data['command']
-        }
-        for stream_id, data in active_streams.items()
-    ]
-
-def build_ffmpeg_command(stream: StreamInput) -> List[str]:
-    command = ['ffmpeg', '-y']
-    
-    # Input options
-    if stream.options and stream.options.get('input_options'):
-        command.extend(stream.options['input_options'])
-    
-    # Input URL
-    command.extend(['-i', stream.input_url])
+            "status": "running" if process.running and not stream_monitor.restart_pending(stream_id) else "restarting",
+            "pid": process.pid,
+            "running": process.running,
+            "uptime": process.uptime,
+            "command": process.command,
+            "restarts": state.restarts if state else 0,
+            "last_exit_reason": state.last_exit_reason if state else None,
+            "supervision": state.to_dict() if state else None,
+            "renditions": process.renditions,
+            "startup": process.startup(),
+            "remux": process.remux
+        })
     
-    # Transcoding profile
-    if stream.profile:
-        if 'video_codec' in stream.profile:
-            command.extend(['-c:v', stream.profile['video_codec']])
-        if 'audio_codec' in stream.profile:
-            command.extend(['-c:a', stream.profile['audio_codec']])
-        if 'video_bitrate' in stream.profile:
-            command.extend(['-b:v', stream.profile['video_bitrate']])
-        if 'audio_bitrate' in stream.profile:
-            command.extend(['-b:a', stream.profile['audio_bitrate']])
-        if 'resolution' in stream.profile:
-            command.extend(['-s', stream.profile['resolution']])
-    
-    # Output options
-    if stream.options and stream.options.get('output_options'):
-        command.extend(stream.options['output_options'])
+    # Streams the supervisor gave up on stay visible until stopped or restarted by hand
+    for stream_id, state in stream_monitor.crash_looped().items():
+        streams.append({
+            "stream_id": stream_id,
+            "status": "failed",
+            "pid": None,
+            "running": False,
+            "uptime": None,
+            "command": state.command,
+            "restarts": state.restarts,
+            "last_exit_reason": state.last_exit_reason,
+            "supervision": state.to_dict()
+        })
+    return streams
+
+@app.get("/cluster/nodes")
+async def cluster_nodes():
+    if cluster is None:
+        return {"enabled": False, "node_id": Config.NODE_ID}
+    return {"enabled": True, **await cluster.stats()}
+
+@app.get("/streams/profiles")
+async def list_profiles():
+    return {
+        "profiles": {name: dict(profile) for name, profile in profile_compiler.named.items()},
+        "compiler": profile_compiler.stats()
+    }
+
+@app.get("/streams/metrics")
+async def streams_metrics():
+    return {
+        stream_id: {**process.metrics.to_dict(), 'uptime': process.uptime, 'running': process.running,
+                    'time_to_first_output': process.time_to_first_output}
+        for stream_id, process in active_streams.items()
+    }
+
+@app.get("/streams/metrics/prometheus", response_class=PlainTextResponse)
+async def streams_metrics_prometheus():
+    return render_prometheus(
+        (stream_id, {**process.metrics.to_dict(), 'uptime': process.uptime,
+                     'time_to_first_output': process.time_to_first_output})
+        for stream_id, process in active_streams.items()
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    # One scrape target: service instrumentation plus the per-stream telemetry
+    return instrumentation.render_prometheus() + await streams_metrics_prometheus()
+
+@app.get("/metrics/summary")
+async def metrics_summary():
+    return instrumentation.summary()
+
+def fast_probe_options(input_options: List[str], info: Optional[InputInfo]) -> List[str]:
+    # The input was just probed successfully, so ffmpeg's own stream
+    # detection can read far less before starting (unless set by hand)
+    if info is None or not info.ok or '-probesize' in input_options or '-analyzeduration' in input_options:
+        return input_options
+    return ['-probesize', Config.PROBE_FAST_PROBESIZE, '-analyzeduration', Config.PROBE_FAST_ANALYZEDURATION] + input_options
+
+def build_ffmpeg_command(stream: StreamInput, info: Optional[InputInfo] = None,
+                         plan: Optional[List[Tuple[CompiledProfile, Dict]]] = None) -> List[str]:
+    # Only the URLs are substituted into a memoized, pre-validated template
+    input_options = fast_probe_options((stream.options or {}).get('input_options') or [], info)
+    if plan is None:
+        plan = plan_outputs(stream, info)
     
-    # Output URL
-    command.extend([stream.output_url])
+    if stream.renditions:
+        outputs = [
+            (profile, (rendition.options or {}).get('output_options') or [])
+            for rendition, (profile, _) in zip(stream.renditions, plan)
+        ]
+        # Without a probe the input is assumed to carry video
+        video = info is None or not info.ok or info.video is not None
+        template = profile_compiler.template(input_options, outputs, multi=True, video=video)
+        return profile_compiler.render(template, stream.input_url, [r.output_url for r in stream.renditions])
     
-    return command
+    output_options = (stream.options or {}).get('output_options') or []
+    template = profile_compiler.template(input_options, [(plan[0][0], output_options)])
+    return profile_compiler.render(template, stream.input_url, [stream.output_url])
+
+async def respawn_streams(processes: List[StreamProcess]):
+    # Registered streams whose ffmpeg died while the manager was down
+    for process in processes:
+        if process.stream_id in active_streams:
+            continue
+        await spawn_limiter.acquire()
+        try:
+            with spawn_timer.time(trigger='respawn'):
+                await process.start()
+        except Exception as e:
+            spawn_limiter.release()
+            logger.error(f"Failed to respawn stream {process.stream_id}: {str(e)}")
+            await registry.remove(process.stream_id)
+            if cluster:
+                await cluster.release(process.stream_id)
+            continue
+        spawn_limiter.release_when_ready(process.ready)
+        register_stream(process)
+        await registry.save(process)
+        logger.info(f"Respawned stream {process.stream_id}")
+
+async def recover_streams():
+    adopted, dead = await registry.recover(Config.STDERR_BUFFER_LINES)
+    if cluster:
+        # Streams moved to another node while this one was gone
+        moved = {process.stream_id for process in adopted + dead if not await cluster.adopt(process.stream_id)}
+        await asyncio.gather(*(
+            process.stop(Config.STOP_TIMEOUT) for process in adopted if process.stream_id in moved
+        ))
+        for stream_id in moved:
+            await registry.remove(stream_id)
+        adopted = [process for process in adopted if process.stream_id not in moved]
+        dead = [process for process in dead if process.stream_id not in moved]
+    for process in adopted:
+        register_stream(process)
+    if adopted or dead:
+        logger.info(f"Re-adopted {len(adopted)} running streams, respawning {len(dead)}")
+    if dead:
+        asyncio.create_task(respawn_streams(dead))
 
 @app.on_event("startup")
 async def startup_event():
+    global monitor_task, cluster_task
+    instrumentation.start()
+    await profile_compiler.probe()
+    spawn_limiter.open()
+    if input_prober:
+        input_prober.open()
+    if cluster:
+        await cluster.open()
+    if registry:
+        await registry.open()
+        await recover_streams()
+    monitor_task = asyncio.create_task(stream_monitor.start())
+    if cluster:
+        cluster_task = asyncio.create_task(cluster.run())
+        logger.info(f"Cluster node {Config.NODE_ID} ({Config.CLUSTER_BACKEND}) at {Config.NODE_URL}")
     logger.info("Stream Manager service started")
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    for stream_id in list(active_streams.keys()):
-        try:
-            await stop_stream(stream_id)
-        except Exception as e:
-            logger.error(f"Error stopping stream {stream_id} during shutdown: {str(e)}")
+    # Stop supervising first so streams being shut down aren't restarted
+    await stream_monitor.stop()
+    if monitor_task:
+        monitor_task.cancel()
+    await instrumentation.stop()
+    if cluster_task:
+        cluster_task.cancel()
+    
+    if registry and Config.DETACH_ON_SHUTDOWN:
+        # Leave ffmpeg running; the next instance re-adopts it from the registry
+        await registry.close()
+        if cluster:
+            await cluster.close(deregister=False)
+        logger.info(f"Stream Manager service stopped, left {len(active_streams)} streams running")
+        return
+    
+    # All streams get SIGTERM at once and share one SIGKILL deadline
+    stream_ids = list(active_streams.keys())
+    results = await asyncio.gather(*(stop_stream_local(stream_id) for stream_id in stream_ids), return_exceptions=True)
+    for stream_id, result in zip(stream_ids, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error stopping stream {stream_id} during shutdown: {str(result)}")
+    if registry:
+        await registry.close()
+    if cluster:
+        await cluster.close()
     logger.info("Stream Manager service stopped")
@@ -0,0 +1,329 @@
+# File: cryonix/services/stream_manager/profile_compiler.py
+
+import asyncio
+import logging
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+PROFILE_KEYS = ('video_codec', 'audio_codec', 'video_bitrate', 'audio_bitrate', 'resolution')
+VIDEO_KEYS = ('video_codec', 'video_bitrate', 'resolution')
+BITRATE_RE = re.compile(r'^\d+(\.\d+)?[kKmM]?$')
+RESOLUTION_RE = re.compile(r'^(\d+)x(\d+)$')
+ENCODER_RE = re.compile(r'^\s*([VAS])[A-Z.]{5}\s+(\S+)')
+VERSION_RE = re.compile(r'ffmpeg version n?(\d+)\.(\d+)')
+
+# Codec an encoder produces, as ffprobe names it, for passthrough matching
+ENCODER_CODECS = {
+    'libx264': 'h264', 'h264_nvenc': 'h264', 'h264_vaapi': 'h264', 'h264_qsv': 'h264', 'h264_amf': 'h264',
+    'libx265': 'hevc', 'hevc_nvenc': 'hevc', 'hevc_vaapi': 'hevc', 'hevc_qsv': 'hevc', 'hevc_amf': 'hevc',
+    'libvpx': 'vp8', 'libvpx-vp9': 'vp9', 'libaom-av1': 'av1', 'libsvtav1': 'av1',
+    'aac': 'aac', 'libfdk_aac': 'aac', 'libmp3lame': 'mp3', 'libopus': 'opus'
+}
+# Pixel formats a copied video stream may have (8-bit 4:2:0, what the encoders above output by default)
+COPY_PIX_FMTS = (None, 'yuv420p', 'yuvj420p', 'nv12')
+
+def bitrate_bps(value: str) -> float:
+    scale = {'k': 1e3, 'm': 1e6}.get(value[-1].lower())
+    return float(value[:-1]) * scale if scale else float(value)
+
+# A validated profile in hashable form: ((key, value), ...) in PROFILE_KEYS order
+CompiledProfile = Tuple[Tuple[str, str], ...]
+
+class ProfileError(ValueError):
+    pass
+
+class FFmpegCapabilities:
+    def __init__(self, encoders: Optional[Set[str]] = None, version: Optional[Tuple[int, int]] = None):
+        self.encoders = encoders  # None when the probe failed: codecs are not checked
+        self.version = version
+
+    @property
+    def supports_stats_period(self) -> bool:
+        # -stats_period arrived in ffmpeg 4.4; unknown/git builds are assumed recent
+        return self.version is None or self.version >= (4, 4)
+
+    def to_dict(self) -> Dict:
+        return {
+            'version': '.'.join(map(str, self.version)) if self.version else None,
+            'encoders': sorted(self.encoders) if self.encoders is not None else None,
+            'stats_period': self.supports_stats_period
+        }
+
+async def run_ffmpeg(ffmpeg_path: str, *args: str, timeout: float = 10) -> str:
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg_path, *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    return stdout.decode('utf-8', 'replace')
+
+async def probe_capabilities(ffmpeg_path: str) -> FFmpegCapabilities:
+    try:
+        version_output = await run_ffmpeg(ffmpeg_path, '-hide_banner', '-version')
+        encoders_output = await run_ffmpeg(ffmpeg_path, '-hide_banner', '-encoders')
+    except (OSError, asyncio.TimeoutError) as e:
+        logger.error(f"Could not probe {ffmpeg_path}, codecs will not be validated: {e!r}")
+        return FFmpegCapabilities()
+
+    match = VERSION_RE.search(version_output)
+    version = (int(match.group(1)), int(match.group(2))) if match else None
+
+    encoders = set()
+    for line in encoders_output.splitlines():
+        match = ENCODER_RE.match(line)
+        # Skip the legend (" V..... = Video") at the top of the listing
+        if match and match.group(2) != '=':
+            encoders.add(match.group(2))
+    return FFmpegCapabilities(encoders, version)
+
+# Placeholders in a command template, filled in per stream
+class InputSlot:
+    pass
+
+class OutputSlot:
+    def __init__(self, index: int):
+        self.index = index
+
+INPUT_URL = InputSlot()
+
+# Turns transcoding profiles into ffmpeg arguments. Profiles are validated
+# once (unknown keys, malformed bitrates/resolutions, encoders the local
+# ffmpeg doesn't have) and whole argv templates are memoized by their
+# shape, so starting a stream only substitutes URLs into a cached template.
+class ProfileCompiler:
+    def __init__(self, ffmpeg_path: str, profiles: Dict[str, Dict], progress: bool = True,
+                 stats_period: str = '1', cache_size: int = 1024):
+        self.ffmpeg_path = ffmpeg_path
+        self.profiles = profiles
+        self.progress = progress
+        self.stats_period = stats_period
+        self.cache_size = cache_size
+        self.capabilities = FFmpegCapabilities()
+        self.named: Dict[str, CompiledProfile] = {}
+        self._templates: Dict[Tuple, Tuple] = {}
+        self.stats_counters = {'template_hits': 0, 'template_misses': 0}
+        self._load_profiles()
+
+    def _load_profiles(self):
+        self._templates.clear()
+        self.named = {}
+        for name, profile in self.profiles.items():
+            try:
+                self.named[name] = self.validate(profile)
+            except ProfileError as e:
+                logger.error(f"Transcoding profile '{name}' disabled: {e}")
+
+    async def probe(self):
+        # Probed once at startup; named profiles are re-validated against the result
+        self.capabilities = await probe_capabilities(self.ffmpeg_path)
+        self._load_profiles()
+        logger.info(f"ffmpeg {self.capabilities.to_dict()['version']}: "
+                    f"{len(self.named)}/{len(self.profiles)} profiles usable")
+
+    def validate(self, profile: Dict) -> CompiledProfile:
+        unknown = set(profile) - set(PROFILE_KEYS)
+        if unknown:
+            raise ProfileError(f"Unknown profile keys: {', '.join(sorted(unknown))}")
+
+        encoders = self.capabilities.encoders
+        for key in ('video_codec', 'audio_codec'):
+            codec = profile.get(key)
+            if codec is not None and codec != 'copy' and encoders is not None and codec not in encoders:
+                raise ProfileError(f"Encoder not supported by {self.ffmpeg_path}: {codec}")
+        for key in ('video_bitrate', 'audio_bitrate'):
+            if key in profile and not BITRATE_RE.match(str(profile[key])):
+                raise ProfileError(f"Invalid {key}: {profile[key]}")
+        if 'resolution' in profile and not RESOLUTION_RE.match(str(profile['resolution'])):
+            raise ProfileError(f"Invalid resolution: {profile['resolution']}")
+
+        return tuple((key, str(profile[key])) for key in PROFILE_KEYS if key in profile)
+
+    def resolve(self, profile: Union[str, Dict, None]) -> CompiledProfile:
+        if profile is None:
+            return ()
+        if isinstance(profile, str):
+            if profile not in self.named:
+                raise ProfileError(f"Unknown profile: {profile}")
+            return self.named[profile]
+        return self.validate(profile)
+
+    def passthrough(self, profile: CompiledProfile, video: Optional[Dict], audio: Optional[Dict],
+                    tolerance: float = 1.25) -> Tuple[CompiledProfile, Dict]:
+        # Compares a probed input with the profile and switches every track
+        # that already matches (codec, resolution, bitrate within tolerance x
+        # the target) to stream copy. Returns the profile to encode with and
+        # the decision per track.
+        settings = dict(profile)
+        reasons: List[str] = []
+        tracks = {}
+
+        if video is None:
+            tracks['video'] = 'absent'
+        else:
+            why = self._video_mismatch(settings, video, tolerance)
+            tracks['video'] = 'transcode' if why else 'copy'
+            if why:
+                reasons.append(why)
+            else:
+                settings['video_codec'] = 'copy'
+                settings.pop('video_bitrate', None)
+                settings.pop('resolution', None)
+
+        if audio is None:
+            tracks['audio'] = 'absent'
+        else:
+            why = self._track_mismatch('audio', settings, audio, tolerance)
+            tracks['audio'] = 'transcode' if why else 'copy'
+            if why:
+                reasons.append(why)
+            else:
+                settings['audio_codec'] = 'copy'
+                settings.pop('audio_bitrate', None)
+
+        present = [mode for mode in tracks.values() if mode != 'absent']
+        if present and all(mode == 'copy' for mode in present):
+            mode = 'remux'
+        elif 'copy' in present:
+            mode = 'partial'
+        else:
+            mode = 'transcode'
+        compiled = tuple((key, settings[key]) for key in PROFILE_KEYS if key in settings)
+        return compiled, {'mode': mode, **tracks, 'reasons': reasons}
+
+    @staticmethod
+    def _track_mismatch(kind: str, settings: Dict[str, str], track: Dict, tolerance: float) -> Optional[str]:
+        encoder = settings.get(f'{kind}_codec')
+        if encoder is None:
+            return f"profile sets no {kind} codec"
+        if encoder != 'copy' and ENCODER_CODECS.get(encoder, encoder) != track.get('codec'):
+            return f"{kind} is {track.get('codec')}, profile wants {ENCODER_CODECS.get(encoder, encoder)}"
+        target = settings.get(f'{kind}_bitrate')
+        # Inputs that don't report a bitrate (common for live TS/HLS) are not held back
+        if target and track.get('bit_rate') and track['bit_rate'] > bitrate_bps(target) * tolerance:
+            return f"{kind} bitrate {track['bit_rate'] // 1000}k is above {target}"
+        return None
+
+    def _video_mismatch(self, settings: Dict[str, str], video: Dict, tolerance: float) -> Optional[str]:
+        why = self._track_mismatch('video', settings, video, tolerance)
+        if why or settings.get('video_codec') == 'copy':
+            return why
+        resolution = settings.get('resolution')
+        if resolution and resolution != f"{video.get('width')}x{video.get('height')}":
+            return f"video is {video.get('width')}x{video.get('height')}, profile wants {resolution}"
+        if video.get('pix_fmt') not in COPY_PIX_FMTS:
+            return f"video pixel format {video['pix_fmt']} is not 8-bit 4:2:0"
+        return None
+
+    @staticmethod
+    def profile_args(profile: CompiledProfile, scaled: bool = False, video: bool = True) -> List[str]:
+        flags = {'video_codec': '-c:v', 'audio_codec': '-c:a', 'video_bitrate': '-b:v',
+                 'audio_bitrate': '-b:a', 'resolution': '-s'}
+        args = []
+        for key, value in profile:
+            # In multi-rendition graphs the scale filter already sized the video
+            if key == 'resolution' and scaled:
+                continue
+            if key in VIDEO_KEYS and not video:
+                continue
+            args.extend([flags[key], value])
+        return args
+
+    def _global_args(self) -> List[str]:
+        args = [self.ffmpeg_path, '-y']
+        # Machine-readable progress on stdout instead of the stderr status line
+        if self.progress:
+            args.extend(['-nostats', '-progress', 'pipe:1'])
+            if self.stats_period and self.capabilities.supports_stats_period:
+                args.extend(['-stats_period', self.stats_period])
+        return args
+
+    def _single(self, input_options: Tuple[str, ...], profile: CompiledProfile,
+                output_options: Tuple[str, ...]) -> Tuple:
+        return tuple(self._global_args() + list(input_options) + ['-i', INPUT_URL]
+                     + self.profile_args(profile) + list(output_options) + [OutputSlot(0)])
+
+    def _multi(self, input_options: Tuple[str, ...], renditions: Tuple[Tuple[CompiledProfile, Tuple[str, ...]], ...],
+               video: bool = True) -> Tuple:
+        # One decode, split once per encoded rendition, scaled per rendition:
+        # [0:v]split=3[s0][s1][s2];[s0]scale=1920:1080[v0];...
+        # Renditions copying the video map the input stream directly.
+        if not video:
+            return self._multi_audio(input_options, renditions)
+        encoded = [i for i, (profile, _) in enumerate(renditions) if dict(profile).get('video_codec') != 'copy']
+        filters = [f"[0:v]split={len(encoded)}" + ''.join(f"[s{i}]" for i in encoded)] if encoded else []
+        args = []
+        for i, (profile, output_options) in enumerate(renditions):
+            resolution = dict(profile).get('resolution')
+            if i not in encoded:
+                video = '0:v'
+            elif resolution:
+                width, height = resolution.split('x')
+                filters.append(f"[s{i}]scale={width}:{height}[v{i}]")
+                video = f"[v{i}]"
+            else:
+                video = f"[s{i}]"
+
+            args.extend(['-map', video, '-map', '0:a?'])
+            args.extend(self.profile_args(profile, scaled=True))
+            args.extend(output_options)
+            args.append(OutputSlot(i))
+
+        graph = ['-filter_complex', ';'.join(filters)] if filters else []
+        return tuple(self._global_args() + list(input_options) + ['-i', INPUT_URL] + graph + args)
+
+    def _multi_audio(self, input_options: Tuple[str, ...],
+                     renditions: Tuple[Tuple[CompiledProfile, Tuple[str, ...]], ...]) -> Tuple:
+        # Audio-only input (radio): there is no [0:v] to split, so every
+        # rendition maps the audio and the video settings are dropped
+        args = []
+        for i, (profile, output_options) in enumerate(renditions):
+            args.extend(['-map', '0:a'])
+            args.extend(self.profile_args(profile, video=False))
+            args.extend(output_options)
+            args.append(OutputSlot(i))
+        return tuple(self._global_args() + list(input_options) + ['-i', INPUT_URL] + args)
+
+    def template(self, input_options: Sequence[str], outputs: Sequence[Tuple[CompiledProfile, Sequence[str]]],
+                 multi: bool = False, video: bool = True) -> Tuple:
+        # video=False when the probe found no video track
+        key = (tuple(input_options), tuple((profile, tuple(options)) for profile, options in outputs), multi, video)
+        template = self._templates.get(key)
+        if template is not None:
+            self.stats_counters['template_hits'] += 1
+            return template
+
+        self.stats_counters['template_misses'] += 1
+        if multi:
+            template = self._multi(key[0], key[1], video)
+        else:
+            profile, output_options = key[1][0]
+            template = self._single(key[0], profile, output_options)
+
+        if len(self._templates) >= self.cache_size:
+            self._templates.clear()
+        self._templates[key] = template
+        return template
+
+    @staticmethod
+    def render(template: Tuple, input_url: str, output_urls: Sequence[str]) -> List[str]:
+        return [
+            input_url if arg is INPUT_URL else output_urls[arg.index] if isinstance(arg, OutputSlot) else arg
+            for arg in template
+        ]
+
+    def stats(self) -> Dict:
+        return {
+            **self.stats_counters,
+            'templates': len(self._templates),
+            'profiles': sorted(self.named),
+            'ffmpeg': self.capabilities.to_dict()
+        }
@@ -0,0 +1,88 @@
+# File: cryonix/services/stream_manager/spawn_limiter.py
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Admission control for ffmpeg spawns. A token bucket caps the spawn rate
+# (rate per second, up to burst at once) and a semaphore caps how many
+# streams may be starting at the same time. A start slot is held until the
+# new process reports its first progress (or exits, or startup_timeout
+# passes), so hundreds of queued starts reach the upstreams and the CPU in
+# waves instead of all at once.
+class SpawnLimiter:
+    def __init__(self, rate: float = 10, burst: int = 10, max_concurrent: int = 20, startup_timeout: float = 15):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrent = max(1, max_concurrent)
+        self.startup_timeout = startup_timeout
+        self.tokens = float(self.burst)
+        self.waiting = 0
+        self.starting = 0
+        self.admitted = 0
+        self._updated = time.monotonic()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def open(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        self._lock = asyncio.Lock()
+
+    async def _take_token(self):
+        # Tokens are handed out in order; a waiter sleeps only for its own deficit
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens < 1 and self.rate > 0:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self._updated = time.monotonic()
+            self.tokens -= 1
+
+    async def acquire(self) -> float:
+        # Returns the seconds spent queued
+        if self._semaphore is None:
+            self.open()
+        started = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+            try:
+                await self._take_token()
+            except BaseException:
+                self._semaphore.release()
+                raise
+        finally:
+            self.waiting -= 1
+        self.starting += 1
+        self.admitted += 1
+        return time.monotonic() - started
+
+    def release(self):
+        self.starting -= 1
+        self._semaphore.release()
+
+    def release_when_ready(self, ready: asyncio.Event):
+        async def wait_ready():
+            try:
+                await asyncio.wait_for(ready.wait(), self.startup_timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.release()
+        asyncio.create_task(wait_ready())
+
+    def stats(self) -> Dict:
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'max_concurrent': self.max_concurrent,
+            'tokens': round(self.tokens, 2),
+            'waiting': self.waiting,
+            'starting': self.starting,
+            'admitted': self.admitted
+        }
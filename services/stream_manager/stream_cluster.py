@@ -0,0 +1,437 @@
+# File: cryonix/services/stream_manager/stream_cluster.py
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Mapping, Optional
+from urllib.parse import quote, unquote
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Set on requests one node sends to another, so the receiver handles them
+# locally instead of placing/forwarding them again. Only trusted together
+# with a valid signature: HMAC-SHA256 with the shared cluster secret over
+# the method, path, timestamp, sending node and body.
+FORWARDED_HEADER = 'X-Cryonix-Forwarded'
+TIMESTAMP_HEADER = 'X-Cryonix-Timestamp'
+SIGNATURE_HEADER = 'X-Cryonix-Signature'
+
+def request_signature(secret: str, node_id: str, method: str, path: str, timestamp: str, body: bytes) -> str:
+    message = '\n'.join((method.upper(), path, timestamp, node_id, hashlib.sha256(body).hexdigest()))
+    return hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def signed_headers(secret: str, node_id: str, method: str, path: str, body: bytes) -> Dict[str, str]:
+    timestamp = str(int(time.time()))
+    return {
+        FORWARDED_HEADER: node_id,
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: request_signature(secret, node_id, method, path, timestamp, body)
+    }
+
+def verify_signature(secret: str, method: str, path: str, body: bytes, headers: Mapping[str, str],
+                     max_skew: float = 30) -> bool:
+    # path is the decoded request path, as the sender signed it
+    node_id = headers.get(FORWARDED_HEADER)
+    timestamp = headers.get(TIMESTAMP_HEADER)
+    signature = headers.get(SIGNATURE_HEADER)
+    if not secret or not node_id or not timestamp or not signature:
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > max_skew:
+            return False
+    except ValueError:
+        return False
+    expected = request_signature(secret, node_id, method, path, timestamp, body)
+    return hmac.compare_digest(expected, signature)
+
+class ClusterError(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def node_cpu() -> float:
+    # 1-minute load average per core
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except OSError:
+        return 0.0
+
+# In-process stand-in for Redis: a single node, or several schedulers
+# sharing one instance in tests
+class MemoryClusterBackend:
+    def __init__(self):
+        self._nodes: Dict[str, tuple] = {}  # node_id -> (expires_at, info)
+        self._owners: Dict[str, str] = {}
+        self._specs: Dict[str, Dict] = {}
+        self._locks: Dict[str, tuple] = {}  # name -> (expires_at, holder)
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def heartbeat(self, node_id: str, info: Dict, ttl: float):
+        self._nodes[node_id] = (time.monotonic() + ttl, info)
+
+    async def deregister(self, node_id: str):
+        self._nodes.pop(node_id, None)
+
+    async def nodes(self) -> Dict[str, Dict]:
+        now = time.monotonic()
+        for node_id in [node_id for node_id, (expires, _) in self._nodes.items() if expires <= now]:
+            del self._nodes[node_id]
+        return {node_id: info for node_id, (_, info) in self._nodes.items()}
+
+    async def owners(self) -> Dict[str, str]:
+        return dict(self._owners)
+
+    async def owner(self, stream_id: str) -> Optional[str]:
+        return self._owners.get(stream_id)
+
+    async def spec(self, stream_id: str) -> Optional[Dict]:
+        return self._specs.get(stream_id)
+
+    async def claim(self, stream_id: str, node_id: str, spec: Dict) -> bool:
+        if stream_id in self._owners:
+            return False
+        await self.assign(stream_id, node_id, spec)
+        return True
+
+    async def assign(self, stream_id: str, node_id: str, spec: Optional[Dict] = None):
+        self._owners[stream_id] = node_id
+        if spec is not None:
+            self._specs[stream_id] = spec
+
+    async def release(self, stream_id: str):
+        self._owners.pop(stream_id, None)
+        self._specs.pop(stream_id, None)
+
+    async def lock(self, name: str, holder: str, ttl: float) -> bool:
+        now = time.monotonic()
+        expires, current = self._locks.get(name, (0, None))
+        if expires > now and current != holder:
+            return False
+        self._locks[name] = (now + ttl, holder)
+        return True
+
+    async def unlock(self, name: str, holder: str):
+        if self._locks.get(name, (0, None))[1] == holder:
+            del self._locks[name]
+
+# Shared state in Redis. Node heartbeats are keys that expire after the TTL;
+# ownership (stream -> node) and the start requests needed to move a stream
+# are kept in two hashes, so counting streams per node stays cheap.
+class RedisClusterBackend:
+    def __init__(self, url: str, prefix: str = 'cryonix'):
+        self.url = url
+        self.prefix = prefix
+        self.redis = None
+
+    def key(self, *parts: str) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    async def open(self):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:
+            raise RuntimeError("CLUSTER_BACKEND=redis needs the redis package (redis>=4.2)")
+        self.redis = aioredis.from_url(self.url, decode_responses=True)
+        await self.redis.ping()
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.close()
+            self.redis = None
+
+    async def heartbeat(self, node_id: str, info: Dict, ttl: float):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.set(self.key('node', node_id), json.dumps(info), ex=max(1, int(ttl)))
+            pipe.sadd(self.key('nodes'), node_id)
+            await pipe.execute()
+
+    async def deregister(self, node_id: str):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.delete(self.key('node', node_id))
+            pipe.srem(self.key('nodes'), node_id)
+            await pipe.execute()
+
+    async def nodes(self) -> Dict[str, Dict]:
+        node_ids = sorted(await self.redis.smembers(self.key('nodes')))
+        if not node_ids:
+            return {}
+        values = await self.redis.mget([self.key('node', node_id) for node_id in node_ids])
+        expired = [node_id for node_id, value in zip(node_ids, values) if value is None]
+        if expired:
+            await self.redis.srem(self.key('nodes'), *expired)
+        return {node_id: json.loads(value) for node_id, value in zip(node_ids, values) if value is not None}
+
+    async def owners(self) -> Dict[str, str]:
+        return await self.redis.hgetall(self.key('owners'))
+
+    async def owner(self, stream_id: str) -> Optional[str]:
+        return await self.redis.hget(self.key('owners'), stream_id)
+
+    async def spec(self, stream_id: str) -> Optional[Dict]:
+        value = await self.redis.hget(self.key('specs'), stream_id)
+        return json.loads(value) if value else None
+
+    async def claim(self, stream_id: str, node_id: str, spec: Dict) -> bool:
+        if not await self.redis.hsetnx(self.key('owners'), stream_id, node_id):
+            return False
+        await self.redis.hset(self.key('specs'), stream_id, json.dumps(spec))
+        return True
+
+    async def assign(self, stream_id: str, node_id: str, spec: Optional[Dict] = None):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hset(self.key('owners'), stream_id, node_id)
+            if spec is not None:
+                pipe.hset(self.key('specs'), stream_id, json.dumps(spec))
+            await pipe.execute()
+
+    async def release(self, stream_id: str):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.hdel(self.key('owners'), stream_id)
+            pipe.hdel(self.key('specs'), stream_id)
+            await pipe.execute()
+
+    async def lock(self, name: str, holder: str, ttl: float) -> bool:
+        return bool(await self.redis.set(self.key('lock', name), holder, nx=True, ex=max(1, int(ttl))))
+
+    async def unlock(self, name: str, holder: str):
+        if await self.redis.get(self.key('lock', name)) == holder:
+            await self.redis.delete(self.key('lock', name))
+
+# Places streams across the stream manager nodes sharing a backend. Every
+# node heartbeats its CPU load and stream count; a new stream goes to the
+# node with the lowest cpu + assigned / max_streams that still has room,
+# and start/stop/status requests for a stream are forwarded to its owner.
+# When a node stops heartbeating for node_ttl seconds, one surviving node
+# (holding the rebalance lock) starts its streams again on the others.
+class StreamScheduler:
+    def __init__(self, backend, node_id: str, node_url: str, max_streams: int,
+                 local_streams: Callable[[], int], start_local: Callable[[Dict], Awaitable[Dict]],
+                 heartbeat_interval: float = 5, node_ttl: float = 30, cpu_limit: float = 0.9,
+                 forward_timeout: float = 60, secret: str = '', max_skew: float = 30):
+        self.backend = backend
+        self.node_id = node_id
+        self.node_url = node_url.rstrip('/')
+        self.max_streams = max_streams
+        self.local_streams = local_streams
+        self.start_local = start_local
+        self.heartbeat_interval = heartbeat_interval
+        self.node_ttl = node_ttl
+        self.cpu_limit = cpu_limit
+        self.forward_timeout = forward_timeout
+        self.secret = secret
+        self.max_skew = max_skew
+        self.running = False
+        self.moved = 0
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._placing: Optional[asyncio.Lock] = None
+
+    async def open(self):
+        self._placing = asyncio.Lock()
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.forward_timeout))
+        await self.backend.open()
+        await self.heartbeat()
+
+    async def close(self, deregister: bool = True):
+        self.running = False
+        # Detached nodes let their heartbeat expire instead: a quick restart
+        # comes back before node_ttl and its streams are not moved
+        if deregister:
+            await self.backend.deregister(self.node_id)
+        await self.backend.close()
+        if self._session:
+            await self._session.close()
+
+    async def heartbeat(self):
+        await self.backend.heartbeat(self.node_id, {
+            'url': self.node_url,
+            'cpu': round(node_cpu(), 3),
+            'streams': self.local_streams(),
+            'max_streams': self.max_streams,
+            'updated': time.time()
+        }, self.node_ttl)
+
+    async def run(self):
+        self.running = True
+        while self.running:
+            try:
+                await self.heartbeat()
+                await self.rebalance()
+            except Exception as e:
+                logger.error(f"Cluster heartbeat failed: {e!r}")
+            await asyncio.sleep(self.heartbeat_interval)
+
+    def choose(self, nodes: Dict[str, Dict], owners: Dict[str, str]) -> Optional[str]:
+        # Ownership counts are current; CPU is as fresh as the last heartbeat
+        assigned: Dict[str, int] = {}
+        for node_id in owners.values():
+            assigned[node_id] = assigned.get(node_id, 0) + 1
+
+        best = None
+        for node_id, info in nodes.items():
+            count = assigned.get(node_id, 0)
+            capacity = info.get('max_streams') or 1
+            if count >= capacity or info.get('cpu', 0) >= self.cpu_limit:
+                continue
+            # Equal CPU alternates by stream count; a much busier node only wins when nearly empty
+            score = (info.get('cpu', 0) + (count + 1) / capacity, node_id != self.node_id)
+            if best is None or score < best[0]:
+                best = (score, node_id)
+        return best[1] if best else None
+
+    async def place(self, stream_id: str, spec: Dict, moving_from: Optional[str] = None) -> str:
+        async with self._placing:
+            nodes = await self.backend.nodes()
+            owners = await self.backend.owners()
+            if moving_from is None and stream_id in owners:
+                raise ClusterError(400, f"Stream already running on node {owners[stream_id]}")
+            if moving_from is not None and owners.get(stream_id) != moving_from:
+                raise ClusterError(409, f"Stream {stream_id} was already moved")
+
+            node_id = self.choose(nodes, owners)
+            if node_id is None:
+                raise ClusterError(503, f"No node has capacity ({len(nodes)} nodes)")
+            if moving_from is None:
+                if not await self.backend.claim(stream_id, node_id, spec):
+                    raise ClusterError(400, "Stream already running")
+            else:
+                await self.backend.assign(stream_id, node_id, spec)
+            return node_id
+
+    async def dispatch(self, node_id: str, spec: Dict) -> Dict:
+        if node_id == self.node_id:
+            return await self.start_local(spec)
+        return await self.forward(node_id, 'POST', '/stream/start', spec)
+
+    async def start(self, stream_id: str, spec: Dict) -> Dict:
+        node_id = await self.place(stream_id, spec)
+        try:
+            result = await self.dispatch(node_id, spec)
+        except BaseException:
+            await self.backend.release(stream_id)
+            raise
+        return {**result, 'node': node_id}
+
+    async def owner(self, stream_id: str) -> Optional[str]:
+        return await self.backend.owner(stream_id)
+
+    async def locate(self, stream_id: str) -> Optional[str]:
+        # Rendition ids ("<stream>:<name>") are owned through their parent
+        owner = await self.backend.owner(stream_id)
+        if owner is None and ':' in stream_id:
+            owner = await self.backend.owner(stream_id.rsplit(':', 1)[0])
+        return owner
+
+    async def remote_owner(self, stream_id: str) -> Optional[str]:
+        # The live node a request for stream_id has to go to, or None to handle it here
+        owner = await self.locate(stream_id)
+        if owner is None or owner == self.node_id:
+            return None
+        if owner not in await self.backend.nodes():
+            return None
+        return owner
+
+    async def release(self, stream_id: str):
+        await self.backend.release(stream_id)
+
+    async def adopt(self, stream_id: str) -> bool:
+        # Streams recovered from the local registry are kept unless they were
+        # moved to another live node while this one was gone
+        owner = await self.backend.owner(stream_id)
+        if owner is not None and owner != self.node_id and owner in await self.backend.nodes():
+            logger.warning(f"Stream {stream_id} was moved to node {owner}, dropping the local copy")
+            return False
+        if owner != self.node_id:
+            await self.backend.assign(stream_id, self.node_id)
+        return True
+
+    async def forward(self, node_id: str, method: str, path: str, body: Optional[Dict] = None,
+                      params: Optional[Dict] = None) -> Dict:
+        nodes = await self.backend.nodes()
+        if node_id not in nodes:
+            raise ClusterError(503, f"Node {node_id} is not available")
+        url = nodes[node_id]['url'].rstrip('/') + path
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        headers = signed_headers(self.secret, self.node_id, method, unquote(path), data)
+        if body is not None:
+            headers['Content-Type'] = 'application/json'
+        try:
+            async with self._session.request(method, url, data=data or None, params=params,
+                                             headers=headers) as response:
+                result = await response.json(content_type=None)
+                if response.status >= 400:
+                    detail = result.get('detail') if isinstance(result, dict) else result
+                    raise ClusterError(response.status, detail)
+                return result
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise ClusterError(502, f"Node {node_id} unreachable: {e!r}")
+
+    def verify(self, method: str, path: str, body: bytes, headers: Mapping[str, str]) -> bool:
+        return verify_signature(self.secret, method, path, body, headers, self.max_skew)
+
+    def stream_path(self, action: str, stream_id: str) -> str:
+        return f"/stream/{action}/{quote(stream_id, safe='')}"
+
+    async def rebalance(self):
+        nodes = await self.backend.nodes()
+        orphaned = [(stream_id, owner) for stream_id, owner in (await self.backend.owners()).items()
+                    if owner not in nodes]
+        if not orphaned or not await self.backend.lock('rebalance', self.node_id, self.node_ttl):
+            return
+        try:
+            lost = sorted({owner for _, owner in orphaned})
+            logger.warning(f"Nodes gone: {', '.join(lost)}; moving {len(orphaned)} streams")
+            for stream_id, owner in orphaned:
+                await self.move(stream_id, owner)
+        finally:
+            await self.backend.unlock('rebalance', self.node_id)
+
+    async def move(self, stream_id: str, owner: str):
+        spec = await self.backend.spec(stream_id)
+        if spec is None:
+            # Claimed by a node from its registry before clustering was on
+            logger.error(f"Cannot move stream {stream_id} from {owner}: its start request is unknown")
+            await self.backend.release(stream_id)
+            return
+        try:
+            node_id = await self.place(stream_id, spec, moving_from=owner)
+        except ClusterError as e:
+            logger.error(f"Cannot move stream {stream_id} from {owner}: {e.detail}")
+            return
+        try:
+            await self.dispatch(node_id, spec)
+            self.moved += 1
+            logger.info(f"Moved stream {stream_id} from {owner} to {node_id}")
+        except ClusterError as e:
+            logger.error(f"Failed to move stream {stream_id} to {node_id}: {e.detail}")
+            if e.status_code >= 500:
+                # Retried on the next pass
+                await self.backend.assign(stream_id, owner)
+            else:
+                await self.backend.release(stream_id)
+
+    async def stats(self) -> Dict:
+        nodes = await self.backend.nodes()
+        assigned: Dict[str, int] = {}
+        orphaned = 0
+        for owner in (await self.backend.owners()).values():
+            assigned[owner] = assigned.get(owner, 0) + 1
+            orphaned += owner not in nodes
+        return {
+            'node_id': self.node_id,
+            'nodes': {node_id: {**info, 'assigned': assigned.get(node_id, 0)} for node_id, info in nodes.items()},
+            'orphaned': orphaned,
+            'moved': self.moved
+        }
@@ -0,0 +1,139 @@
+# File: cryonix/services/stream_manager/stream_metrics.py
+
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, Tuple
+
+from instrumentation import escape_label
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+def parse_number(value: str, suffix: str = '') -> Optional[float]:
+    # ffmpeg reports 'N/A' until it has a value, and units such as '1.02x' or '2000.1kbits/s'
+    value = value.strip()
+    if suffix and value.endswith(suffix):
+        value = value[:-len(suffix)]
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def read_process_times(pid: int) -> Optional[Tuple[float, int]]:
+    # (cpu seconds, rss bytes) from procfs, None once the process is gone
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+        with open(f'/proc/{pid}/statm') as f:
+            statm = f.read().split()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces; the remaining fields follow the last ')'
+    fields = stat[stat.rindex(')') + 2:].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    return cpu_seconds, int(statm[1]) * PAGE_SIZE
+
+# Rolling telemetry for one ffmpeg process, fed from its -progress output.
+# ffmpeg writes a block of key=value lines every stats period and ends each
+# block with progress=continue|end; a snapshot is published per block.
+class StreamMetrics:
+    def __init__(self, window: int = 30):
+        self.current: Dict = {}
+        self.updates = 0
+        self.updated_at: Optional[float] = None
+        self.speeds = deque(maxlen=window)
+        self.fps_history = deque(maxlen=window)
+        self.cpu_percent: Optional[float] = None
+        self.rss_bytes: Optional[int] = None
+        self._block: Dict[str, str] = {}
+        self._last_cpu: Optional[Tuple[float, float]] = None
+
+    def feed_line(self, line: str, pid: Optional[int] = None):
+        key, sep, value = line.partition('=')
+        if not sep:
+            return
+        key = key.strip()
+        if key != 'progress':
+            self._block[key] = value.strip()
+            return
+
+        self._publish(self._block, value.strip())
+        self._block = {}
+        if pid is not None:
+            self.sample_process(pid)
+
+    def _publish(self, block: Dict[str, str], state: str):
+        out_time_us = parse_number(block.get('out_time_us', block.get('out_time_ms', '')))
+        snapshot = {
+            'frame': parse_number(block.get('frame', '')),
+            'fps': parse_number(block.get('fps', '')),
+            'speed': parse_number(block.get('speed', ''), 'x'),
+            'bitrate_kbps': parse_number(block.get('bitrate', ''), 'kbits/s'),
+            'total_size': parse_number(block.get('total_size', '')),
+            # out_time_ms is in microseconds too (a long-standing ffmpeg quirk)
+            'out_time_seconds': out_time_us / 1000000 if out_time_us is not None else None,
+            'dup_frames': parse_number(block.get('dup_frames', '')),
+            'drop_frames': parse_number(block.get('drop_frames', '')),
+            'progress': state
+        }
+        self.current = snapshot
+        self.updates += 1
+        self.updated_at = time.time()
+        if snapshot['speed'] is not None:
+            self.speeds.append(snapshot['speed'])
+        if snapshot['fps'] is not None:
+            self.fps_history.append(snapshot['fps'])
+
+    def sample_process(self, pid: int):
+        sample = read_process_times(pid)
+        if sample is None:
+            return
+        cpu_seconds, self.rss_bytes = sample
+        now = time.monotonic()
+        if self._last_cpu is not None and now > self._last_cpu[0]:
+            self.cpu_percent = 100 * (cpu_seconds - self._last_cpu[1]) / (now - self._last_cpu[0])
+        self._last_cpu = (now, cpu_seconds)
+
+    def to_dict(self) -> Dict:
+        return {
+            **self.current,
+            'avg_speed': sum(self.speeds) / len(self.speeds) if self.speeds else None,
+            'avg_fps': sum(self.fps_history) / len(self.fps_history) if self.fps_history else None,
+            'cpu_percent': round(self.cpu_percent, 1) if self.cpu_percent is not None else None,
+            'rss_bytes': self.rss_bytes,
+            'updates': self.updates,
+            'updated_at': self.updated_at
+        }
+
+PROMETHEUS_METRICS = [
+    ('fps', 'cryonix_stream_fps', 'gauge', 'Encoding frames per second'),
+    ('speed', 'cryonix_stream_speed', 'gauge', 'Encoding speed relative to realtime'),
+    ('bitrate_kbps', 'cryonix_stream_bitrate_kbps', 'gauge', 'Output bitrate in kbit/s'),
+    ('out_time_seconds', 'cryonix_stream_out_time_seconds', 'gauge', 'Output media time'),
+    ('frame', 'cryonix_stream_frames_total', 'counter', 'Frames encoded'),
+    ('dup_frames', 'cryonix_stream_dup_frames_total', 'counter', 'Duplicated frames'),
+    ('drop_frames', 'cryonix_stream_drop_frames_total', 'counter', 'Dropped frames'),
+    ('cpu_percent', 'cryonix_stream_cpu_percent', 'gauge', 'CPU usage of the ffmpeg process'),
+    ('rss_bytes', 'cryonix_stream_rss_bytes', 'gauge', 'Resident memory of the ffmpeg process'),
+    ('uptime', 'cryonix_stream_uptime_seconds', 'gauge', 'Seconds since the ffmpeg process started'),
+    ('time_to_first_output', 'cryonix_stream_time_to_first_output_seconds', 'gauge',
+     'Seconds from the start request to the first output bytes')
+]
+
+def render_prometheus(streams: Iterable[Tuple[str, Dict]]) -> str:
+    # streams: (stream_id, metrics dict) pairs in Prometheus text exposition format
+    streams = list(streams)
+    lines = [
+        '# HELP cryonix_streams_active Streams managed by this node',
+        '# TYPE cryonix_streams_active gauge',
+        f'cryonix_streams_active {len(streams)}'
+    ]
+    for key, name, kind, help_text in PROMETHEUS_METRICS:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for stream_id, metrics in streams:
+            value = metrics.get(key)
+            if value is not None:
+                lines.append(f'{name}{{stream_id="{escape_label(stream_id)}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -2,61 +2,223 @@
 
 import asyncio
 import logging
-from datetime import datetime
-from typing import Dict
+import random
+import time
+from typing import Dict, Optional
+
+from stream_process import StreamProcess
 
 logger = logging.getLogger(__name__)
 
+def exit_reason(process: StreamProcess) -> str:
+    if process.running:
+        return 'running'
+    code = process.returncode
+    if code is None:
+        # Adopted processes aren't our children: no exit status
+        return 'exited (exit code unknown)'
+    if code < 0:
+        return f'killed by signal {-code}'
+    return f'exited with code {code}'
+
+class SupervisionState:
+    def __init__(self, command):
+        self.command = command
+        self.restarts = 0
+        self.failures = 0  # consecutive, reset once a run stays up for the stable period
+        self.last_exit_reason: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_failure_at: Optional[float] = None
+        self.next_restart_at: Optional[float] = None
+        self.crash_looped = False
+        self.task: Optional[asyncio.Task] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'restarts': self.restarts,
+            'consecutive_failures': self.failures,
+            'last_exit_reason': self.last_exit_reason,
+            'last_error': self.last_error,
+            'last_failure_at': self.last_failure_at,
+            'next_restart_at': self.next_restart_at,
+            'crash_looped': self.crash_looped
+        }
+
+# Supervisor for the active streams. Exits and stalls (no progress output for
+# stall_timeout seconds) are restarted after a jittered exponential backoff;
+# a stream that keeps failing is given up on after max_restarts consecutive
+# failures, and the failure count resets once a run stays up for
+# stable_period. Restarts pass through a shared gate spaced restart_stagger
+# apart, so a dead upstream taking out every channel at once does not turn
+# into a burst of simultaneous ffmpeg spawns.
 class StreamMonitor:
-    def __init__(self, active_streams: Dict, check_interval: int = 30):
+    def __init__(self, active_streams: Dict[str, StreamProcess], check_interval: int = 30,
+                 backoff_base: float = 2, backoff_max: float = 300, max_restarts: int = 10,
+                 stable_period: float = 300, stall_timeout: float = 60, restart_stagger: float = 0.5,
+                 stop_timeout: float = 10, registry=None, spawn_timer=None, cluster=None, input_prober=None):
         self.active_streams = active_streams
         self.check_interval = check_interval
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.stable_period = stable_period
+        self.stall_timeout = stall_timeout
+        self.restart_stagger = restart_stagger
+        self.stop_timeout = stop_timeout
+        self.registry = registry
+        # Cluster scheduler (stream_cluster.StreamScheduler); a stream given up
+        # on no longer belongs to this node
+        self.cluster = cluster
+        # Cached probe results (input_probe.InputProber) go stale when an input fails
+        self.input_prober = input_prober
+        # Optional histogram (instrumentation.HistogramFamily) for restart spawn times
+        self.spawn_timer = spawn_timer
         self.running = False
-    
+
+        self.states: Dict[str, SupervisionState] = {}
+        self._gate: Optional[asyncio.Lock] = None
+        self._last_spawn = 0.0
+
     async def start(self):
         self.running = True
+        self._gate = asyncio.Lock()
         while self.running:
-            await self.check_streams()
+            try:
+                await self.check_streams()
+            except Exception as e:
+                logger.error(f"Stream check failed: {e!r}")
             await asyncio.sleep(self.check_interval)
-    
+
     async def stop(self):
         self.running = False
-    
+        for state in self.states.values():
+            if state.task:
+                state.task.cancel()
+
+    def state(self, stream_id: str) -> Optional[SupervisionState]:
+        return self.states.get(stream_id)
+
+    def restart_pending(self, stream_id: str) -> bool:
+        state = self.states.get(stream_id)
+        return state is not None and state.task is not None and not state.task.done()
+
+    def forget(self, stream_id: str):
+        # Called when a stream is stopped or started by hand
+        state = self.states.pop(stream_id, None)
+        if state and state.task:
+            state.task.cancel()
+
+    def crash_looped(self) -> Dict[str, SupervisionState]:
+        return {stream_id: state for stream_id, state in self.states.items() if state.crash_looped}
+
+    def stalled(self, process: StreamProcess) -> bool:
+        if not process.progress or not self.stall_timeout:
+            return False
+        if process.metrics.updated_at is not None:
+            return time.time() - process.metrics.updated_at > self.stall_timeout
+        return process.uptime > self.stall_timeout
+
     async def check_streams(self):
-        for stream_id, stream_data in list(self.active_streams.items()):
-            process = stream_data['process']
-            
+        for stream_id, process in list(self.active_streams.items()):
+            # Stopped by the API, or already waiting for its restart
+            if process.stopping or self.restart_pending(stream_id):
+                continue
+
+            state = self.states.get(stream_id)
+            if process.running:
+                process.sample()
+                if self.stalled(process):
+                    logger.warning(f"Stream {stream_id} stalled: no progress for {self.stall_timeout}s")
+                    self.schedule_restart(stream_id, process, 'stalled')
+                elif state and state.failures and process.uptime >= self.stable_period:
+                    logger.info(f"Stream {stream_id} stable again after {state.failures} failures")
+                    state.failures = 0
+                continue
+
             # Check if process is still running
-            if process.poll() is not None:
-                logger.warning(f"Stream {stream_id} has stopped unexpectedly")
-                
-                # Get error output
-                error_output = process.stderr.read().decode()
-                logger.error(f"Stream {stream_id} error: {error_output}")
-                
-                # Remove from active streams
+            reason = exit_reason(process)
+            logger.warning(f"Stream {stream_id} has stopped unexpectedly ({reason})")
+            logger.error(f"Stream {stream_id} error: {process.error()}")
+            self.schedule_restart(stream_id, process, reason)
+
+    def backoff(self, failures: int) -> float:
+        # Exponential step with +-50% jitter so failed streams spread out
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def schedule_restart(self, stream_id: str, process: StreamProcess, reason: str):
+        state = self.states.setdefault(stream_id, SupervisionState(process.command))
+        state.command = process.command
+        state.failures += 1
+        state.last_exit_reason = reason
+        state.last_error = process.error(3) or None
+        state.last_failure_at = time.time()
+        if self.input_prober and process.input_url:
+            # The upstream may have changed (or died): the next start probes it again
+            self.input_prober.invalidate(process.input_url)
+
+        if state.failures > self.max_restarts:
+            logger.error(f"Stream {stream_id} is crash-looping ({state.failures} consecutive failures), giving up")
+            state.crash_looped = True
+            state.next_restart_at = None
+            if self.active_streams.get(stream_id) is process:
                 del self.active_streams[stream_id]
-                
-                # Here you could implement auto-restart logic
-                # await self.restart_stream(stream_id, stream_data)
-    
-    async def restart_stream(self, stream_id: str, stream_data: dict):
+            if process.running:
+                # Gave up on a stalled process: don't leave it behind
+                state.task = asyncio.create_task(process.stop(self.stop_timeout))
+            if self.registry:
+                asyncio.create_task(self.registry.remove(stream_id))
+            if self.cluster:
+                asyncio.create_task(self.release(stream_id))
+            return
+
+        delay = self.backoff(state.failures)
+        state.next_restart_at = time.time() + delay
+        logger.info(f"Restarting stream {stream_id} in {delay:.1f}s (failure {state.failures})")
+        state.task = asyncio.create_task(self._delayed_restart(stream_id, process, delay))
+
+    async def release(self, stream_id: str):
         try:
-            command = stream_data['command']
-            process = await asyncio.create_subprocess_exec(
-                *command,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            
-            self.active_streams[stream_id] = {
-                'process': process,
-                'start_time': datetime.now(),
-                'command': command,
-                'restarts': stream_data.get('restarts', 0) + 1
-            }
-            
+            await self.cluster.release(stream_id)
+        except Exception as e:
+            logger.error(f"Failed to release cluster ownership of stream {stream_id}: {e!r}")
+
+    async def _delayed_restart(self, stream_id: str, process: StreamProcess, delay: float):
+        if process.running:
+            # Stalled: kill the hung process before backing off
+            await process.stop(self.stop_timeout)
+        await asyncio.sleep(delay)
+        async with self._gate:
+            wait = self._last_spawn + self.restart_stagger - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            # Stopped or replaced through the API while we were waiting
+            if self.active_streams.get(stream_id) is not process:
+                return
+            await self.restart_stream(stream_id, process)
+            self._last_spawn = time.monotonic()
+
+    async def restart_stream(self, stream_id: str, old_process: StreamProcess):
+        state = self.states.get(stream_id)
+        try:
+            process = old_process.clone()
+            spawn_started = time.perf_counter()
+            await process.start()
+            if self.spawn_timer:
+                self.spawn_timer.observe(time.perf_counter() - spawn_started, trigger='restart')
+
+            self.active_streams[stream_id] = process
+            if self.registry:
+                await self.registry.save(process)
+            if state:
+                state.restarts += 1
+                state.next_restart_at = None
+
             logger.info(f"Restarted stream {stream_id}")
-            
+
         except Exception as e:
             logger.error(f"Failed to restart stream {stream_id}: {str(e)}")
+            # Spawn failures count against the crash-loop cap like exits do
+            if state:
+                state.task = None
+            self.schedule_restart(stream_id, old_process, f'restart failed: {e}')
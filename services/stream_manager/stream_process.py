@@ -0,0 +1,308 @@
+# File: cryonix/services/stream_manager/stream_process.py
+
+import asyncio
+import logging
+import os
+import re
+import signal
+import subprocess
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from stream_metrics import StreamMetrics
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg terminates its status line with \r and everything else with \n
+LINE_SPLIT = re.compile(rb'[\r\n]+')
+READ_SIZE = 4096
+MAX_LINE_LENGTH = 4096
+
+# One supervised ffmpeg process. stderr is drained continuously by a reader
+# task into a bounded ring buffer of recent lines, so a chatty process can
+# never fill the pipe and stall, and status/errors are answered from memory
+# without touching the pipe on the event loop. With progress enabled the
+# command writes ffmpeg's -progress feed to stdout, which a second reader
+# turns into rolling metrics.
+class StreamProcess:
+    def __init__(self, stream_id: str, command: List[str], log_lines: int = 200, progress: bool = False,
+                 renditions: Optional[List[Dict]] = None):
+        self.stream_id = stream_id
+        self.command = command
+        self.progress = progress
+        self.renditions = renditions  # sub-streams sharing this process in multi-rendition mode
+        self.metrics = StreamMetrics()
+        self.lines = deque(maxlen=log_lines)
+        self.lines_read = 0
+        self.process: Optional[subprocess.Popen] = None
+        self.start_time: Optional[datetime] = None
+        self.started_at = 0.0
+        self.exited_at: Optional[float] = None
+        self.stopping = False
+        # Start request timings (probe, queue, spawn); the clock for the
+        # time to first output starts at requested_at, or at spawn if unset
+        self.requested_at: Optional[float] = None
+        self.timings: Dict[str, float] = {}
+        self.first_output_at: Optional[float] = None
+        # Copy/transcode decision the command was built with
+        self.remux: Optional[Dict] = None
+        # Set on the first progress report (or exit): the stream is past startup
+        self.ready = asyncio.Event()
+        self._reader: Optional[asyncio.Task] = None
+        self._progress_reader: Optional[asyncio.Task] = None
+
+    @staticmethod
+    async def _pipe_reader(pipe) -> asyncio.StreamReader:
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        return reader
+
+    async def start(self):
+        # Plain Popen with its pipes attached to the event loop, rather than
+        # asyncio's subprocess transport, which kills children that are still
+        # running when the loop goes away. New session (setsid) so the whole
+        # process group can be signalled. restore_signals=False on purpose:
+        # the child inherits the manager's ignored SIGPIPE (Python ignores it
+        # at startup), so when the manager exits and the stderr/progress
+        # pipes close, ffmpeg's next log write fails with EPIPE instead of
+        # killing it. ffmpeg ignores SIGPIPE itself anyway (term_init), so
+        # its handling of broken output pipes is the same either way. Both
+        # let the streams survive a manager restart and be re-adopted.
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE if self.progress else subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            start_new_session=True,
+            restore_signals=False
+        )
+        self.start_time = datetime.now()
+        self.started_at = time.monotonic()
+        stderr = await self._pipe_reader(self.process.stderr)
+        self._reader = asyncio.create_task(self._read_stderr(stderr))
+        if self.progress:
+            stdout = await self._pipe_reader(self.process.stdout)
+            self._progress_reader = asyncio.create_task(self._read_progress(stdout))
+        else:
+            self.ready.set()
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.process.pid if self.process else None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self.process.returncode if self.process else None
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def input_url(self) -> Optional[str]:
+        # The argument after -i; every command has exactly one input
+        try:
+            return self.command[self.command.index('-i') + 1]
+        except (ValueError, IndexError):
+            return None
+
+    @property
+    def uptime(self) -> float:
+        end = self.exited_at if self.exited_at is not None else time.monotonic()
+        return end - self.started_at if self.start_time else 0.0
+
+    @property
+    def time_to_first_output(self) -> Optional[float]:
+        if self.first_output_at is None:
+            return None
+        return self.first_output_at - (self.requested_at if self.requested_at is not None else self.started_at)
+
+    def startup(self) -> Dict:
+        first_output = self.time_to_first_output
+        return {**self.timings, 'time_to_first_output': round(first_output, 3) if first_output is not None else None}
+
+    def _append(self, line: bytes):
+        if line:
+            self.lines.append(line[:MAX_LINE_LENGTH].decode('utf-8', 'replace'))
+            self.lines_read += 1
+
+    async def _read_stderr(self, stream: asyncio.StreamReader):
+        pending = b''
+        try:
+            while True:
+                chunk = await stream.read(READ_SIZE)
+                if not chunk:
+                    break
+                parts = LINE_SPLIT.split(pending + chunk)
+                pending = parts.pop()
+                for line in parts:
+                    self._append(line)
+                if len(pending) > MAX_LINE_LENGTH:
+                    self._append(pending)
+                    pending = b''
+            self._append(pending)
+        except Exception as e:
+            logger.error(f"stderr reader for stream {self.stream_id} failed: {e!r}")
+
+        # stderr only closes when ffmpeg exits, so this reap is immediate.
+        # Not reached on cancellation: a detached process keeps running.
+        await asyncio.get_running_loop().run_in_executor(None, self.process.wait)
+        self.exited_at = time.monotonic()
+        self.ready.set()
+
+    async def _read_progress(self, stream: asyncio.StreamReader):
+        try:
+            while True:
+                line = await stream.readline()
+                if not line:
+                    return
+                self.metrics.feed_line(line.decode('utf-8', 'replace'), self.process.pid)
+                if self.metrics.updates and not self.ready.is_set():
+                    self.ready.set()
+                if self.first_output_at is None and (self.metrics.current.get('total_size') or 0) > 0:
+                    # First bytes muxed to the output(s): the first segment is on its way out
+                    self.first_output_at = time.monotonic()
+                    logger.info(f"Stream {self.stream_id} first output after {self.time_to_first_output:.2f}s")
+        except Exception as e:
+            logger.error(f"progress reader for stream {self.stream_id} failed: {e!r}")
+
+    async def wait(self) -> int:
+        if self._reader:
+            await asyncio.shield(self._reader)
+        return self.process.returncode
+
+    def signal(self, sig: int):
+        try:
+            os.killpg(self.process.pid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def stop(self, timeout: float = 10) -> Optional[int]:
+        if self.process is None:
+            return None
+        self.stopping = True
+        if self.running:
+            self.signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stream {self.stream_id} ignored SIGTERM, killing")
+                self.signal(signal.SIGKILL)
+        return await self.wait()
+
+    def sample(self):
+        # CPU/RSS are sampled on every progress report; adopted processes poll instead
+        pass
+
+    def clone(self) -> 'StreamProcess':
+        # Fresh, not yet started process with the same configuration
+        process = StreamProcess(self.stream_id, self.command, self.lines.maxlen, self.progress, self.renditions)
+        process.remux = self.remux
+        return process
+
+    def recent_output(self, lines: Optional[int] = None) -> List[str]:
+        output = list(self.lines)
+        return output[-lines:] if lines else output
+
+    def error(self, lines: int = 20) -> str:
+        return '\n'.join(self.recent_output(lines))
+
+    def to_dict(self) -> Dict:
+        return {
+            'stream_id': self.stream_id,
+            'pid': self.pid,
+            'running': self.running,
+            'returncode': self.returncode,
+            'uptime': self.uptime,
+            'command': self.command,
+            'renditions': self.renditions,
+            'startup': self.startup(),
+            'remux': self.remux,
+            'metrics': self.metrics.to_dict()
+        }
+
+def read_cmdline(pid: int) -> Optional[List[str]]:
+    try:
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    return [arg.decode('utf-8', 'surrogateescape') for arg in data.split(b'\0')[:-1]]
+
+def process_matches(pid: int, pgid: int, command: List[str]) -> bool:
+    # Guards against pid reuse: same pid, same process group, same argv
+    try:
+        if os.getpgid(pid) != pgid:
+            return False
+    except ProcessLookupError:
+        return False
+    return read_cmdline(pid) == command
+
+# An ffmpeg started by a previous manager instance and found alive on
+# startup. It is not our child and its log pipes died with the old
+# instance, so liveness comes from /proc, stderr/progress aren't captured
+# (no stall detection) and the exit code is unknown. CPU/RSS are still
+# sampled. A supervised restart replaces it with a regular StreamProcess.
+class AdoptedProcess(StreamProcess):
+    def __init__(self, stream_id: str, command: List[str], pid: int, pgid: int, started: float,
+                 log_lines: int = 200, progress: bool = False, renditions: Optional[List[Dict]] = None):
+        super().__init__(stream_id, command, log_lines, False, renditions)
+        self.spawn_progress = progress
+        self.adopted_pid = pid
+        self.pgid = pgid
+        self.start_time = datetime.fromtimestamp(started)
+        self.started_at = time.monotonic() - max(0.0, time.time() - started)
+        self.lines.append('adopted after a stream manager restart; output of this run is not captured')
+        self.ready.set()
+        self._alive = True
+        self._last_sample = 0.0
+
+    @property
+    def pid(self) -> Optional[int]:
+        return self.adopted_pid
+
+    @property
+    def running(self) -> bool:
+        if self._alive and not process_matches(self.adopted_pid, self.pgid, self.command):
+            self._alive = False
+            self.exited_at = time.monotonic()
+        return self._alive
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return None
+
+    def sample(self):
+        now = time.monotonic()
+        if now - self._last_sample >= 1 and self.running:
+            self._last_sample = now
+            self.metrics.sample_process(self.adopted_pid)
+
+    async def wait(self) -> Optional[int]:
+        while self.running:
+            await asyncio.sleep(0.2)
+        return None
+
+    def signal(self, sig: int):
+        try:
+            os.killpg(self.pgid, sig)
+        except ProcessLookupError:
+            pass
+
+    async def stop(self, timeout: float = 10) -> Optional[int]:
+        self.stopping = True
+        if self.running:
+            self.signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.wait(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Stream {self.stream_id} ignored SIGTERM, killing")
+                self.signal(signal.SIGKILL)
+                await self.wait()
+        return None
+
+    def clone(self) -> StreamProcess:
+        return StreamProcess(self.stream_id, self.command, self.lines.maxlen, self.spawn_progress, self.renditions)
@@ -0,0 +1,131 @@
+# File: cryonix/services/stream_manager/stream_registry.py
+
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from stream_process import AdoptedProcess, StreamProcess, process_matches
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    stream_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    pgid INTEGER NOT NULL,
+    command TEXT NOT NULL,
+    started REAL NOT NULL,
+    progress INTEGER NOT NULL,
+    renditions TEXT,
+    updated REAL NOT NULL DEFAULT (strftime('%s', 'now'))
+)
+"""
+
+# On-disk record of the streams this node should be running, so a restart
+# of the manager can re-adopt its ffmpeg processes instead of killing or
+# orphaning them. SQLite calls run on a single worker thread, which keeps
+# them off the event loop and in submission order.
+class StreamRegistry:
+    def __init__(self, path: str):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='stream-registry')
+        self._db: Optional[sqlite3.Connection] = None
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(SCHEMA)
+        self._db.commit()
+
+    async def open(self):
+        await self._run(self._open)
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    def _save(self, row: tuple):
+        self._db.execute("""
+            INSERT OR REPLACE INTO streams (stream_id, pid, pgid, command, started, progress, renditions, updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, strftime('%s', 'now'))
+        """, row)
+        self._db.commit()
+
+    async def save(self, process: StreamProcess):
+        if self._db is None:
+            return
+        progress = getattr(process, 'spawn_progress', process.progress)
+        # Our processes lead their own session, so pgid == pid
+        pgid = getattr(process, 'pgid', process.pid)
+        row = (
+            process.stream_id, process.pid, pgid,
+            json.dumps(process.command), process.start_time.timestamp(), int(progress),
+            json.dumps(process.renditions) if process.renditions else None
+        )
+        try:
+            await self._run(self._save, row)
+        except sqlite3.Error as e:
+            logger.error(f"Could not record stream {process.stream_id} in the registry: {e!r}")
+
+    def _remove(self, stream_id: str):
+        self._db.execute("DELETE FROM streams WHERE stream_id = ?", (stream_id,))
+        self._db.commit()
+
+    async def remove(self, stream_id: str):
+        if self._db is None:
+            return
+        try:
+            await self._run(self._remove, stream_id)
+        except sqlite3.Error as e:
+            logger.error(f"Could not remove stream {stream_id} from the registry: {e!r}")
+
+    def _load(self) -> List[Dict]:
+        cursor = self._db.execute(
+            "SELECT stream_id, pid, pgid, command, started, progress, renditions FROM streams ORDER BY started"
+        )
+        return [
+            {
+                'stream_id': stream_id,
+                'pid': pid,
+                'pgid': pgid,
+                'command': json.loads(command),
+                'started': started,
+                'progress': bool(progress),
+                'renditions': json.loads(renditions) if renditions else None
+            }
+            for stream_id, pid, pgid, command, started, progress, renditions in cursor.fetchall()
+        ]
+
+    async def load(self) -> List[Dict]:
+        return await self._run(self._load)
+
+    async def recover(self, log_lines: int = 200) -> Tuple[List[AdoptedProcess], List[StreamProcess]]:
+        # Splits the recorded streams into live processes to adopt and dead
+        # ones to spawn again, verified against /proc so a reused pid is
+        # never mistaken for our ffmpeg
+        adopted: List[AdoptedProcess] = []
+        dead: List[StreamProcess] = []
+        for record in await self.load():
+            if process_matches(record['pid'], record['pgid'], record['command']):
+                adopted.append(AdoptedProcess(
+                    record['stream_id'], record['command'], record['pid'], record['pgid'], record['started'],
+                    log_lines, record['progress'], record['renditions']
+                ))
+            else:
+                dead.append(StreamProcess(
+                    record['stream_id'], record['command'], log_lines, record['progress'], record['renditions']
+                ))
+        return adopted, dead
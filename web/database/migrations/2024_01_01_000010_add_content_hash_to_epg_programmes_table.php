@@ -0,0 +1,26 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    public function up()
+    {
+        Schema::table('epg_programmes', function (Blueprint $table) {
+            // Fingerprint of title/description/category used by incremental EPG sync
+            $table->char('content_hash', 32)->nullable()->after('category');
+            
+            $table->index(['source_id', 'channel_id', 'start_time']);
+        });
+    }
+
+    public function down()
+    {
+        Schema::table('epg_programmes', function (Blueprint $table) {
+            $table->dropIndex(['source_id', 'channel_id', 'start_time']);
+            $table->dropColumn('content_hash');
+        });
+    }
+};
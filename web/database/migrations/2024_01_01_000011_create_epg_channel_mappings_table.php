@@ -0,0 +1,31 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    public function up()
+    {
+        // Which EPG channel each live stream shows. Automatic rows are rewritten
+        // by the EPG service after every sync; manual rows are overrides it never
+        // touches, and a manual row without a channel means "no EPG".
+        Schema::create('epg_channel_mappings', function (Blueprint $table) {
+            $table->id();
+            $table->foreignId('stream_id')->unique()->constrained('streams')->onDelete('cascade');
+            $table->foreignId('source_id')->nullable()->constrained('epg_sources')->onDelete('cascade');
+            $table->string('channel_id')->nullable();
+            $table->enum('match_type', ['exact', 'fuzzy', 'manual']);
+            $table->float('score')->default(1);
+            $table->timestamps();
+
+            $table->index(['source_id', 'channel_id']);
+        });
+    }
+
+    public function down()
+    {
+        Schema::dropIfExists('epg_channel_mappings');
+    }
+};
@@ -0,0 +1,45 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    public function up()
+    {
+        // A full EPG sync writes the next generation of a source's rows and
+        // switches epg_sources.generation over when it is complete; only rows
+        // of the source's current generation are visible.
+        Schema::table('epg_sources', function (Blueprint $table) {
+            $table->unsignedInteger('generation')->default(0)->after('is_active');
+        });
+
+        Schema::table('epg_channels', function (Blueprint $table) {
+            $table->unsignedInteger('generation')->default(0)->after('icon');
+            $table->index(['source_id', 'generation']);
+        });
+
+        Schema::table('epg_programmes', function (Blueprint $table) {
+            $table->unsignedInteger('generation')->default(0)->after('content_hash');
+            $table->index(['source_id', 'generation']);
+        });
+    }
+
+    public function down()
+    {
+        Schema::table('epg_programmes', function (Blueprint $table) {
+            $table->dropIndex(['source_id', 'generation']);
+            $table->dropColumn('generation');
+        });
+
+        Schema::table('epg_channels', function (Blueprint $table) {
+            $table->dropIndex(['source_id', 'generation']);
+            $table->dropColumn('generation');
+        });
+
+        Schema::table('epg_sources', function (Blueprint $table) {
+            $table->dropColumn('generation');
+        });
+    }
+};